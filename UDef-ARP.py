@@ -1,13 +1,14 @@
 import sys
 import os
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import Qt,QUrl
+from PyQt5.QtCore import Qt,QUrl,QObject,pyqtSignal
 from PyQt5.QtWidgets import QDialog, QFileDialog, QMessageBox, QProgressDialog, QApplication, QWidget, QPushButton,QTextEdit,QSizePolicy
 from PyQt5.QtGui import QFontDatabase, QIcon, QFont, QDesktopServices
 from PyQt5.uic import loadUi
 from allocation_tool import AllocationTool
 from vulnerability_map import VulnerabilityMap
 from model_evaluation import ModelEvaluation
+from map_checker import MapChecker
 from osgeo import gdal
 from pathlib import Path, PureWindowsPath
 import numpy as np
@@ -16,6 +17,16 @@ import traceback
 # GDAL exceptions
 gdal.UseExceptions()
 
+class QtProgressAdapter(QObject):
+    '''
+    Forward the progress callbacks of an engine as a Qt signal for the progress dialogs
+    '''
+    progress_updated = pyqtSignal(int)
+
+    def __init__(self, engine):
+        super(QtProgressAdapter, self).__init__()
+        engine.progress_updated.connect(self.progress_updated.emit)
+
 class IntroScreen(QDialog):
     def __init__(self):
         super(IntroScreen, self).__init__()
@@ -100,7 +111,8 @@ class RMT_FIT_CAL_SCREEN(QDialog):
         self.ok_button2_2.clicked.connect(self.process_data2_2)
 
         self.vulnerability_map = VulnerabilityMap()
-        self.vulnerability_map.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.vulnerability_map)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.in_fn = None
         self.deforestation_hrp = None
@@ -388,8 +400,8 @@ class RMT_FIT_CAL_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory)
-            mask_arr = self.vulnerability_map.geometric_classification(self.in_fn, NRT, n_classes, self.mask)
-            self.vulnerability_map.array_to_image(self.in_fn, out_fn, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_streaming(self.in_fn, NRT, n_classes, self.mask, out_fn,
+                                                                      gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn, out_fn)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -503,8 +515,9 @@ class RMT_FIT_CAL_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory_2)
-            mask_arr = self.vulnerability_map.geometric_classification_alternative(self.in_fn_2, n_classes_2, self.mask_2, self.fmask_2)
-            self.vulnerability_map.array_to_image(self.in_fn_2, out_fn_2, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_alternative_streaming(self.in_fn_2, n_classes_2, self.mask_2,
+                                                                                  self.fmask_2, out_fn_2,
+                                                                                  gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn_2, out_fn_2)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -564,7 +577,8 @@ class AT_FIT_CAL_Screen(QDialog):
         self.ok_button3.clicked.connect(self.process_data3)
         self.allocation_tool = AllocationTool()
         # Connect the progress_updated signal to the update_progress method
-        self.allocation_tool.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.allocation_tool)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.risk30_hrp = None
         self.municipality = None
@@ -782,7 +796,8 @@ class MCT_FIT_CAL_Screen(QDialog):
         self.density_button.clicked.connect(self.select_density)
         self.ok_button.clicked.connect(self.process_data4)
         self.model_evaluation = ModelEvaluation()
-        self.model_evaluation.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.model_evaluation)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.mask = None
         self.deforestation_hrp = None
@@ -1065,7 +1080,8 @@ class RMT_PRE_CNF_SCREEN(QDialog):
         self.ok_button2_2.clicked.connect(self.process_data2_2)
 
         self.vulnerability_map = VulnerabilityMap()
-        self.vulnerability_map.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.vulnerability_map)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.in_fn = None
         self.NRT = None
@@ -1243,8 +1259,8 @@ class RMT_PRE_CNF_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory)
-            mask_arr = self.vulnerability_map.geometric_classification(self.in_fn, NRT, n_classes, self.mask)
-            self.vulnerability_map.array_to_image(self.in_fn, out_fn, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_streaming(self.in_fn, NRT, n_classes, self.mask, out_fn,
+                                                                      gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn, out_fn)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -1356,9 +1372,9 @@ class RMT_PRE_CNF_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory_2)
-            mask_arr = self.vulnerability_map.geometric_classification_alternative(self.in_fn_2, n_classes_2,
-                                                                                   self.mask_2, self.fmask_2)
-            self.vulnerability_map.array_to_image(self.in_fn_2, out_fn_2, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_alternative_streaming(self.in_fn_2, n_classes_2, self.mask_2,
+                                                                                  self.fmask_2, out_fn_2,
+                                                                                  gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn_2, out_fn_2)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -1418,20 +1434,19 @@ class AT_PRE_CNF_Screen(QDialog):
         self.deforestation_cnf_button.clicked.connect(self.select_deforestation_cnf)
         self.ok_button3.clicked.connect(self.process_data3)
         self.allocation_tool = AllocationTool()
-        self.allocation_tool.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.allocation_tool)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.csv = None
         self.municipality = None
         self.risk30_vp = None
         self.deforestation_cnf = None
-        self.max_iterations = None
         self.image1 = None
         self.image2 = None
         self.file_path_directory = None
         self.file_path1_directory = None
         self.file_path2_directory = None
         self.file_path3_directory = None
-        self.iteration_entry.setPlaceholderText('The suggestion max iteration number is 5')
         self.image1_entry.setPlaceholderText('e.g., Acre_Prediction_Modeling_Region_CNF.tif')
         self.image2_entry.setPlaceholderText('e.g., Acre_Adjucted_Density_Map_CNF.tif')
         self.setWindowTitle("JNR Integrated Risk/Allocation Tool")
@@ -1557,16 +1572,6 @@ class AT_PRE_CNF_Screen(QDialog):
                                  "Please enter .rst or .tif extension in the name of Adjusted Prediction Density Map in CNF!")
             return
 
-        max_iterations = self.iteration_entry.text()
-        if not max_iterations:
-            QMessageBox.critical(self, "Error", "Please enter the max iterations! The suggestion number is 5.")
-            return
-        try:
-            self.max_iterations = int(max_iterations)
-        except ValueError:
-            QMessageBox.critical(self, "Error", "Max iteration value should be a valid number!")
-            return
-
         if not map_checker.check_binary_map(self.deforestation_cnf):
             QMessageBox.critical(None, "Error",
                                  "'MAP OF DEFORESTATION IN THE CNF' must be a binary map (0 and 1) where the 1’s indicate deforestation.")
@@ -1589,18 +1594,14 @@ class AT_PRE_CNF_Screen(QDialog):
         QApplication.processEvents()
 
         try:
-            id_difference,iteration_count = self.allocation_tool.execute_workflow_cnf(directory,
-                                                            self.max_iterations, self.csv,
-                                                            self.municipality,
-                                                            self.deforestation_cnf,
-                                                            self.risk30_vp, out_fn1,
-                                                            out_fn2)
+            id_difference, _ = self.allocation_tool.execute_workflow_cnf(directory, None, self.csv,
+                                                                         self.municipality,
+                                                                         self.deforestation_cnf,
+                                                                         self.risk30_vp, out_fn1,
+                                                                         out_fn2)
             if id_difference.size > 0:
                 QMessageBox.warning(self, " Warning ", f"Modeling Region ID {','.join(map(str, id_difference))} do not exist in the Calculation Period. A new CSV has been created for the CAL where relative frequencies for missing bins have been estimated from corresponding vulnerability zones over the entire jurisdiction.")
-            if iteration_count > int(max_iterations):
-                QMessageBox.warning(self, " Warning ", f"Maximum iterations limit reached. Please increase the Maximum Iterations and try running the tool again.")
-            else:
-                QMessageBox.information(self, "Processing Completed", "Processing completed!")
+            QMessageBox.information(self, "Processing Completed", "Processing completed!")
             self.progressDialog.close()
 
         except Exception:
@@ -1658,7 +1659,8 @@ class MCT_PRE_CNF_Screen(QDialog):
         self.density_button.clicked.connect(self.select_density)
         self.ok_button.clicked.connect(self.process_data4)
         self.model_evaluation = ModelEvaluation()
-        self.model_evaluation.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.model_evaluation)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.mask = None
         self.fmask = None
@@ -1990,7 +1992,8 @@ class RMT_FIT_HRP_SCREEN(QDialog):
         self.ok_button2_2.clicked.connect(self.process_data2_2)
 
         self.vulnerability_map = VulnerabilityMap()
-        self.vulnerability_map.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.vulnerability_map)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.in_fn = None
         self.NRT = None
@@ -2162,8 +2165,8 @@ class RMT_FIT_HRP_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory)
-            mask_arr = self.vulnerability_map.geometric_classification(self.in_fn, NRT, n_classes, self.mask)
-            self.vulnerability_map.array_to_image(self.in_fn, out_fn, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_streaming(self.in_fn, NRT, n_classes, self.mask, out_fn,
+                                                                      gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn, out_fn)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -2276,9 +2279,9 @@ class RMT_FIT_HRP_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory_2)
-            mask_arr = self.vulnerability_map.geometric_classification_alternative(self.in_fn_2, n_classes_2,
-                                                                                   self.mask_2, self.fmask_2)
-            self.vulnerability_map.array_to_image(self.in_fn_2, out_fn_2, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_alternative_streaming(self.in_fn_2, n_classes_2, self.mask_2,
+                                                                                  self.fmask_2, out_fn_2,
+                                                                                  gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn_2, out_fn_2)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -2336,7 +2339,8 @@ class AT_FIT_HRP_Screen(QDialog):
         self.deforestation_hrp_button.clicked.connect(self.select_deforestation_hrp)
         self.ok_button3.clicked.connect(self.process_data3)
         self.allocation_tool = AllocationTool()
-        self.allocation_tool.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.allocation_tool)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.risk30_hrp = None
         self.municipality = None
@@ -2571,7 +2575,8 @@ class RMT_PRE_VP_SCREEN(QDialog):
         self.ok_button2_2.clicked.connect(self.process_data2_2)
 
         self.vulnerability_map = VulnerabilityMap()
-        self.vulnerability_map.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.vulnerability_map)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.in_fn = None
         self.NRT = None
@@ -2745,8 +2750,8 @@ class RMT_PRE_VP_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory)
-            mask_arr = self.vulnerability_map.geometric_classification(self.in_fn, NRT, n_classes, self.mask)
-            self.vulnerability_map.array_to_image(self.in_fn, out_fn, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_streaming(self.in_fn, NRT, n_classes, self.mask, out_fn,
+                                                                      gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn, out_fn)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -2859,9 +2864,9 @@ class RMT_PRE_VP_SCREEN(QDialog):
 
         try:
             self.vulnerability_map.set_working_directory(directory_2)
-            mask_arr = self.vulnerability_map.geometric_classification_alternative(self.in_fn_2, n_classes_2,
-                                                                                   self.mask_2, self.fmask_2)
-            self.vulnerability_map.array_to_image(self.in_fn_2, out_fn_2, mask_arr, gdal.GDT_Int16, -1)
+            self.vulnerability_map.geometric_classification_alternative_streaming(self.in_fn_2, n_classes_2, self.mask_2,
+                                                                                  self.fmask_2, out_fn_2,
+                                                                                  gdal.GDT_Int16, -1)
             self.vulnerability_map.replace_ref_system(self.in_fn_2, out_fn_2)
 
             QMessageBox.information(self, "Processing Completed", "Processing completed!")
@@ -2920,19 +2925,18 @@ class AT_PRE_VP_Screen(QDialog):
         self.ok_button3.clicked.connect(self.process_data3)
         self.allocation_tool = AllocationTool()
         # Connect the progress_updated signal to the update_progress method
-        self.allocation_tool.progress_updated.connect(self.update_progress)
+        self.progress_adapter = QtProgressAdapter(self.allocation_tool)
+        self.progress_adapter.progress_updated.connect(self.update_progress)
         self.directory = None
         self.csv = None
         self.municipality = None
         self.risk30_vp = None
         self.expected_deforestation = None
-        self.max_iterations = None
         self.image1 = None
         self.image2 = None
         self.file_path_directory = None
         self.file_path1_directory = None
         self.file_path2_directory = None
-        self.iteration_entry.setPlaceholderText('The suggestion max iteration number is 5')
         self.image1_entry.setPlaceholderText('e.g., Acre_Prediction_Modeling_Region_VP.tif')
         self.image2_entry.setPlaceholderText('e.g., Acre_Adjucted_Density_Map_VP.tif')
         self.setWindowTitle("JNR Integrated Risk/Allocation Tool")
@@ -3051,16 +3055,6 @@ class AT_PRE_VP_Screen(QDialog):
                                  "Please enter .rst or .tif extension in the name of Adjusted Prediction Density Map in VP!")
             return
 
-        max_iterations = self.iteration_entry.text()
-        if not max_iterations:
-            QMessageBox.critical(self, "Error", "Please enter the max iterations! The suggestion number is 5.")
-            return
-        try:
-            self.max_iterations = int(max_iterations)
-        except ValueError:
-            QMessageBox.critical(self, "Error", "Max iteration value should be a valid number!")
-            return
-
         # Show "Processing" message
         processing_message = "Processing data..."
         self.progressDialog = QProgressDialog(processing_message, None, 0, 100, self)
@@ -3078,19 +3072,14 @@ class AT_PRE_VP_Screen(QDialog):
         QApplication.processEvents()
 
         try:
-            id_difference,iteration_count = self.allocation_tool.execute_workflow_vp(directory, self.max_iterations,
-                                                                           self.csv,
-                                                                           self.municipality,
-                                                                           self.expected_deforestation,
-                                                                           self.risk30_vp, out_fn1,out_fn2)
+            id_difference, _ = self.allocation_tool.execute_workflow_vp(directory, None, self.csv,
+                                                                        self.municipality,
+                                                                        self.expected_deforestation,
+                                                                        self.risk30_vp, out_fn1,out_fn2)
 
             if id_difference.size > 0:
                 QMessageBox.warning(self, " Warning ", f"Modeling Region ID {','.join(map(str, id_difference))} do not exist in the Historical Reference Period. A new CSV has been created for the HRP where relative frequencies for missing bins have been estimated from corresponding vulnerability zones over the entire jurisdiction.")
-            if iteration_count > int(max_iterations):
-                QMessageBox.warning(self, " Warning ",
-                                    f"Maximum iterations limit reached. Please increase the Maximum Iterations and try running the tool again.")
-            else:
-                QMessageBox.information(self, "Processing Completed", "Processing completed!")
+            QMessageBox.information(self, "Processing Completed", "Processing completed!")
             self.progressDialog.close()
 
         except Exception:
@@ -3132,78 +3121,6 @@ class CentralDataStore:
         self.NRT = None
         self.directory = None
 
-class MapChecker:
-    def __init__(self):
-        self.image=None
-        self.arr=None
-        self.in_fn=None
-
-    def get_image_resolution(self,image):
-        in_ds = gdal.Open(image)
-        P = in_ds.GetGeoTransform()[1]
-        return P
-
-    def get_image_dimensions(self, image):
-        dataset = gdal.Open(image)
-        cols = dataset.RasterXSize
-        rows = dataset.RasterYSize
-        return rows, cols
-
-    def get_image_datatype(self, image):
-        in_ds = gdal.Open(image)
-        in_band = in_ds.GetRasterBand(1)
-        datatype = gdal.GetDataTypeName(in_band.DataType)
-        return datatype
-
-    def get_image_max_min(self, image):
-        in_ds = gdal.Open(image)
-        in_band = in_ds.GetRasterBand(1)
-        min, max= in_band.ComputeRasterMinMax()
-        return min, max
-
-    def find_unique_values(self, arr, limit=2):
-        unique_values = set()
-        for value in np.nditer(arr):
-            unique_values.add(value.item())
-            if len(unique_values) > limit:
-                return False
-        return True
-
-    def check_binary_map(self, in_fn):
-        '''
-        Check if input image is binary map
-        :param in_fn: input image
-        :return: True if the file is a binary map, False otherwise
-        '''
-        file_extension = in_fn.split('.')[-1].lower()
-        file_name, _ = os.path.splitext(in_fn)
-        if file_extension == 'rst':
-            with open(file_name + '.rdc', 'r') as read_file:
-                rdc_content = read_file.read().lower()
-                byte_or_integer_binary = "data type   : byte" in rdc_content or (
-                        "data type   : integer" in rdc_content and "min. value  : 0" in rdc_content and "max. value  : 1" in rdc_content)
-                float_binary = "data type   : real" in rdc_content and "min. value  : 0.0000000" in rdc_content and "max. value  : 1.0000000" in rdc_content
-        elif file_extension == 'tif':
-            datatype = self.get_image_datatype(in_fn)
-            min_val, max_val = self.get_image_max_min(in_fn)
-            byte_or_integer_binary = datatype in ['Byte', 'CInt16', 'CInt32', 'Int16', 'Int32', 'UInt16',
-                                                      'UInt32'] and max_val == 1 and min_val == 0
-            float_binary = datatype in ['Float32', 'Float64', 'CFloat32', 'CFloat64'] and max_val == 1.0000000 and min_val == 0.0000000
-
-        if byte_or_integer_binary or (float_binary):
-            # For float_binary, use find_unique_values function to check if data only have two unique values [0.0000000, 1.0000000].
-            if float_binary:
-                in_ds = gdal.Open(in_fn)
-                in_band = in_ds.GetRasterBand(1)
-                arr = in_band.ReadAsArray()
-                # If more than two unique values are found, it's not a binary map, return False.
-                if not self.find_unique_values(arr, 2):
-                    return False
-            # Binary map: byte_or_integer_binary or float_binary with two unique values [0.0000000, 1.0000000], it returns True.
-            return True
-        # For any other scenario, it returns False.
-        return False
-
 if __name__ == "__main__":
     # main
     app = QApplication(sys.argv)
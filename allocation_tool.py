@@ -2,18 +2,36 @@ import os
 import numpy as np
 import pandas as pd
 from osgeo import gdal
-from PyQt5.QtCore import QObject, pyqtSignal
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from raster_stack import RasterStack, DEFAULT_PROFILE, BLOCK_PIXELS
+from progress import ProgressReporter
+from modeling_region import ModelingRegionEncoding, LookupTable, count_ids, add_counts, count_pairs, pair_bin_counts
+from tabulation_cache import TabulationCache
+from bin_table import is_bin_table, source_fingerprint, save_bin_table, load_bin_table, check_bin_table
 
 # GDAL exceptions
 gdal.UseExceptions()
 
-class AllocationTool(QObject):
-    progress_updated = pyqtSignal(int)
+class AllocationTool:
 
-    def __init__(self):
-        super(AllocationTool, self).__init__()
+    def __init__(self, progress_callback=None, tabulation_cache=None, out_of_core=False,
+                 creation_profile=DEFAULT_PROFILE):
+        '''
+        :param progress_callback: function called with the progress percentage
+        :param tabulation_cache: TabulationCache or cache directory for the prediction modeling region maps,
+                                 None to always tabulate
+        :param out_of_core: if True, the prediction modeling region map is kept on disk only and read back window by
+                            window to write the adjusted prediction density map, for maps larger than the memory
+        :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+        '''
+        self.progress_updated = ProgressReporter(progress_callback)
         self.data_folder = None
+        self.rasters = RasterStack(creation_profile)
+        if isinstance(tabulation_cache, str):
+            tabulation_cache = TabulationCache(tabulation_cache)
+        self.tabulation_cache = tabulation_cache
+        self.out_of_core = out_of_core
 
     def set_working_directory(self, directory):
         '''
@@ -22,17 +40,9 @@ class AllocationTool(QObject):
         '''
         self.data_folder = directory
         os.chdir(self.data_folder)
+        self.rasters.close()
 
 ###Step1 Create the Fitting Modeling Region Map###
-    def image_to_array(self,image):
-        # Set up a GDAL dataset
-        in_ds = gdal.Open(image)
-        # Set up a GDAL band
-        in_band = in_ds.GetRasterBand(1)
-        # Create Numpy Array1
-        arr = in_band.ReadAsArray()
-        return arr
-
     def array_to_image(self, in_fn, out_fn, data, data_type, nodata=None):
         '''
           Create image from array
@@ -43,52 +53,110 @@ class AllocationTool(QObject):
          :param nodata:optional NoData value
          :return:
         '''
-        in_ds = gdal.Open(in_fn)
-        output_format = out_fn.split('.')[-1].upper()
-        if (output_format == 'TIF'):
-            output_format = 'GTIFF'
-        elif (output_format == 'RST'):
-            output_format = 'rst'
-        driver = gdal.GetDriverByName(output_format)
-        out_ds = driver.Create(out_fn, in_ds.RasterXSize, in_ds.RasterYSize, 1, data_type, options=["BigTIFF=YES"])
-        out_band = out_ds.GetRasterBand(1)
-        out_ds.SetGeoTransform(in_ds.GetGeoTransform())
-        out_ds.SetProjection(in_ds.GetProjection().encode('utf-8', 'backslashreplace').decode('utf-8'))
-        if nodata is not None:
-            out_band.SetNoDataValue(nodata)
-        out_band.WriteArray(data)
-        out_band.FlushCache()
-        out_ds.FlushCache()
+        with self.rasters.writer(in_fn, out_fn, data_type, nodata) as writer:
+            writer.write(data)
         return
 
-    def tabulation_bin_id_HRP(self, risk30_hrp, municipality, out_fn1):
+    def tabulation_bin_id_HRP(self, risk30_hrp, municipality, out_fn1, encoding=None):
         """
         This function is to create fitting modeling region array(tabulation_bin_id_masked)
         and fitting modeling region map(tabulation_bin_image)
         :param risk30_hrp: The 30-class vulnerability map for the CAL/HRP
         :param municipality: Subdivision image
         :param out_fn1: user input
+        :param encoding: modeling region encoding, derived from the two maps if None
         :return: tabulation_bin_id_masked: tabulation bin id array in CAL/HRP
         """
-        # Convert risk30_hrp to NumPy array
-        arr1 = self.image_to_array(risk30_hrp)
+        tabulation_bin_id_masked = self.tabulation_bin_id(risk30_hrp, municipality, out_fn1, encoding)
+        return tabulation_bin_id_masked
 
-        # Convert municipality to NumPy array2
-        arr2 = self.image_to_array(municipality)
+    def region_encoding(self, risk30, municipality, out_fn1=None):
+        """
+        Choose the modeling region id encoding from the exact value ranges of the vulnerability and subdivision maps
+        :param risk30: The 30-class vulnerability map
+        :param municipality: Subdivision image
+        :param out_fn1: optional modeling region map name, checked up front to be able to hold the ids
+        :return: encoding: ModelingRegionEncoding
+        """
+        encoding = ModelingRegionEncoding(self.rasters.value_range(risk30), self.rasters.value_range(municipality))
+        if out_fn1 is not None:
+            encoding.output_data_type(out_fn1)
+        return encoding
 
-        # Create a mask where the risk30_hrp value larger than 1 reclassed into 1
-        mask_arr_HRP = np.where(arr1 > 0,1, arr1)
+    def tabulation_bin_id(self, risk30, municipality, out_fn1, encoding=None):
+        """
+        Calculate the tabulation bin id window by window and write each window of the modeling region map as it is computed
+        :param risk30: The 30-class vulnerability map
+        :param municipality: Subdivision image
+        :param out_fn1: user input
+        :param encoding: modeling region encoding, derived from the two maps if None
+        :return: tabulation_bin_id_masked: tabulation bin id array
+        """
+        if encoding is None:
+            encoding = self.region_encoding(risk30, municipality)
+        cols, rows = self.rasters.size(risk30)
+        tabulation_bin_id_masked = np.empty((rows, cols), dtype=encoding.dtype)
+
+        with self.rasters.writer(risk30, out_fn1, encoding.output_data_type(out_fn1), -1) as writer:
+            for window in writer.windows():
+                xoff, yoff, xsize, ysize = window
+                tabulation_bin_id_window = self.tabulation_bin_id_window(risk30, municipality, window, encoding)
+                writer.write(tabulation_bin_id_window, xoff, yoff)
+                tabulation_bin_id_masked[yoff:yoff + ysize, xoff:xoff + xsize] = tabulation_bin_id_window
+
+        return tabulation_bin_id_masked
+
+    def tabulation_bin_id_window(self, risk30, municipality, window, encoding=None):
+        """
+        Calculate the tabulation bin id of one window
+        :param risk30: The 30-class vulnerability map
+        :param municipality: Subdivision image
+        :param window: (xoff, yoff, xsize, ysize) window
+        :param encoding: modeling region encoding, derived from the two maps if None
+        :return: tabulation_bin_id_window: tabulation bin id array of the window
+        """
+        if encoding is None:
+            encoding = self.region_encoding(risk30, municipality)
 
-        # Calculate tabulation bin id with mask
-        tabulation_bin_id_masked = np.add(arr1*1000, arr2) * mask_arr_HRP
+        # Convert risk30 and municipality to NumPy array, in their stored types: the encoding casts them to the id type
+        arr1 = self.rasters.read_window(risk30, window)
+        arr2 = self.rasters.read_window(municipality, window)
 
-        # Convert the array to signed 16-bit integer (int16) data type
-        tabulation_bin_id_masked = tabulation_bin_id_masked.astype(np.int16)
+        # class * multiplier + subdivision inside the mask
+        return encoding.encode(arr1, arr2)
 
-        # Create the final image using tabulation_bin_image function
-        self.array_to_image(risk30_hrp, out_fn1, tabulation_bin_id_masked,
-                                     gdal.GDT_Int16, -1)
-        return tabulation_bin_id_masked
+    def tabulation_bin_counts_HRP(self, risk30_hrp, municipality, deforestation_hrp, out_fn1=None):
+        """
+        Fitting pass one: read the three inputs together window by window, count the pixels and deforested pixels
+        of each (class, subdivision) pair and collect the exact value ranges of the class and subdivision maps, so
+        that the encoding is chosen without reading the maps beforehand
+        :param risk30_hrp: The 30-class vulnerability map for the CAL/HRP
+        :param municipality: Subdivision image
+        :param deforestation_hrp: Deforestation Map during the CAL/HRP
+        :param out_fn1: optional modeling region map name, checked to be able to hold the ids
+        :return: bin_counts: (bin_ids, counts) non-deforested and deforested pixels of each id,
+                 encoding: modeling region encoding
+        """
+        pair_counts = None
+        # Exact (minimum, maximum) of the class and subdivision maps, NoData left out
+        value_ranges = [None, None]
+
+        for window in self.rasters.windows(risk30_hrp):
+            arrays = [self.rasters.read_window(risk30_hrp, window), self.rasters.read_window(municipality, window)]
+            for i, (image, arr) in enumerate(zip((risk30_hrp, municipality), arrays)):
+                window_range = self.rasters.window_range(image, arr)
+                if window_range is not None:
+                    low, high = value_ranges[i] or window_range
+                    value_ranges[i] = (min(low, window_range[0]), max(high, window_range[1]))
+            deforestation_window = self.rasters.read_binary(deforestation_hrp, window)
+            pair_counts = add_counts(pair_counts, count_pairs(arrays[0], arrays[1], deforestation_window))
+
+        if None in value_ranges:
+            raise ValueError("The vulnerability map and the subdivision map must have values other than NoData!")
+        encoding = ModelingRegionEncoding(*value_ranges)
+        if out_fn1 is not None:
+            encoding.output_data_type(out_fn1)
+        return pair_bin_counts(pair_counts, encoding), encoding
 
 ###Step2 Calculate the Relative Frequencies###
     def create_relative_frequency_table(self, tabulation_bin_id_masked, deforestation_hrp, csv_name):
@@ -98,27 +166,52 @@ class AllocationTool(QObject):
         :param deforestation_hrp: Deforestation Map during the CAL/HRP
         :return: merged_df: relative frequency dataframe
         """
-        # Calculate array area of the bin [integer] (in pixels) for Col3 using np.unique and counts function, excluding 0
-        unique, counts = np.unique(tabulation_bin_id_masked[tabulation_bin_id_masked != 0], return_counts=True)
-        # Convert to array
-        arr_counts = np.asarray((unique, counts)).T
-
-        # Calculate total deforestation within the bin [integer] array for Col2
-        arr3 = self.image_to_array(deforestation_hrp)
-
-        # deforestation_within_bin will have tabulation_bin_id value in deforestation pixel
-        deforestation_within_bin = tabulation_bin_id_masked * arr3
-        # Use np.unique to counts total deforestation in each bin
-        unique1, counts1 = np.unique(deforestation_within_bin[deforestation_within_bin != 0], return_counts=True)
-        # Convert to array
-        arr_counts_deforestion = np.asarray((unique1, counts1)).T
+        # Count the pixels and the deforested pixels of each bin, reading deforestation window by window
+        bin_counts = None
+        for xoff, yoff, xsize, ysize in self.rasters.windows(deforestation_hrp):
+            tabulation_bin_id_window = tabulation_bin_id_masked[yoff:yoff + ysize, xoff:xoff + xsize]
+            deforestation_window = self.rasters.read_binary(deforestation_hrp, (xoff, yoff, xsize, ysize))
+            bin_counts = self.count_bins(bin_counts, tabulation_bin_id_window, deforestation_window)
+
+        merged_df = self.relative_frequency_table(bin_counts, csv_name)
+        return merged_df
 
-        # Create pandas DataFrames
-        df1 = pd.DataFrame(arr_counts_deforestion, columns=['ID', 'Total Deforestation(pixel)'])
-        df2 = pd.DataFrame(arr_counts, columns=['ID', 'Area of the Bin(pixel)'])
+    def count_bins(self, bin_counts, tabulation_bin_id_window, deforestation_window):
+        """
+        Add the pixels and the deforested pixels of each bin of a window to the bin counts. The window is counted with
+        one np.bincount over its own id range (count_ids) and added to the ids seen so far, so no array spans the whole
+        id range of the encoding
+        :param bin_counts: (bin_ids, counts) so far, counts holding the non-deforested and deforested pixels of each id,
+                           or None to start
+        :param tabulation_bin_id_window: tabulation bin id array
+        :param deforestation_window: deforestation bool array, or a bool for the whole window
+        :return: bin_counts: (bin_ids, counts) including the window
+        """
+        return add_counts(bin_counts, count_ids(tabulation_bin_id_window, deforestation_window))
 
-        # Merge the two DataFrames based on the 'id' column using an outer join to include all rows from both DataFrames
-        merged_df = pd.merge(df1, df2, on='ID', how='outer').fillna(0)
+    def relative_frequency_table(self, bin_counts, csv_name, metadata=None):
+        """
+        Create the relative frequency dataframe from the bin counts and save it as csv
+        :param bin_counts: (bin_ids, counts) non-deforested and deforested pixels of each id, from count_bins
+        :param csv_name: user input; a .npz name saves the binary table and exports the csv next to it
+        :param metadata: dictionary saved with a binary table
+        :return: merged_df: relative frequency dataframe
+        """
+        # Area of the bin [integer] (in pixels) for Col3 and total deforestation within the bin [integer] for Col2,
+        # for the bins present in the map, excluding 0
+        bin_ids, counts = bin_counts
+        in_mask = bin_ids != 0
+        ids = bin_ids[in_mask].astype(np.int64)
+        area_of_bin = counts[in_mask].sum(axis=1)
+        total_deforestation = counts[in_mask, 1]
+
+        # Create pandas DataFrame
+        merged_df = pd.DataFrame({'ID': ids, 'Total Deforestation(pixel)': total_deforestation,
+                                  'Area of the Bin(pixel)': area_of_bin})
+
+        # Bins without deforestation used to be filled in by an outer merge, which made the column float; keep the csv format
+        if np.any(total_deforestation == 0):
+            merged_df['Total Deforestation(pixel)'] = merged_df['Total Deforestation(pixel)'].astype(float)
 
         # Calculate Average Deforestation by performing the division operation of col2 and col3 and add a new column to merged_df
         merged_df['Average Deforestation(pixel)'] = merged_df.iloc[:, 1].astype(float) / merged_df.iloc[:, 2].astype(float)
@@ -130,83 +223,127 @@ class AllocationTool(QObject):
         merged_df = merged_df.reset_index(drop=True)
 
         csv_file_path = csv_name
+        if is_bin_table(csv_name):
+            save_bin_table(merged_df, csv_name, metadata)
+            csv_file_path = f"{os.path.splitext(csv_name)[0]}.csv"
         merged_df.to_csv(csv_file_path, index=False)
 
         return merged_df
 
 ###Step 3 Fitting Phase: create the fitted density map###
-    def create_fit_density_map(self,risk30_hrp, tabulation_bin_id_masked, merged_df, out_fn2):
+    def create_fit_density_map(self,risk30_hrp, tabulation_bin_id_masked, merged_df, out_fn2, municipality=None,
+                               encoding=None, out_fn1=None):
         '''
         Create the fitting density map, this function used for fitting phase (CAL and HRP)
         :param risk30_hrp: the 30-class vulnerability map for the CAL/HRP
-        :param tabulation_bin_id_masked: array for tabulation bin id in fitting Phase
+        :param tabulation_bin_id_masked: array for tabulation bin id in fitting Phase,
+                                         or None to recompute it window by window from risk30_hrp and municipality
         :param merged_df: relative frequency dataframe
+        :param municipality: Subdivision image, needed when tabulation_bin_id_masked is None
+        :param encoding: modeling region encoding used for the bin ids, derived from the maps if None
+        :param out_fn1: optional fitting modeling region map, written from the same windows of bin ids
         :return:
         '''
-        # Insert index=0 row into first row of merged_df DataFrame
-        new_row = pd.DataFrame({'ID': [0], 'Total Deforestation(pixel)': [0], 'Area of the Bin(pixel)': [0],
-                                'Average Deforestation(pixel)': [0]})
-        merged_df = pd.concat([new_row, merged_df]).reset_index(drop=True)
-
-        # Using numpy.searchsorted() to assign values to 'id'
-        df_sorted = merged_df.sort_values('ID')
-        sorted_indices = df_sorted['ID'].searchsorted(tabulation_bin_id_masked)
-        relative_frequency_arr = tabulation_bin_id_masked[:] = df_sorted['Average Deforestation(pixel)'].values[sorted_indices]
-
         # Calculate areal_resolution_of_map_pixels
-        in_ds4 = gdal.Open(risk30_hrp)
-        P1 = in_ds4.GetGeoTransform()[1]
-        P2 = abs(in_ds4.GetGeoTransform()[5])
-        areal_resolution_of_map_pixels = P1 * P2 / 10000
+        areal_resolution_of_map_pixels = self.rasters.pixel_area(risk30_hrp)
 
         # Relative_frequency multiplied by the areal resolution of the map pixels to express the probabilities as densities
-        fit_density_arr=relative_frequency_arr * areal_resolution_of_map_pixels
-
-        # Create the final fit_density_map image using tabulation_bin_image function
-        self.array_to_image(risk30_hrp, out_fn2, fit_density_arr, gdal.GDT_Float32, -1)
+        fit_density = merged_df['Average Deforestation(pixel)'].values * areal_resolution_of_map_pixels
+
+        # Look-up table from bin id to density; id 0 (outside the mask) has density 0
+        lookup = LookupTable(merged_df['ID'].values, fit_density)
+
+        # Create the final fit_density_map image window by window
+        region_writer = None
+        if out_fn1 is not None:
+            if encoding is None:
+                encoding = self.region_encoding(risk30_hrp, municipality)
+            region_writer = self.rasters.writer(risk30_hrp, out_fn1, encoding.output_data_type(out_fn1), -1)
+        try:
+            with self.rasters.writer(risk30_hrp, out_fn2, gdal.GDT_Float32, -1) as writer:
+                for window in writer.windows():
+                    xoff, yoff, xsize, ysize = window
+                    if tabulation_bin_id_masked is None:
+                        tabulation_bin_id_window = self.tabulation_bin_id_window(risk30_hrp, municipality, window,
+                                                                                 encoding)
+                    else:
+                        tabulation_bin_id_window = tabulation_bin_id_masked[yoff:yoff + ysize, xoff:xoff + xsize]
+                    if region_writer is not None:
+                        region_writer.write(tabulation_bin_id_window, xoff, yoff)
+                    writer.write(lookup.map(tabulation_bin_id_window), xoff, yoff)
+        finally:
+            if region_writer is not None:
+                region_writer.close()
 
         return
 
 ###Step 3 Prediction Phase: create the adjusted predicted density map###
-    def tabulation_bin_id_VP (self, risk30_vp, municipality, out_fn1):
+    def tabulation_bin_id_VP (self, risk30_vp, municipality, out_fn1, encoding=None):
         """
         This function is to create modeling region array(tabulation_bin_id_VP_masked)
         and modeling region map(tabulation_bin_image_vp)
         :param risk30_vp: The 30-class vulnerability map for the CNF/VP
         :param municipality: Subdivision image
         :param out_fn1: user input
+        :param encoding: modeling region encoding, derived from the two maps if None
         :return: tabulation_bin_id_VP_masked: tabulation bin id array in CNF/VP
         """
 
-        # Convert municipality and risk30_vp to NumPy array
-        arr2 = self.image_to_array(municipality)
-        arr4 = self.image_to_array(risk30_vp)
-
-        # Create a mask where the risk30_hrp value larger than 1 reclassed into 1
-        mask_arr_VP = np.where(arr4 > 0, 1, arr4)
-
-        # Calculate tabulation bin id of CNF/VP with mask
-        tabulation_bin_id_VP_masked = np.add(arr4 * 1000, arr2) * mask_arr_VP
-
-        # Convert the array to signed 16-bit integer (int16) data type
-        tabulation_bin_id_VP_masked = tabulation_bin_id_VP_masked.astype(np.int16)
-        #Write image to disk
-        self.array_to_image(risk30_vp, out_fn1, tabulation_bin_id_VP_masked,
-                                     gdal.GDT_Int16, -1)
-
+        tabulation_bin_id_VP_masked = self.tabulation_bin_id(risk30_vp, municipality, out_fn1, encoding)
         return tabulation_bin_id_VP_masked
 
+    def tabulation_bin_counts_VP(self, risk30_vp, municipality, out_fn1, encoding=None):
+        """
+        Out-of-core version of tabulation_bin_id_VP: write the modeling region map window by window and count the
+        pixels of each bin without keeping the tabulation bin id array
+        :param risk30_vp: The 30-class vulnerability map for the CNF/VP
+        :param municipality: Subdivision image
+        :param out_fn1: user input
+        :param encoding: modeling region encoding, derived from the two maps if None
+        :return: bin_ids: modeling region ids present in the map, counts: number of pixels of each bin
+        """
+        if encoding is None:
+            encoding = self.region_encoding(risk30_vp, municipality)
+        bin_counts = None
+
+        with self.rasters.writer(risk30_vp, out_fn1, encoding.output_data_type(out_fn1), -1) as writer:
+            for window in writer.windows():
+                xoff, yoff, xsize, ysize = window
+                tabulation_bin_id_window = self.tabulation_bin_id_window(risk30_vp, municipality, window, encoding)
+                writer.write(tabulation_bin_id_window, xoff, yoff)
+                # Every pixel is counted as non-deforested
+                bin_counts = self.count_bins(bin_counts, tabulation_bin_id_window, False)
+
+        bin_ids, counts = bin_counts
+        return bin_ids.astype(encoding.dtype), counts[:, 0]
+
+    def read_relative_frequency_table(self, csv, encoding=None):
+        '''
+        Read the relative frequency table of the fitting stage
+        :param csv: relative frequency table file (.csv or .npz), or a DataFrame that is returned as is
+        :param encoding: ModelingRegionEncoding of the prediction maps; if given, a .npz table is checked against it
+                         and against its fitting maps
+        :return: merged_df: relative frequency table
+        '''
+        if isinstance(csv, pd.DataFrame):
+            return csv
+        if is_bin_table(csv):
+            merged_df, metadata = load_bin_table(csv)
+            if encoding is not None:
+                check_bin_table(csv, metadata, encoding.multiplier)
+            return merged_df
+        return pd.read_csv(csv)
 
     def calculate_prediction_density_arr(self,risk30_vp, tabulation_bin_id_VP_masked, csv):
         '''
-        Calculate the prediction density arry
-        :param tabulation_bin_id_VP_masked: array for tabulation bin id in CNF/VP
-        :param csv: relative frequency table
+        Calculate the prediction density of tabulation bin ids
+        :param tabulation_bin_id_VP_masked: tabulation bin ids in CNF/VP, e.g. the bin ids of the bin table
+        :param csv: relative frequency table, file or DataFrame
         :param risk30_vp: the 30-class vulnerability map for the CNF/VP
-        :return: prediction_density_arr: modeled deforestation (MD)
+        :return: prediction_density_arr: prediction density of each id
         '''
-        # Read Relative Frequency csv file
-        merged_df=pd.read_csv(csv)
+        # Read Relative Frequency table
+        merged_df = self.read_relative_frequency_table(csv)
 
         # Insert index=0 row into first row of merged_df DataFrame
         new_row = pd.DataFrame({'ID': [0], 'Total Deforestation(pixel)': [0], 'Area of the Bin(pixel)': [0],
@@ -216,112 +353,141 @@ class AllocationTool(QObject):
         # Using numpy.searchsorted() to assign values to 'id'
         df_sorted = merged_df.sort_values('ID')
         sorted_indices = df_sorted['ID'].searchsorted(tabulation_bin_id_VP_masked)
-        relative_frequency_arr = tabulation_bin_id_VP_masked[:] = df_sorted['Average Deforestation(pixel)'].values[sorted_indices]
+        relative_frequency_arr = df_sorted['Average Deforestation(pixel)'].values[sorted_indices]
 
         # Calculate areal_resolution_of_map_pixels
-        in_ds4 = gdal.Open(risk30_vp)
-        P1 = in_ds4.GetGeoTransform()[1]
-        P2 = abs(in_ds4.GetGeoTransform()[5])
-        areal_resolution_of_map_pixels = P1 * P2 / 10000
+        areal_resolution_of_map_pixels = self.rasters.pixel_area(risk30_vp)
 
         # Relative_frequency multiplied by the areal resolution of the map pixels to express the probabilities as densities
         prediction_density_arr=relative_frequency_arr * areal_resolution_of_map_pixels
 
         return prediction_density_arr
 
-    def calculate_adjustment_ratio_cnf(self, prediction_density_arr, deforestation_cnf):
+    def bin_pixel_counts(self, tabulation_bin_id_VP_masked):
         '''
-        Calculate the Adjustment Ratio (AR) in CNF
-        :param prediction_density_arr: modeled deforestation (MD)
-        :param deforestation_cnf: deforestation binary map in cnf
-        :return: AR
+        Count the pixels of each modeling region
+        :param tabulation_bin_id_VP_masked: array for tabulation bin id in CNF/VP
+        :return: bin_ids: modeling region ids present in the map, counts: number of pixels of each bin
         '''
-
-        # Sum up the pixels in the prediction density map. This is the modeled deforestation (MD).
-        MD = np.sum(prediction_density_arr)
-
-        # Calculate areal_resolution_of_map_pixels
-        in_ds5 = gdal.Open(deforestation_cnf)
-        P1 = in_ds5.GetGeoTransform()[1]
-        P2 = abs(in_ds5.GetGeoTransform()[5])
-        areal_resolution_of_map_pixels = P1 * P2 / 10000
-
-        # Convert deforestation_cnf to array in ha
-        arr5 = self.image_to_array(deforestation_cnf)
-        arr5_ha=arr5 * areal_resolution_of_map_pixels
-
-        # Calculate the Actual Deforestation (AD) during the confirmation period
-        AD = np.sum(arr5_ha)
-
-        # AR = AD / MD
-        AR = AD / MD
-        return AR
-
-    def calculate_adjustment_ratio(self,prediction_density_arr, expected_deforestation):
+        # Count row strips, so that the bincount index never spans the whole map
+        rows, cols = tabulation_bin_id_VP_masked.shape
+        strip_rows = max(1, BLOCK_PIXELS // cols)
+        bin_counts = None
+        for yoff in range(0, rows, strip_rows):
+            bin_counts = self.count_bins(bin_counts, tabulation_bin_id_VP_masked[yoff:yoff + strip_rows], False)
+        bin_ids, counts = bin_counts
+        return bin_ids.astype(tabulation_bin_id_VP_masked.dtype), counts[:, 0]
+
+    def prediction_density_table(self, risk30_vp, tabulation_bin_id_VP_masked, csv, bin_counts=None):
         '''
-        Calculate the Adjustment Ratio (AR) in VP
-        :param prediction_density_arr: modeled deforestation (MD)
-        :param expected_deforestation: user input
-        :return: AR
+        Tabulate the prediction density and the number of pixels of each modeling region
+        :param risk30_vp: the 30-class vulnerability map for the CNF/VP
+        :param tabulation_bin_id_VP_masked: array for tabulation bin id in CNF/VP
+        :param csv: relative frequency table, file or DataFrame
+        :param bin_counts: (bin_ids, counts) of the map if already counted
+        :return: bin_ids: modeling region ids, densities: prediction density of each bin, counts: number of pixels of each bin
         '''
+        if bin_counts is None:
+            bin_counts = self.bin_pixel_counts(tabulation_bin_id_VP_masked)
+        bin_ids, counts = bin_counts
 
-        # Sum up the pixels in the prediction density map. This is the modeled deforestation (MD).
-        MD = np.sum(prediction_density_arr)
-
-        # AR = ED / MD
-        AR = expected_deforestation / MD
-        return AR
+        # Look up the densities of the bins present in the map
+        densities = self.calculate_prediction_density_arr(risk30_vp, bin_ids, csv)
+        return bin_ids, densities, counts
 
-    def adjusted_prediction_density_array (self, prediction_density_arr, risk30_vp, AR):
+    def calculate_actual_deforestation_cnf(self, deforestation_cnf):
         '''
-        Create adjusted prediction density array
-        :param prediction_density_arr:modeled deforestation (MD)
-        :param risk30_vp: risk30_vp image
-        :param AR:Adjustment Ratio
-        :return: adjusted_prediction_density_np_arr
+        Calculate the Actual Deforestation (AD) in CNF
+        :param deforestation_cnf: deforestation binary map in cnf
+        :return: AD
         '''
-
-        # Calculate the maximum density
         # Calculate areal_resolution_of_map_pixels
-        in_ds4 = gdal.Open(risk30_vp)
-        P1 = in_ds4.GetGeoTransform()[1]
-        P2 = abs(in_ds4.GetGeoTransform()[5])
-        maximum_density = P1 * P2 / 10000
-
-        # Adjusted_Prediction_Density_Map = AR x Prediction_Density _Map
-        adjusted_prediction_density_arr=AR*prediction_density_arr
+        areal_resolution_of_map_pixels = self.rasters.pixel_area(deforestation_cnf)
 
-        # Reclassify all pixels greater than the maximum (e.g., 0.09) to be the maximum
-        adjusted_prediction_density_arr[adjusted_prediction_density_arr > maximum_density] = maximum_density
+        # Read deforestation_cnf as a bool array
+        arr5 = self.rasters.read_binary(deforestation_cnf)
 
-        return adjusted_prediction_density_arr
+        # Calculate the Actual Deforestation (AD) in ha during the confirmation period
+        AD = np.count_nonzero(arr5) * areal_resolution_of_map_pixels
+        return AD
 
+    def solve_adjustment_ratio(self, densities, counts, target, maximum_density):
+        '''
+        Calculate the Adjustment Ratio (AR) such that the adjusted densities, capped at the maximum density,
+        sum up to the target. This is the ratio the repeated AR adjustment converges to: bins pushed over the
+        maximum stay at the maximum and the remaining bins share the rest of the target.
+        :param densities: prediction density of each bin
+        :param counts: number of pixels of each bin
+        :param target: Actual Deforestation (AD) in CNF or expected deforestation in VP (ha)
+        :param maximum_density: maximum density (areal resolution of the map pixels)
+        :return: AR
+        '''
+        # Only bins with a positive density can take up deforestation
+        positive = densities > 0
+        densities = densities[positive]
+        counts = counts[positive].astype(np.float64)
+
+        if target > maximum_density * np.sum(counts):
+            raise ValueError(f"The deforestation to allocate ({target} ha) exceeds the maximum density over every "
+                             f"pixel with a positive prediction density ({maximum_density * np.sum(counts)} ha).")
+        if densities.size == 0:
+            return 0.0
+
+        # Sort bins from the highest to the lowest density
+        order = np.argsort(densities)[::-1]
+        densities = densities[order]
+        counts = counts[order]
+
+        # With the k densest bins capped, the others share what is left of the target
+        capped = maximum_density * np.concatenate(([0.0], np.cumsum(counts)[:-1]))
+        uncapped = np.cumsum((densities * counts)[::-1])[::-1]
+        ratios = (target - capped) / uncapped
+
+        # The solution is the first k for which the densest uncapped bin stays under the maximum.
+        # At exact capacity every bin is capped and rounding may leave no k under the maximum: the last k caps all bins
+        fits = ratios * densities <= maximum_density
+        k = np.argmax(fits) if fits.any() else len(ratios) - 1
+        AR = ratios[k]
+        return AR
 
-    def adjusted_prediction_density_map (self, prediction_density_arr, risk30_vp, AR, out_fn2):
+    def adjusted_prediction_density_map (self, tabulation_bin_id_VP_masked, bin_ids, densities, risk30_vp, AR, out_fn2,
+                                         out_fn1=None):
         '''
         Create adjusted prediction density map
-        :param prediction_density_arr:modeled deforestation (MD)
+        :param tabulation_bin_id_VP_masked: array for tabulation bin id in CNF/VP, or None to read out_fn1
+        :param bin_ids: modeling region ids
+        :param densities: prediction density of each bin
         :param risk30_vp: risk30_vp image
         :param AR:Adjustment Ratio
         :param out_fn2: user input
+        :param out_fn1: prediction modeling region map, read window by window if tabulation_bin_id_VP_masked is None
         :return:
         '''
 
         # Calculate the maximum density
         # Calculate areal_resolution_of_map_pixels
-        in_ds4 = gdal.Open(risk30_vp)
-        P1 = in_ds4.GetGeoTransform()[1]
-        P2 = abs(in_ds4.GetGeoTransform()[5])
-        maximum_density = P1 * P2 / 10000
+        maximum_density = self.rasters.pixel_area(risk30_vp)
+
+        # Adjusted_Prediction_Density = AR x Prediction_Density, for each bin
+        adjusted_densities = AR * densities
 
-        # Adjusted_Prediction_Density_Map = AR x Prediction_Density _Map
-        adjusted_prediction_density_arr=AR*prediction_density_arr
+        # Reclassify all bins greater than the maximum (e.g., 0.09) to be the maximum
+        adjusted_densities[adjusted_densities > maximum_density] = maximum_density
 
-        # Reclassify all pixels greater than the maximum (e.g., 0.09) to be the maximum
-        adjusted_prediction_density_arr[adjusted_prediction_density_arr > maximum_density] = maximum_density
+        # Look-up table from bin id to adjusted density
+        lookup = LookupTable(bin_ids, adjusted_densities)
 
-        # Create imagery
-        self.array_to_image(risk30_vp, out_fn2, adjusted_prediction_density_arr, gdal.GDT_Float32, -1)
+        # Create imagery window by window
+        with self.rasters.writer(risk30_vp, out_fn2, gdal.GDT_Float32, -1) as writer:
+            for window in writer.windows():
+                xoff, yoff, xsize, ysize = window
+                if tabulation_bin_id_VP_masked is None:
+                    # Ids are stored as Float32 in .rst maps
+                    tabulation_bin_id_window = self.rasters.read_window(out_fn1, window).astype(bin_ids.dtype,
+                                                                                               copy=False)
+                else:
+                    tabulation_bin_id_window = tabulation_bin_id_VP_masked[yoff:yoff + ysize, xoff:xoff + xsize]
+                writer.write(lookup.map(tabulation_bin_id_window), xoff, yoff)
 
         return
 
@@ -382,62 +548,120 @@ class AllocationTool(QObject):
         self.progress_updated.emit(0)
         data_folder = self.set_working_directory(directory)
         self.progress_updated.emit(10)
-        tabulation_bin_id_masked = self.tabulation_bin_id_HRP(risk30_hrp,municipality,out_fn1)
-        self.replace_ref_system(municipality, out_fn1)
+        # Pass one: count each bin and find the value ranges of the maps while reading the three inputs once
+        bin_counts, encoding = self.tabulation_bin_counts_HRP(risk30_hrp, municipality, deforestation_hrp, out_fn1)
         self.progress_updated.emit(50)
-        merged_df = self.create_relative_frequency_table(tabulation_bin_id_masked,
-                                                                              deforestation_hrp, csv_name)
+        metadata = None
+        if is_bin_table(csv_name):
+            metadata = {'pixel_area': float(self.rasters.pixel_area(risk30_hrp)),
+                        'class_count': encoding.class_range[1],
+                        'multiplier': encoding.multiplier,
+                        'sources': {'risk30_hrp': source_fingerprint(risk30_hrp),
+                                    'municipality': source_fingerprint(municipality),
+                                    'deforestation_hrp': source_fingerprint(deforestation_hrp)}}
+        merged_df = self.relative_frequency_table(bin_counts, csv_name, metadata)
         self.progress_updated.emit(75)
-        self.create_fit_density_map(risk30_hrp, tabulation_bin_id_masked,
-                                                              merged_df, out_fn2)
+        # Pass two: recompute the bin ids window by window to write the modeling region map and the fitted density map
+        self.create_fit_density_map(risk30_hrp, None, merged_df, out_fn2, municipality, encoding, out_fn1)
+        self.replace_ref_system(municipality, out_fn1)
         self.replace_ref_system(municipality, out_fn2)
+        self.rasters.close()
         self.progress_updated.emit(100)
         # After processing, emit processCompleted or any other signal as needed
         return
 
-    def execute_workflow_cnf(self, directory, max_iterations, csv, municipality, deforestation_cnf, risk30_vp, out_fn1, out_fn2):
+    def prepare_prediction(self, directory, csv, municipality, risk30_vp, out_fn1):
         '''
-        Create workflow function for CNF
-        :param max_iterations: maximum number of iterations
+        Shared steps of the prediction workflows: write the prediction modeling region map, estimate the relative
+        frequency of missing bins and tabulate the prediction density of each bin
+        :param directory: working directory
+        :param csv: relative frequency table of the fitting stage
+        :param municipality: Subdivision image
+        :param risk30_vp: the 30-class vulnerability map for the CNF/VP
+        :param out_fn1: user input
+        :return: id_difference: modeling region IDs missing in the fitting stage,
+                 tabulation_bin_id_VP_masked: tabulation bin id array (None if out of core),
+                 bin_ids, densities, counts: bin table
         '''
         self.progress_updated.emit(0)
         data_folder = self.set_working_directory(directory)
         self.progress_updated.emit(10)
-        tabulation_bin_id_VP_masked = self.tabulation_bin_id_VP(risk30_vp, municipality, out_fn1)
-        self.replace_ref_system(municipality, out_fn1)
+
+        # Reuse the encoding, modeling region map and bin counts of an earlier run on the same inputs, so that a cache
+        # hit does not read the maps at all
+        cache_key = None
+        value_ranges = None
+        if self.tabulation_cache is not None:
+            cache_key = self.tabulation_cache.key(risk30_vp, municipality, out_fn1, self.rasters.creation_profile)
+            value_ranges = self.tabulation_cache.value_ranges(cache_key)
+        if value_ranges is not None:
+            encoding = ModelingRegionEncoding(*value_ranges)
+            encoding.output_data_type(out_fn1)
+        else:
+            encoding = self.region_encoding(risk30_vp, municipality, out_fn1)
+        # Check a binary table against the prediction maps before anything is written
+        merged_df = self.read_relative_frequency_table(csv, encoding)
+
+        cached = None
+        if value_ranges is not None:
+            cached = self.tabulation_cache.load(cache_key, out_fn1)
+
+        if cached is not None:
+            tabulation_bin_id_VP_masked, bin_counts = cached
+        elif self.out_of_core:
+            # Only out_fn1 holds the bin ids, the adjusted prediction density map reads it back window by window
+            tabulation_bin_id_VP_masked = None
+            bin_counts = self.tabulation_bin_counts_VP(risk30_vp, municipality, out_fn1, encoding)
+            self.replace_ref_system(municipality, out_fn1)
+            if cache_key is not None:
+                self.tabulation_cache.store(cache_key, out_fn1, tabulation_bin_id_VP_masked, bin_counts, encoding)
+        else:
+            tabulation_bin_id_VP_masked = self.tabulation_bin_id_VP(risk30_vp, municipality, out_fn1, encoding)
+            self.replace_ref_system(municipality, out_fn1)
+            bin_counts = self.bin_pixel_counts(tabulation_bin_id_VP_masked)
+            if cache_key is not None:
+                self.tabulation_cache.store(cache_key, out_fn1, tabulation_bin_id_VP_masked, bin_counts, encoding)
         self.progress_updated.emit(30)
 
-        # Check modeling region IDs present in the prediction stage but absent in the fitting stage
-        id_difference, pre_model_region_id = self.check_modeling_region_ids(csv, out_fn1)
+        # Check modeling region IDs present in the prediction stage but absent in the fitting stage, from the bins
+        # of the tabulation instead of reading out_fn1 back
+        id_difference, pre_model_region_id = self.check_modeling_region_ids(merged_df, bin_counts[0])
 
-        # If there are missing bins, calculate the relative frequency and create a new csv file
+        # If there are missing bins, calculate their relative frequency; the adjusted csv file is only an output,
+        # written next to a table file but not for a DataFrame
         if id_difference.size > 0:
-            csv = self.calculate_missing_bins_rf(id_difference, csv,pre_model_region_id)
+            out_csv = csv if isinstance(csv, (str, os.PathLike)) else None
+            merged_df = self.calculate_missing_bins_rf(id_difference, merged_df, pre_model_region_id,
+                                                       encoding.multiplier, out_csv)
 
         self.progress_updated.emit(40)
 
-        prediction_density_arr = self.calculate_prediction_density_arr(risk30_vp, tabulation_bin_id_VP_masked,csv)
+        # Modeled deforestation is tabulated per bin, the densities are only mapped when writing out_fn2
+        bin_ids, densities, counts = self.prediction_density_table(risk30_vp, tabulation_bin_id_VP_masked, merged_df,
+                                                                   bin_counts)
         self.progress_updated.emit(50)
-        AR = self.calculate_adjustment_ratio_cnf(prediction_density_arr, deforestation_cnf)
+        return id_difference, tabulation_bin_id_VP_masked, bin_ids, densities, counts
+
+    def execute_workflow_cnf(self, directory, max_iterations, csv, municipality, deforestation_cnf, risk30_vp, out_fn1, out_fn2):
+        '''
+        Create workflow function for CNF
+        :param max_iterations: deprecated and ignored, the AR is solved directly; may be None
+        :return: id_difference: modeling region IDs missing from the CAL, iteration_count: always 0, kept so that
+                 existing callers can still unpack it
+        '''
+        id_difference, tabulation_bin_id_VP_masked, bin_ids, densities, counts = self.prepare_prediction(
+            directory, csv, municipality, risk30_vp, out_fn1)
+        AD = self.calculate_actual_deforestation_cnf(deforestation_cnf)
+        AR = self.solve_adjustment_ratio(densities, counts, AD, self.rasters.pixel_area(risk30_vp))
         self.progress_updated.emit(75)
-        # Set a maximum number of iterations to avoid infinite loop
-        iteration_count = 0
-        new_prediction_density_arr = None
-
-        # When AR > 1.00001 and iteration_count <= max_iterations, treat the result as new prediction density map to iterate the AR util AR is <=1.00001 or iteration_count = max_iterations
-        while AR > 1.00001 and iteration_count <= max_iterations:
-            new_prediction_density_arr = self.adjusted_prediction_density_array(prediction_density_arr, risk30_vp, AR)
-            AR = self.calculate_adjustment_ratio_cnf(new_prediction_density_arr, deforestation_cnf)
-            prediction_density_arr=new_prediction_density_arr
-            iteration_count += 1
-        if iteration_count <= int(max_iterations):
-            selected_density_arr = new_prediction_density_arr if new_prediction_density_arr is not None else prediction_density_arr
-            self.adjusted_prediction_density_map(selected_density_arr, risk30_vp, AR, out_fn2)
-            self.replace_ref_system(municipality, out_fn2)
 
-        else:
-            print("Maximum number of iterations reached. Please reset the maximum number of iterations.")
+        # The capped adjustment is solved directly on the bins, so no iterations are needed
+        iteration_count = 0
+        self.adjusted_prediction_density_map(tabulation_bin_id_VP_masked, bin_ids, densities, risk30_vp, AR, out_fn2,
+                                            out_fn1)
+        self.replace_ref_system(municipality, out_fn2)
 
+        self.rasters.close()
         self.progress_updated.emit(100)
 
         return id_difference , iteration_count
@@ -445,79 +669,109 @@ class AllocationTool(QObject):
     def execute_workflow_vp(self, directory,max_iterations, csv, municipality, expected_deforestation, risk30_vp, out_fn1, out_fn2):
         '''
         Create workflow function for VP
-        :param max_iterations: maximum number of iterations
+        :param max_iterations: deprecated and ignored, the AR is solved directly; may be None
+        :return: id_difference: modeling region IDs missing from the HRP, iteration_count: always 0, kept so that
+                 existing callers can still unpack it
         '''
-        self.progress_updated.emit(0)
-        data_folder = self.set_working_directory(directory)
-        self.progress_updated.emit(10)
-        tabulation_bin_id_VP_masked = self.tabulation_bin_id_VP(risk30_vp, municipality, out_fn1)
-        self.replace_ref_system(municipality, out_fn1)
-        self.progress_updated.emit(30)
+        id_difference, tabulation_bin_id_VP_masked, bin_ids, densities, counts = self.prepare_prediction(
+            directory, csv, municipality, risk30_vp, out_fn1)
+        AR = self.solve_adjustment_ratio(densities, counts, expected_deforestation, self.rasters.pixel_area(risk30_vp))
+        self.progress_updated.emit(75)
 
-        # Check modeling region IDs present in the prediction stage but absent in the fitting stage
-        id_difference, pre_model_region_id = self.check_modeling_region_ids(csv, out_fn1)
+        # The capped adjustment is solved directly on the bins, so no iterations are needed
+        iteration_count = 0
+        self.adjusted_prediction_density_map(tabulation_bin_id_VP_masked, bin_ids, densities, risk30_vp, AR, out_fn2,
+                                            out_fn1)
+        self.replace_ref_system(municipality, out_fn2)
 
-        # If there are missing bins, calculate the relative frequency and create a new csv file
-        if id_difference.size > 0:
-            csv=self.calculate_missing_bins_rf(id_difference, csv,pre_model_region_id)
+        self.rasters.close()
+        self.progress_updated.emit(100)
 
-        self.progress_updated.emit(40)
+        return id_difference, iteration_count
 
-        prediction_density_arr = self.calculate_prediction_density_arr(risk30_vp, tabulation_bin_id_VP_masked,csv)
-        self.progress_updated.emit(50)
-        AR = self.calculate_adjustment_ratio(prediction_density_arr, expected_deforestation)
-        self.progress_updated.emit(75)
-        # Set a maximum number of iterations to avoid infinite loop
-        iteration_count = 0
-        new_prediction_density_arr = None
-
-        # When AR > 1.00001 and iteration_count <= max_iterations, treat the result as new prediction density map to iterate the AR util AR is <=1.00001 or iteration_count = max_iterations
-        while AR > 1.00001 and iteration_count <= max_iterations:
-            new_prediction_density_arr = self.adjusted_prediction_density_array(prediction_density_arr, risk30_vp, AR)
-            AR = self.calculate_adjustment_ratio(new_prediction_density_arr, expected_deforestation)
-            prediction_density_arr = new_prediction_density_arr
-            iteration_count += 1
-            # Emitting progress based on the current iteration_count and max_iterations
-        if iteration_count <= int(max_iterations):
-            selected_density_arr = new_prediction_density_arr if new_prediction_density_arr is not None else prediction_density_arr
-            self.adjusted_prediction_density_map(selected_density_arr, risk30_vp, AR, out_fn2)
+    def execute_workflow_vp_scenarios(self, directory, csv, municipality, expected_deforestations, risk30_vp, out_fn1,
+                                      out_fn2s, workers=1):
+        '''
+        Create workflow function for several VP scenarios: the modeling region map and bin table are computed once,
+        the AR is solved for every expected deforestation and one adjusted prediction density map is written per scenario
+        :param expected_deforestations: list of expected deforestation (ha), one per scenario, or a single value
+        :param out_fn2s: list of adjusted prediction density map names, one per scenario, or a single name
+        :param workers: number of maps written at the same time; None uses all cores
+        :return: id_difference: modeling region IDs missing in the fitting stage, ARs: Adjustment Ratio of each scenario
+        '''
+        expected_deforestations = np.atleast_1d(expected_deforestations).tolist()
+        if isinstance(out_fn2s, str):
+            out_fn2s = [out_fn2s]
+        if len(expected_deforestations) != len(out_fn2s):
+            raise ValueError("Please enter one Adjusted Prediction Density Map name per expected deforestation!")
+
+        # Maps written at the same time must not share a file, nor overwrite the modeling region map
+        out_paths = [os.path.normcase(os.path.abspath(os.path.join(directory, out_fn)))
+                     for out_fn in [out_fn1] + list(out_fn2s)]
+        if len(set(out_paths)) != len(out_paths):
+            raise ValueError("The Adjusted Prediction Density Map names must be different from each other and from the "
+                             "Prediction Modeling Region Map name!")
+
+        id_difference, tabulation_bin_id_VP_masked, bin_ids, densities, counts = self.prepare_prediction(
+            directory, csv, municipality, risk30_vp, out_fn1)
+        maximum_density = self.rasters.pixel_area(risk30_vp)
+        ARs = [self.solve_adjustment_ratio(densities, counts, expected_deforestation, maximum_density)
+               for expected_deforestation in expected_deforestations]
+        self.progress_updated.emit(60)
+
+        # Each map is its own GDAL dataset, so the maps can be written in parallel
+        def write_map(AR, out_fn2):
+            self.adjusted_prediction_density_map(tabulation_bin_id_VP_masked, bin_ids, densities, risk30_vp, AR, out_fn2,
+                                                out_fn1)
+            return out_fn2
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = [executor.submit(write_map, AR, out_fn2) for AR, out_fn2 in zip(ARs, out_fn2s)]
+            for i, future in enumerate(futures):
+                future.result()
+                self.progress_updated.emit(60 + int(35 * (i + 1) / len(futures)))
+
+        # replace_ref_system uses a shared temporary file, so it runs after the writes
+        for out_fn2 in out_fn2s:
             self.replace_ref_system(municipality, out_fn2)
-        else:
-            print("Maximum number of iterations reached. Please reset the maximum number of iterations.")
 
+        self.rasters.close()
         self.progress_updated.emit(100)
 
-        return id_difference, iteration_count
+        return id_difference, ARs
 
-    def check_modeling_region_ids(self, csv, out_fn):
+    def check_modeling_region_ids(self, csv, bin_ids):
         '''
         Check modeling region IDs present in the prediction stage but absent in the fitting stage.
-        :param csv: csv file of relative frequency in fitiing stage
-        :param out_fn: modeling region image in prediction stage
-        :return: id_difference: A set of modeling region IDs np array that exist only in the prediction stage
+        :param csv: relative frequency table of the fitting stage, file or DataFrame
+        :param bin_ids: modeling region ids of the prediction stage, e.g. the bin ids of bin_pixel_counts
+        :return: id_difference: A set of modeling region IDs np array that exist only in the prediction stage,
+                 pre_model_region_id: Prediction modeling region ID np array
         '''
-        fit_model_region_id = pd.read_csv(csv)['ID'].to_numpy()
-        pre_model_region_arr = self.image_to_array(out_fn)
-        pre_model_region_id = np.unique(pre_model_region_arr[pre_model_region_arr != 0])
+        fit_model_region_id = self.read_relative_frequency_table(csv)['ID'].to_numpy()
+        pre_model_region_id = np.unique(bin_ids[bin_ids != 0])
         id_difference = np.setdiff1d(pre_model_region_id, fit_model_region_id)
 
         return id_difference, pre_model_region_id
 
-    def calculate_missing_bins_rf (self, id_difference, csv, pre_model_region_id):
+    def calculate_missing_bins_rf (self, id_difference, csv, pre_model_region_id, multiplier=1000, out_csv=None):
         '''
         If one or more empty bins are found, compute the jurisdiction-wide weighted average of relative frequencies for
-        missing bins and create a new csv file
-        :param csv: csv file of relative frequency in the fitting stage
+        missing bins
+        :param csv: relative frequency table of the fitting stage, file or DataFrame
         :param id_difference: A set of modeling region IDs np array that exist only in the prediction stage
         :param pre_model_region_id: Prediction modeling region ID np array
-        :return
+        :param multiplier: vulnerability class multiplier of the modeling region ids
+        :param out_csv: table file of the fitting stage; if given, the adjusted table is also saved next to it as
+                        <name>_adjusted_for_prediction.csv
+        :return: df_new_cnf: relative frequency table of the prediction modeling regions
         '''
         # Convert modeling region ids to vulnerability zone id
-        df=pd.read_csv(csv)
-        df['v_zone'] = (df['ID'] // 1000).astype(int)
+        df = self.read_relative_frequency_table(csv).copy()
+        df['v_zone'] = (df['ID'] // multiplier).astype(int)
 
         # Convert missing bin ids to vulnerability zone id
-        missing_v_zone = [x // 1000 for x in id_difference]
+        missing_v_zone = np.asarray(id_difference) // multiplier
 
         # Select rows
         filtered_df = df[df['v_zone'].isin(missing_v_zone)].copy()
@@ -553,7 +807,7 @@ class AllocationTool(QObject):
 
 
         # Save the new result to csv
-        base, ext = os.path.splitext(csv)
-        new_csv = f"{base}_adjusted_for_prediction{ext}"
-        df_new_cnf.to_csv(new_csv, index=False)
-        return new_csv
\ No newline at end of file
+        if out_csv is not None:
+            base, ext = os.path.splitext(out_csv)
+            df_new_cnf.to_csv(f"{base}_adjusted_for_prediction.csv", index=False)
+        return df_new_cnf
\ No newline at end of file
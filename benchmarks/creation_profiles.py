@@ -0,0 +1,139 @@
+'''
+Benchmark of the GeoTIFF creation profiles of raster_stack.CREATION_PROFILES.
+
+For each profile, a class map (Int16, like the vulnerability and modeling region maps) and a density map (Float32,
+like the fitted and adjusted density maps) are written window by window with RasterWriter and read back window by
+window with RasterStack. The file size and the write and read times are reported:
+
+    python benchmarks/creation_profiles.py --size 8000 --repeat 3 --csv creation_profiles.csv
+
+An existing map can be used instead of the synthetic ones with --image; it is written in its own data type.
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from osgeo import gdal, gdal_array, osr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from raster_stack import RasterStack, CREATION_PROFILES
+
+# GDAL exceptions
+gdal.UseExceptions()
+
+def synthetic_maps(size, seed=0):
+    '''
+    Spatially correlated test maps, so that compression ratios are close to those of real maps
+    :param size: number of rows and columns
+    :param seed: random seed
+    :return: dictionary of map name to NumPy array
+    '''
+    rng = np.random.default_rng(seed)
+    # Smooth field from coarse noise upsampled to the map size
+    coarse = rng.random((size // 64 + 2, size // 64 + 2))
+    field = np.kron(coarse, np.ones((64, 64)))[:size, :size]
+    field += rng.random((size, size)) * 0.05
+    field /= field.max()
+
+    # 30 geometric classes and 0 outside a circular jurisdiction
+    rows, cols = np.ogrid[:size, :size]
+    inside = (rows - size / 2) ** 2 + (cols - size / 2) ** 2 < (0.45 * size) ** 2
+    classes = np.where(inside, np.ceil(field * 30), 0).astype(np.int16)
+    density = np.where(inside, field * 0.04, 0).astype(np.float32)
+    return {'classes': classes, 'density': density}
+
+def write_template(arr, out_fn):
+    '''
+    Write an uncompressed GeoTIFF whose size, projection and geotransform the benchmark outputs copy
+    :param arr: NumPy array
+    :param out_fn: path to the file to create
+    '''
+    out_ds = gdal.GetDriverByName('GTiff').Create(out_fn, arr.shape[1], arr.shape[0], 1,
+                                                   gdal_array.NumericTypeCodeToGDALTypeCode(arr.dtype),
+                                                   options=['BIGTIFF=YES'])
+    out_ds.SetGeoTransform((500000.0, 30.0, 0.0, 1000000.0, 0.0, -30.0))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32619)
+    out_ds.SetProjection(srs.ExportToWkt())
+    out_ds.GetRasterBand(1).WriteArray(arr)
+    out_ds = None
+
+def file_size(image):
+    '''
+    :param image: raster path
+    :return: total size in bytes of the files of the dataset
+    '''
+    in_ds = gdal.Open(image)
+    file_list = in_ds.GetFileList()
+    in_ds = None
+    return sum(os.path.getsize(file_name) for file_name in file_list)
+
+def benchmark_profile(profile, template, data_type, out_fn):
+    '''
+    Write and read back one map with a creation profile
+    :param profile: key of CREATION_PROFILES
+    :param template: raster with the data to write
+    :param data_type: GDAL data type of the output
+    :param out_fn: path to the file to create
+    :return: (write seconds, read seconds, file size in bytes)
+    '''
+    rasters = RasterStack(profile)
+    start = time.perf_counter()
+    with rasters.writer(template, out_fn, data_type) as writer:
+        for xoff, yoff, xsize, ysize in writer.windows():
+            writer.write(rasters.read_window(template, (xoff, yoff, xsize, ysize)), xoff, yoff)
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for window in rasters.windows(out_fn):
+        rasters.read_window(out_fn, window)
+    read_time = time.perf_counter() - start
+    rasters.close()
+    return write_time, read_time, file_size(out_fn)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare file size and write/read time of the creation profiles.')
+    parser.add_argument('--size', type=int, default=4000, help='rows and columns of the synthetic maps')
+    parser.add_argument('--image', help='benchmark an existing map instead of the synthetic ones')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per profile, the fastest is reported')
+    parser.add_argument('--csv', help='also save the results to this csv file')
+    args = parser.parse_args(argv)
+
+    temp_dir = tempfile.mkdtemp(prefix='udef_arp_profiles_')
+    try:
+        if args.image:
+            templates = {os.path.basename(args.image): args.image}
+        else:
+            templates = {}
+            for name, arr in synthetic_maps(args.size).items():
+                templates[name] = os.path.join(temp_dir, f'{name}_template.tif')
+                write_template(arr, templates[name])
+
+        rows = []
+        for name, template in templates.items():
+            in_ds = gdal.Open(template)
+            data_type = in_ds.GetRasterBand(1).DataType
+            in_ds = None
+            for profile in CREATION_PROFILES:
+                out_fn = os.path.join(temp_dir, f'{name}_{profile}.tif')
+                runs = [benchmark_profile(profile, template, data_type, out_fn) for _ in range(args.repeat)]
+                rows.append({'map': name, 'profile': profile,
+                             'size (MB)': runs[-1][2] / 2 ** 20,
+                             'write (s)': min(run[0] for run in runs),
+                             'read (s)': min(run[1] for run in runs)})
+                os.remove(out_fn)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False, float_format='{:.3f}'.format))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
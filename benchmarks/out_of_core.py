@@ -0,0 +1,138 @@
+'''
+Benchmark of the in-memory and out-of-core CNF/VP prediction.
+
+A synthetic vulnerability map, subdivision map and relative frequency table are written once, then the VP prediction
+(execute_workflow_vp) is run with out_of_core=False and out_of_core=True. Each run is a separate process, so that
+the peak resident memory of one mode does not hide the other. Reported per mode:
+    - tabulation (s): writing the modeling region map and counting the pixels of each bin
+      (tabulation_bin_id_VP + bin_pixel_counts in memory, tabulation_bin_counts_VP out of core)
+    - workflow (s): the whole VP prediction, including the adjusted prediction density map
+    - numpy peak (MB): peak of the memory allocated by NumPy and Python, from tracemalloc
+    - max RSS (MB): peak resident memory of the process, including GDAL (not available on Windows)
+
+    python benchmarks/out_of_core.py --size 8000 --csv out_of_core.csv
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from allocation_tool import AllocationTool
+from creation_profiles import synthetic_maps, write_template
+
+MODES = {'in memory': False, 'out of core': True}
+
+def max_rss():
+    '''
+    :return: peak resident memory of the process in MB, or None where the resource module is not available
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+def write_inputs(size, directory):
+    '''
+    Write the vulnerability map, the subdivision map and a relative frequency table covering all of their bins
+    :param size: number of rows and columns
+    :param directory: output directory
+    :return: (risk30_vp, municipality, csv) paths
+    '''
+    risk30 = synthetic_maps(size)['classes']
+    # 16 subdivisions in a 4 x 4 layout
+    rows, cols = np.indices(risk30.shape)
+    municipality = (rows * 4 // size * 4 + cols * 4 // size + 1).astype(np.int16)
+
+    risk30_vp = os.path.join(directory, 'risk30_vp.tif')
+    municipality_fn = os.path.join(directory, 'municipality.tif')
+    write_template(risk30, risk30_vp)
+    write_template(municipality, municipality_fn)
+
+    bin_ids = np.unique(risk30.astype(np.int32) * 1000 + municipality)
+    bin_ids = bin_ids[bin_ids >= 1000]
+    rng = np.random.default_rng(1)
+    csv = os.path.join(directory, 'relative_frequency.csv')
+    pd.DataFrame({'ID': bin_ids,
+                  'Total Deforestation(pixel)': np.zeros(len(bin_ids)),
+                  'Area of the Bin(pixel)': np.ones(len(bin_ids)),
+                  'Average Deforestation(pixel)': rng.random(len(bin_ids)) * 0.2}).to_csv(csv, index=False)
+    return risk30_vp, municipality_fn, csv
+
+def run_mode(directory, out_of_core):
+    '''
+    Run the VP prediction in one mode
+    :param directory: directory of the inputs written by write_inputs
+    :param out_of_core: AllocationTool out_of_core option
+    :return: dictionary of the measures
+    '''
+    risk30_vp = os.path.join(directory, 'risk30_vp.tif')
+    municipality = os.path.join(directory, 'municipality.tif')
+    csv = os.path.join(directory, 'relative_frequency.csv')
+    suffix = 'out_of_core' if out_of_core else 'in_memory'
+    out_fn1 = os.path.join(directory, f'region_{suffix}.tif')
+    out_fn2 = os.path.join(directory, f'density_{suffix}.tif')
+
+    tracemalloc.start()
+    allocation_tool = AllocationTool(out_of_core=out_of_core)
+    encoding = allocation_tool.region_encoding(risk30_vp, municipality)
+    start = time.perf_counter()
+    if out_of_core:
+        allocation_tool.tabulation_bin_counts_VP(risk30_vp, municipality, out_fn1, encoding)
+    else:
+        allocation_tool.bin_pixel_counts(allocation_tool.tabulation_bin_id_VP(risk30_vp, municipality, out_fn1,
+                                                                              encoding))
+    tabulation_time = time.perf_counter() - start
+    allocation_tool.rasters.close()
+
+    start = time.perf_counter()
+    allocation_tool.execute_workflow_vp(directory, None, csv, municipality, 1000.0, risk30_vp, out_fn1, out_fn2)
+    workflow_time = time.perf_counter() - start
+    _, numpy_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'tabulation (s)': tabulation_time, 'workflow (s)': workflow_time,
+            'numpy peak (MB)': numpy_peak / 2 ** 20, 'max RSS (MB)': max_rss()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare time and peak memory of the in-memory and out-of-core '
+                                                 'VP prediction.')
+    parser.add_argument('--size', type=int, default=4000, help='rows and columns of the synthetic maps')
+    parser.add_argument('--csv', help='also save the results to this csv file')
+    parser.add_argument('--run-mode', choices=list(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Child process: run one mode on the inputs of the parent and print the measures
+    if args.run_mode:
+        print(json.dumps(run_mode(args.directory, MODES[args.run_mode])))
+        return 0
+
+    temp_dir = tempfile.mkdtemp(prefix='udef_arp_out_of_core_')
+    try:
+        write_inputs(args.size, temp_dir)
+        rows = []
+        for mode in MODES:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-mode', mode,
+                                     '--directory', temp_dir], check=True, capture_output=True, text=True).stdout
+            rows.append({'mode': mode, **json.loads(output.strip().splitlines()[-1])})
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False, float_format='{:.3f}'.format))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+'''
+Benchmark of the relative frequency tabulation of create_relative_frequency_table.
+
+The combined np.bincount tabulation (one pass over the bin ids, deforestation read window by window) is timed
+against the original implementation, inlined below as reference_relative_frequency_table: two
+np.unique(return_counts=True) calls, one for the bin areas and one for the deforested pixels, and a pandas outer
+merge. Both write the same csv, which is checked. The default size is a 20000 x 20000 map, about 2.5 GB of memory
+for the ids, the deforestation map and the reference:
+
+    python benchmarks/relative_frequency.py --size 20000 --repeat 3 --csv relative_frequency.csv
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from osgeo import gdal, osr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from allocation_tool import AllocationTool
+
+# GDAL exceptions
+gdal.UseExceptions()
+
+def synthetic_bin_ids(size, seed=0):
+    '''
+    Modeling region ids of a circular jurisdiction: 30 classes in 64 x 64 pixel patches and 16 subdivisions in a
+    4 x 4 layout, built at the patch scale and upsampled so that no float array of the map size is needed
+    :param size: number of rows and columns
+    :param seed: random seed
+    :return: int16 NumPy array of ids, 0 outside the jurisdiction
+    '''
+    rng = np.random.default_rng(seed)
+    n_patches = -(-size // 64)
+    rows, cols = np.indices((n_patches, n_patches))
+    classes = rng.integers(1, 31, (n_patches, n_patches))
+    subdivisions = rows * 4 // n_patches * 4 + cols * 4 // n_patches + 1
+    inside = (rows - n_patches / 2) ** 2 + (cols - n_patches / 2) ** 2 < (0.45 * n_patches) ** 2
+    patch_ids = np.where(inside, classes * 1000 + subdivisions, 0).astype(np.int16)
+    return np.repeat(np.repeat(patch_ids, 64, axis=0), 64, axis=1)[:size, :size]
+
+def write_deforestation(bin_ids, out_fn, rate=0.05, seed=1):
+    '''
+    Write a Byte deforestation map, deforested pixels drawn at random inside the jurisdiction, strip by strip
+    :param bin_ids: modeling region ids
+    :param out_fn: path to the file to create
+    :param rate: probability of deforestation of a pixel
+    :param seed: random seed
+    '''
+    rows, cols = bin_ids.shape
+    out_ds = gdal.GetDriverByName('GTiff').Create(out_fn, cols, rows, 1, gdal.GDT_Byte,
+                                                   options=['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    out_ds.SetGeoTransform((500000.0, 30.0, 0.0, 1000000.0, 0.0, -30.0))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32619)
+    out_ds.SetProjection(srs.ExportToWkt())
+    out_band = out_ds.GetRasterBand(1)
+    rng = np.random.default_rng(seed)
+    for yoff in range(0, rows, 1024):
+        strip = bin_ids[yoff:yoff + 1024]
+        out_band.WriteArray(((rng.random(strip.shape) < rate) & (strip != 0)).astype(np.uint8), 0, yoff)
+    out_ds = None
+
+def reference_relative_frequency_table(tabulation_bin_id_masked, deforestation_hrp, csv_name):
+    '''
+    Original create_relative_frequency_table: np.unique of the bin ids and of the deforested bin ids, then an outer
+    merge of the two tables
+    :param tabulation_bin_id_masked: modeling region ids
+    :param deforestation_hrp: deforestation map
+    :param csv_name: csv to write
+    :return: merged_df: relative frequency dataframe
+    '''
+    unique, counts = np.unique(tabulation_bin_id_masked[tabulation_bin_id_masked != 0], return_counts=True)
+    arr_counts = np.asarray((unique, counts)).T
+
+    in_ds = gdal.Open(deforestation_hrp)
+    arr3 = in_ds.GetRasterBand(1).ReadAsArray()
+    in_ds = None
+
+    deforestation_within_bin = tabulation_bin_id_masked * arr3
+    unique1, counts1 = np.unique(deforestation_within_bin[deforestation_within_bin != 0], return_counts=True)
+    arr_counts_deforestion = np.asarray((unique1, counts1)).T
+
+    df1 = pd.DataFrame(arr_counts_deforestion, columns=['ID', 'Total Deforestation(pixel)'])
+    df2 = pd.DataFrame(arr_counts, columns=['ID', 'Area of the Bin(pixel)'])
+    merged_df = pd.merge(df1, df2, on='ID', how='outer').fillna(0)
+    merged_df['Average Deforestation(pixel)'] = merged_df.iloc[:, 1].astype(float) / merged_df.iloc[:, 2].astype(float)
+    merged_df = merged_df.sort_values(by='ID').reset_index(drop=True)
+    merged_df.to_csv(csv_name, index=False)
+    return merged_df
+
+def time_best(function, repeat):
+    '''
+    :param function: function without arguments
+    :param repeat: number of runs
+    :return: shortest run time in seconds
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the bincount relative frequency tabulation with the '
+                                                 'original np.unique and merge tabulation.')
+    parser.add_argument('--size', type=int, default=20000, help='rows and columns of the synthetic maps')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each implementation, the best is reported')
+    parser.add_argument('--csv', help='also save the results to this csv file')
+    args = parser.parse_args(argv)
+
+    temp_dir = tempfile.mkdtemp(prefix='udef_arp_relative_frequency_')
+    try:
+        bin_ids = synthetic_bin_ids(args.size)
+        deforestation_hrp = os.path.join(temp_dir, 'deforestation_hrp.tif')
+        write_deforestation(bin_ids, deforestation_hrp)
+        reference_csv = os.path.join(temp_dir, 'reference.csv')
+        bincount_csv = os.path.join(temp_dir, 'bincount.csv')
+
+        allocation_tool = AllocationTool()
+        reference_time = time_best(lambda: reference_relative_frequency_table(bin_ids, deforestation_hrp,
+                                                                              reference_csv), args.repeat)
+        bincount_time = time_best(lambda: allocation_tool.create_relative_frequency_table(bin_ids, deforestation_hrp,
+                                                                                          bincount_csv), args.repeat)
+        allocation_tool.rasters.close()
+        with open(reference_csv) as reference_file, open(bincount_csv) as bincount_file:
+            same_table = reference_file.read() == bincount_file.read()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = pd.DataFrame([{'size': args.size, 'unique + merge (s)': reference_time, 'bincount (s)': bincount_time,
+                             'speedup': reference_time / bincount_time, 'same table': same_table}])
+    print(results.to_string(index=False, float_format='{:.3f}'.format))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+    return 0 if same_table else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Extension of the binary relative frequency table
+BIN_TABLE_EXTENSION = '.npz'
+
+# Columns of the relative frequency table, in order
+BIN_TABLE_COLUMNS = ['ID', 'Total Deforestation(pixel)', 'Area of the Bin(pixel)', 'Average Deforestation(pixel)']
+
+def is_bin_table(file_name):
+    '''
+    :param file_name: relative frequency table name
+    :return: True if the name is of a binary relative frequency table
+    '''
+    return os.path.splitext(str(file_name))[1].lower() == BIN_TABLE_EXTENSION
+
+def source_fingerprint(image):
+    '''
+    :param image: file path
+    :return: dictionary with the path, size and modification time of the file
+    '''
+    stat = os.stat(image)
+    return {'path': os.path.abspath(image), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def save_bin_table(merged_df, file_name, metadata=None):
+    '''
+    Save the relative frequency table as typed columns, so that it is loaded without parsing and floats are exact
+    :param merged_df: relative frequency table
+    :param file_name: .npz file name
+    :param metadata: JSON serializable dictionary saved with the table, e.g. pixel area, class count and sources
+    '''
+    columns = {f'column{i}': merged_df[column].to_numpy() for i, column in enumerate(BIN_TABLE_COLUMNS)}
+    with open(file_name, 'wb') as write_file:
+        np.savez(write_file, metadata=np.array(json.dumps(metadata or {})), **columns)
+
+def load_bin_table(file_name):
+    '''
+    Load a binary relative frequency table
+    :param file_name: .npz file name
+    :return: merged_df: relative frequency table, metadata: dictionary saved with the table
+    '''
+    with np.load(file_name, allow_pickle=False) as table:
+        merged_df = pd.DataFrame({column: table[f'column{i}'] for i, column in enumerate(BIN_TABLE_COLUMNS)})
+        metadata = json.loads(str(table['metadata']))
+    return merged_df, metadata
+
+def check_bin_table(file_name, metadata, multiplier):
+    '''
+    Check that a binary relative frequency table can be used with the prediction inputs
+    :param file_name: .npz file name
+    :param metadata: dictionary saved with the table
+    :param multiplier: vulnerability class multiplier of the prediction modeling region ids
+    '''
+    # The ids of the table are only comparable with ids encoded with the same multiplier
+    fit_multiplier = metadata.get('multiplier')
+    if fit_multiplier is not None and fit_multiplier != multiplier:
+        raise ValueError(f"The modeling region IDs of {os.path.basename(file_name)} use the multiplier {fit_multiplier}, "
+                         f"but the prediction maps need {multiplier}. Please use subdivision maps with the same "
+                         f"IDs in the fitting and prediction stages!")
+
+    # A fitting map changed since the table was saved makes the table stale; maps that were moved are not checked
+    for name, fingerprint in metadata.get('sources', {}).items():
+        if os.path.exists(fingerprint['path']) and source_fingerprint(fingerprint['path']) != fingerprint:
+            raise ValueError(f"{fingerprint['path']} ({name}) changed after {os.path.basename(file_name)} was saved. "
+                             f"Please run the fitting stage again!")
@@ -4,15 +4,14 @@ from osgeo import gdal, osr, ogr
 from osgeo.gdalconst import *
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.spatial import Voronoi
 import scipy.stats as stats
 import geopandas as gpd
 import shapely
 import seaborn as sns
-from shapely.geometry import Point
 import pandas as pd
-from PyQt5.QtCore import QObject, pyqtSignal
 import shutil
+from raster_stack import RasterStack, DEFAULT_PROFILE
+from progress import ProgressReporter
 from geopandas import GeoDataFrame
 import plotly.graph_objects as go
 import plotly.io as pio
@@ -20,11 +19,11 @@ import plotly.io as pio
 # GDAL exceptions
 gdal.UseExceptions()
 
-class ModelEvaluation(QObject):
-    progress_updated = pyqtSignal(int)
-    def __init__(self):
-        super(ModelEvaluation, self).__init__()
+class ModelEvaluation:
+    def __init__(self, progress_callback=None, creation_profile=DEFAULT_PROFILE):
+        self.progress_updated = ProgressReporter(progress_callback)
         self.data_folder = None
+        self.rasters = RasterStack(creation_profile)
 
     def set_working_directory(self, directory: object) -> object:
         '''
@@ -34,15 +33,7 @@ class ModelEvaluation(QObject):
         self.progress_updated.emit(0)
         self.data_folder = directory
         os.chdir(self.data_folder)
-
-    def image_to_array(self,image):
-        # Set up a GDAL dataset
-        in_ds = gdal.Open(image)
-        # Set up a GDAL band
-        in_band = in_ds.GetRasterBand(1)
-        # Create Numpy Array1
-        arr = in_band.ReadAsArray()
-        return arr
+        self.rasters.close()
 
     def array_to_image(self, in_fn, out_fn, data, data_type, nodata=None):
         '''
@@ -54,22 +45,8 @@ class ModelEvaluation(QObject):
          :param nodata:optional NoData value
          :return:
         '''
-        in_ds = gdal.Open(in_fn)
-        output_format = out_fn.split('.')[-1].upper()
-        if (output_format == 'TIF'):
-            output_format = 'GTIFF'
-        elif (output_format == 'RST'):
-            output_format = 'rst'
-        driver = gdal.GetDriverByName(output_format)
-        out_ds = driver.Create(out_fn, in_ds.RasterXSize, in_ds.RasterYSize, 1, data_type, options=["BigTIFF=YES"])
-        out_band = out_ds.GetRasterBand(1)
-        out_ds.SetGeoTransform(in_ds.GetGeoTransform())
-        out_ds.SetProjection(in_ds.GetProjection().encode('utf-8', 'backslashreplace').decode('utf-8'))
-        if nodata is not None:
-            out_band.SetNoDataValue(nodata)
-        out_band.WriteArray(data)
-        out_band.FlushCache()
-        out_ds.FlushCache()
+        with self.rasters.writer(in_fn, out_fn, data_type, nodata) as writer:
+            writer.write(data)
         return
 
     def replace_ref_system(self, in_fn, out_fn):
@@ -167,121 +144,140 @@ class ModelEvaluation(QObject):
         self.progress_updated.emit(20)
         return
 
-    def bbox_to_pixel_offsets(self,gt, bbox):
-        '''
-        https://gist.github.com/perrygeo/5667173
-        '''
-        originX = gt[0]
-        originY = gt[3]
-        pixel_width = gt[1]
-        pixel_height = gt[5]
-        x1 = int((bbox[0] - originX) / pixel_width)
-        x2 = int((bbox[1] - originX) / pixel_width) + 1
-
-        y1 = int((bbox[3] - originY) / pixel_height)
-        y2 = int((bbox[2] - originY) / pixel_height) + 1
-
-        xsize = x2 - x1
-        ysize = y2 - y1
-        return (x1, y1, xsize, ysize)
-
-    def zonal_stats(self, vector_path, raster_path, nodata_value=None, global_src_extent=False):
+    def rasterize_zones(self, vector_path):
         '''
-        https://gist.github.com/perrygeo/5667173
+        Copy the polygons to an in-memory layer where each polygon holds its 1-based index (in layer order), so that
+        one RasterizeLayer call burns all of them into a label raster
+        :param vector_path: polygon vector datasource
+        :return: zones_ds: OGR Memory datasource with the 'zones' layer, n_zones: number of polygons
         '''
-        rds = gdal.Open(raster_path, GA_ReadOnly)
-        assert (rds)
-        rb = rds.GetRasterBand(1)
-        rgt = rds.GetGeoTransform()
-
-        if nodata_value:
-            nodata_value = float(nodata_value)
-            rb.SetNoDataValue(nodata_value)
-
-        vds = ogr.Open(vector_path, GA_ReadOnly)  # TODO maybe open update if we want to write stats
-        assert (vds)
+        vds = ogr.Open(vector_path, GA_ReadOnly)
         vlyr = vds.GetLayer(0)
 
-        # create an in-memory numpy array of the source raster data
-        # covering the whole extent of the vector layer
-        if global_src_extent:
-            # use global source extent
-            # useful only when disk IO or raster scanning inefficiencies are your limiting factor
-            # advantage: reads raster data in one pass
-            # disadvantage: large vector extents may have big memory requirements
-            src_offset = self.bbox_to_pixel_offsets(rgt, vlyr.GetExtent())
-            src_array = rb.ReadAsArray(*src_offset)
-
-            # calculate new geotransform of the layer subset
-            new_gt = (
-                (rgt[0] + (src_offset[0] * rgt[1])),
-                rgt[1],
-                0.0,
-                (rgt[3] + (src_offset[1] * rgt[5])),
-                0.0,
-                rgt[5]
-            )
-
-        mem_drv = ogr.GetDriverByName('Memory')
-        driver = gdal.GetDriverByName('MEM')
-
-        # Loop through vectors
-        stats = []
+        zones_ds = ogr.GetDriverByName('Memory').CreateDataSource('zones')
+        zones_layer = zones_ds.CreateLayer('zones', vlyr.GetSpatialRef(), ogr.wkbUnknown)
+        zones_layer.CreateField(ogr.FieldDefn('zone', ogr.OFTInteger))
+        n_zones = 0
         feat = vlyr.GetNextFeature()
         while feat is not None:
-
-            if not global_src_extent:
-                # use local source extent
-                # fastest option when you have fast disks and well indexed raster (ie tiled Geotiff)
-                # advantage: each feature uses the smallest raster chunk
-                # disadvantage: lots of reads on the source raster
-                src_offset = self.bbox_to_pixel_offsets(rgt, feat.geometry().GetEnvelope())
-                src_array = rb.ReadAsArray(*src_offset)
-
-                # calculate new geotransform of the feature subset
-                new_gt = (
-                    (rgt[0] + (src_offset[0] * rgt[1])),
-                    rgt[1],
-                    0.0,
-                    (rgt[3] + (src_offset[1] * rgt[5])),
-                    0.0,
-                    rgt[5]
-                )
-
-            # Create a temporary vector layer in memory
-            mem_ds = mem_drv.CreateDataSource('out')
-            mem_layer = mem_ds.CreateLayer('poly', None, ogr.wkbPolygon)
-            mem_layer.CreateFeature(feat.Clone())
-
-            # Rasterize it
-            rvds = driver.Create('', src_offset[2], src_offset[3], 1, gdal.GDT_Byte)
-            rvds.SetGeoTransform(new_gt)
-            gdal.RasterizeLayer(rvds, [1], mem_layer, burn_values=[1])
-            rv_array = rvds.ReadAsArray()
-
-            # Mask the source data array with our current feature
-            # we take the logical_not to flip 0<->1 to get the correct mask effect
-            # we also mask out nodata values explictly
-            masked = np.ma.MaskedArray(
-                src_array,
-                mask=np.logical_or(
-                    src_array == nodata_value,
-                    np.logical_not(rv_array)
-                )
-            )
-
-            feature_stats = {
-                'sum': float(masked.sum())}
-
-            stats.append(feature_stats)
-
-            rvds = None
-            mem_ds = None
+            n_zones += 1
+            zone_feat = ogr.Feature(zones_layer.GetLayerDefn())
+            zone_feat.SetGeometry(feat.GetGeometryRef())
+            zone_feat.SetField('zone', n_zones)
+            zones_layer.CreateFeature(zone_feat)
             feat = vlyr.GetNextFeature()
 
         vds = None
-        rds = None
-        return stats
+        return zones_ds, n_zones
+
+    def rasterize_window(self, zones_ds, in_fn, window):
+        '''
+        Rasterize the zones over one window of in_fn, so that only a window-sized label raster is held in memory
+        :param zones_ds: zones datasource from rasterize_zones
+        :param in_fn: datasource to copy the grid and projection from
+        :param window: (xoff, yoff, xsize, ysize)
+        :return: labels: Int32 array of the window, with the 1-based index of the polygon covering each pixel and 0
+                 outside the polygons
+        '''
+        xoff, yoff, xsize, ysize = window
+        gt = self.rasters.geotransform(in_fn)
+
+        # Same grid as in_fn, with the origin moved to the upper left corner of the window
+        window_gt = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+                     gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+        labels_ds = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Int32)
+        labels_ds.SetGeoTransform(window_gt)
+        labels_ds.SetProjection(self.rasters.dataset(in_fn).GetProjection())
+
+        # Only the polygons overlapping the window are burnt
+        xs = [window_gt[0] + col * gt[1] + row * gt[2] for col in (0, xsize) for row in (0, ysize)]
+        ys = [window_gt[3] + col * gt[4] + row * gt[5] for col in (0, xsize) for row in (0, ysize)]
+        zones_layer = zones_ds.GetLayer(0)
+        zones_layer.SetSpatialFilterRect(min(xs), min(ys), max(xs), max(ys))
+        gdal.RasterizeLayer(labels_ds, [1], zones_layer, options=["ATTRIBUTE=zone"])
+        zones_layer.SetSpatialFilter(None)
+
+        labels = labels_ds.GetRasterBand(1).ReadAsArray()
+        labels_ds = None
+        return labels
+
+    def zonal_table(self, zones_ds, n_zones, raster_paths, statistics=('sum',), nodata_value=None):
+        '''
+        Zonal statistics of several rasters over the zones in one traversal: the zones are rasterized once per window
+        and every raster adds its window to the running statistics
+        :param zones_ds: zones datasource from rasterize_zones
+        :param n_zones: number of zones
+        :param raster_paths: list of value rasters on the same grid, the zones are rasterized on the grid of the first
+        :param statistics: statistics among 'sum', 'count', 'mean', 'min' and 'max'
+        :param nodata_value: optional value left out of the statistics
+        :return: table: DataFrame with one row per zone (zone 1 first) and one (raster, statistic) column per pair;
+                 mean, min and max are NaN in zones without values
+        '''
+        unknown = set(statistics) - {'sum', 'count', 'mean', 'min', 'max'}
+        if unknown:
+            raise ValueError(f"Unknown zonal statistics: {', '.join(sorted(unknown))}")
+
+        # Running sums, counts, minimums and maximums of each raster, label 0 (outside the polygons) included
+        sums = {raster_path: np.zeros(n_zones + 1) for raster_path in raster_paths}
+        counts = {raster_path: np.zeros(n_zones + 1, dtype=np.int64) for raster_path in raster_paths}
+        mins = {raster_path: np.full(n_zones + 1, np.inf) for raster_path in raster_paths}
+        maxs = {raster_path: np.full(n_zones + 1, -np.inf) for raster_path in raster_paths}
+
+        for window in self.rasters.windows(raster_paths[0]):
+            labels = self.rasterize_window(zones_ds, raster_paths[0], window).ravel()
+            for raster_path in raster_paths:
+                values = self.rasters.read_window(raster_path, window).ravel()
+                zones = labels
+                if nodata_value is not None:
+                    valid = values != nodata_value
+                    zones, values = labels[valid], values[valid]
+                sums[raster_path] += np.bincount(zones, weights=values, minlength=n_zones + 1)
+                counts[raster_path] += np.bincount(zones, minlength=n_zones + 1)
+                if 'min' in statistics:
+                    np.minimum.at(mins[raster_path], zones, values)
+                if 'max' in statistics:
+                    np.maximum.at(maxs[raster_path], zones, values)
+
+        columns = {}
+        for raster_path in raster_paths:
+            # Label 0 is outside the polygons
+            count = counts[raster_path][1:]
+            empty = count == 0
+            for statistic in statistics:
+                if statistic == 'sum':
+                    column = sums[raster_path][1:]
+                elif statistic == 'count':
+                    column = count
+                elif statistic == 'mean':
+                    column = np.where(empty, np.nan, sums[raster_path][1:] / np.maximum(count, 1))
+                elif statistic == 'min':
+                    column = np.where(empty, np.nan, mins[raster_path][1:])
+                else:
+                    column = np.where(empty, np.nan, maxs[raster_path][1:])
+                columns[(raster_path, statistic)] = column
+
+        return pd.DataFrame(columns, index=pd.RangeIndex(1, n_zones + 1, name='zone'))
+
+    def zonal_stats(self, vector_path, raster_paths, statistics=('sum',), nodata_value=None):
+        '''
+        Zonal statistics of one or more rasters within each polygon of a vector datasource
+        :param vector_path: polygon vector datasource
+        :param raster_paths: value raster, or list of value rasters on the same grid
+        :param statistics: statistics among 'sum', 'count', 'mean', 'min' and 'max'
+        :param nodata_value: optional value left out of the statistics
+        :return: stats: for a single raster, list of {statistic: value} in the order of the polygons;
+                 for a list of rasters, the DataFrame of zonal_table
+        '''
+        single = isinstance(raster_paths, str)
+        if single:
+            raster_paths = [raster_paths]
+        zones_ds, n_zones = self.rasterize_zones(vector_path)
+        table = self.zonal_table(zones_ds, n_zones, raster_paths, statistics, nodata_value)
+        zones_ds = None
+        if single:
+            return [{statistic: float(row[(raster_paths[0], statistic)]) for statistic in statistics}
+                    for _, row in table.iterrows()]
+        return table
 
     def vector_to_raster(self,vector_fn,in_fn,raster_fn,data_type, nodata=None):
         '''
@@ -297,21 +293,8 @@ class ModelEvaluation(QObject):
         source_ds = ogr.Open(vector_fn)
         source_layer = source_ds.GetLayer()
 
-        in_ds = gdal.Open(in_fn)
-        output_format = raster_fn.split('.')[-1].upper()
-        if (output_format == 'TIF'):
-            output_format = 'GTIFF'
-        elif (output_format == 'RST'):
-            output_format = 'rst'
-        driver = gdal.GetDriverByName(output_format)
-        out_ds = driver.Create(raster_fn, in_ds.RasterXSize, in_ds.RasterYSize, 1, data_type, options=["BigTIFF=YES"])
+        out_ds = self.rasters.create(in_fn, raster_fn, data_type, nodata)
         out_band = out_ds.GetRasterBand(1)
-        out_ds.SetGeoTransform(in_ds.GetGeoTransform())
-
-        out_ds.SetProjection(in_ds.GetProjection().encode('utf-8', 'backslashreplace').decode('utf-8'))
-
-        if nodata is not None:
-            out_band.SetNoDataValue(nodata)
         # Rasterize
         gdal.RasterizeLayer(out_ds, [1], source_layer, options=["ATTRIBUTE=Residuals"])
 
@@ -342,6 +325,37 @@ class ModelEvaluation(QObject):
 
         return thiessen_gdf
 
+    def assessment_grid_cells(self, mask, grid_size):
+        '''
+        Thiessen polygons of the systematic sample points, one point every grid_size pixels from one grid cell before
+        the first row/column to one after the last. The points form a square lattice, so the polygons are the squares
+        centred on the points; the points on the edge of the lattice have open polygons and get no cell, like the
+        Voronoi ridges that go to infinity.
+        The cells are the same as those of scipy's Voronoi and shapely.ops.polygonize, but in row-major order (left to
+        right, from the first to the last raster row). The order of polygonize follows the ridge order of qhull, which
+        depends on the absolute coordinates of the points: the same raster moved by one pixel can give its cells in
+        another order. That order cannot be derived from the grid, so the cell IDs of create_thiessen_polygon are
+        row-major and differ from those of runs made with the Voronoi construction.
+        :param mask: mask of the jurisdiction (binary map)
+        :param grid_size: distance between sample points (pixels)
+        :return: cells: array of square polygons in row-major order
+        '''
+        cols, rows = self.rasters.size(mask)
+        gt = self.rasters.geotransform(mask)
+
+        # Systematic Sampling, without the edge of the lattice
+        x = np.arange(-1 * grid_size, cols + 1 * grid_size, grid_size)[1:-1]
+        y = np.arange(-1 * grid_size, rows + 1 * grid_size, grid_size)[1:-1]
+        grid_x, grid_y = np.meshgrid(x, y)
+
+        # Convert raster coordinates to geographic coordinates
+        center_x = gt[0] + grid_x.ravel() * gt[1]
+        center_y = gt[3] + grid_y.ravel() * gt[5]
+
+        half_width = grid_size * abs(gt[1]) / 2
+        half_height = grid_size * abs(gt[5]) / 2
+        return shapely.box(center_x - half_width, center_y - half_height, center_x + half_width, center_y + half_height)
+
     def create_thiessen_polygon (self, grid_area, mask, density, deforestation, out_fn, raster_fn):
         '''
           Create thiessen polygon
@@ -352,43 +366,15 @@ class ModelEvaluation(QObject):
          :param csv_name:Name of performance chart
          :return  clipped_gdf: thiessen polygon dataframe
         '''
-        ## Create sample points:
+        ## Create the assessment grid:
         # Open the Polygonized_Mask shapefile
         mask_df = gpd.GeoDataFrame.from_file('POLYGONIZED_MASK.shp')
 
         # Calculate grid size
-        in_ds = gdal.Open(mask)
-        grid_size = int(np.sqrt(grid_area * 10000)) // int(in_ds.GetGeoTransform()[1])
-
-        # Systematic Sampling
-        sample_points = []
-        for y in range(-1 * grid_size, in_ds.RasterYSize + 1 * grid_size, grid_size):
-            for x in range(-1 * grid_size, in_ds.RasterXSize + 1 * grid_size, grid_size):
-                # Convert raster coordinates to geographic coordinates
-                geo_x = in_ds.GetGeoTransform()[0] + x * in_ds.GetGeoTransform()[1]
-                geo_y = in_ds.GetGeoTransform()[3] + y * in_ds.GetGeoTransform()[5]
-                sample_points.append((geo_x, geo_y))
-
-        # Convert sample_points list to DataFrame
-        df = pd.DataFrame(sample_points, columns=['geo_x', 'geo_y'])
-        df['coords'] = list(zip(df['geo_x'], df['geo_y']))
-        df['coords_P'] = df['coords'].apply(Point)
-        points_df = gpd.GeoDataFrame(df, geometry='coords_P', crs=mask_df.crs)
-
-        # Convert the 'coords' column to a numpy array
-        coords = np.array(points_df['coords'].tolist())
+        grid_size = int(np.sqrt(grid_area * 10000)) // int(self.rasters.resolution(mask))
 
         ## Create thiessen polygon
-        vor = Voronoi(points=coords)
-
-        # Polygonize the line ridge is not infinity
-        lines = [shapely.geometry.LineString(vor.vertices[line]) for line in
-                 vor.ridge_vertices if -1 not in line]
-
-        polys = shapely.ops.polygonize(lines)
-
-        # Convert Voronoi polygons (polys) into a GeoDataFrame.
-        voronois = gpd.GeoDataFrame(geometry=gpd.GeoSeries(polys), crs=mask_df.crs)
+        voronois = gpd.GeoDataFrame(geometry=self.assessment_grid_cells(mask, grid_size), crs=mask_df.crs)
         self.progress_updated.emit(30)
 
         # Ensure Thiessen Polygon cells retain 99.9% of maximum size after intersection with study area
@@ -414,28 +400,24 @@ class ModelEvaluation(QObject):
         vector_temp_path = "temp_vector.shp"
         clipped_gdf.to_file(vector_temp_path)
 
-        # Actual Deforestation(ha)
-        stats = self.zonal_stats(vector_temp_path, deforestation, nodata_value=0)
-
+        # Sum both maps in one traversal, rasterizing the cells window by window
+        zones_ds, n_zones = self.rasterize_zones(vector_temp_path)
         self.progress_updated.emit(50)
+        zonal_df = self.zonal_table(zones_ds, n_zones, [deforestation, density], nodata_value=0)
+        zones_ds = None
+        self.progress_updated.emit(60)
 
         # Calculate areal_resolution_of_map_pixels
-        in_ds4 = gdal.Open(density)
-        P1 = in_ds4.GetGeoTransform()[1]
-        P2 = abs(in_ds4.GetGeoTransform()[5])
-        areal_resolution_of_map_pixels = P1 * P2 / 10000
+        areal_resolution_of_map_pixels = self.rasters.pixel_area(density)
 
-        # Add the results back to the GeoDataFrame
-        clipped_gdf['Actual Deforestation(ha)'] = [(item['sum'] if item['sum'] is not None else 0) * areal_resolution_of_map_pixels for item in stats]
-        self.progress_updated.emit(60)
+        # Actual Deforestation(ha)
+        clipped_gdf['Actual Deforestation(ha)'] = zonal_df[(deforestation, 'sum')].to_numpy() * areal_resolution_of_map_pixels
 
         # Predicted Deforestation(ha)
-        stats1 = self.zonal_stats(vector_temp_path, density, nodata_value=0)
+        clipped_gdf['Predicted Deforestation(ha)'] = zonal_df[(density, 'sum')].to_numpy()
         self.progress_updated.emit(70)
 
-        clipped_gdf['Predicted Deforestation(ha)'] = [(item['sum'] if item['sum'] is not None else 0) for item in stats1]
-
-        # ID
+        # ID, in the row-major order of assessment_grid_cells
         clipped_gdf['ID'] = range(1, len(clipped_gdf) + 1)
 
         # Replace NaN or blank values with '0'
@@ -466,20 +448,138 @@ class ModelEvaluation(QObject):
 
         return clipped_gdf
 
+    def grid_cell_index(self, window, grid_size, n_cells_x, n_cells_y, offset=(0.5, 0.5)):
+        '''
+        Assessment grid cell of each pixel of a window, from the pixel row and column: a pixel belongs to the square
+        of assessment_grid_cells that contains its centre
+        :param window: (xoff, yoff, xsize, ysize) window
+        :param grid_size: distance between sample points (pixels)
+        :param n_cells_x: number of cells per row
+        :param n_cells_y: number of cells per column
+        :param offset: (x, y) position in the pixel used instead of the centre, in pixels
+        :return: cell_index: row-major cell index of each pixel, n_cells_x * n_cells_y where there is no cell
+        '''
+        xoff, yoff, xsize, ysize = window
+
+        # Cell k is centred on pixel coordinate k * grid_size
+        cell_x = np.floor((np.arange(xoff, xoff + xsize) + offset[0] + grid_size / 2) / grid_size).astype(np.int64)
+        cell_y = np.floor((np.arange(yoff, yoff + ysize) + offset[1] + grid_size / 2) / grid_size).astype(np.int64)
+        n_cells = n_cells_x * n_cells_y
+        cell_index = cell_y[:, None] * n_cells_x + cell_x[None, :]
+        return np.where((cell_y[:, None] < n_cells_y) & (cell_x[None, :] < n_cells_x), cell_index, n_cells)
+
+    def create_grid_evaluation(self, grid_area, mask, density, deforestation, out_fn, raster_fn):
+        '''
+        Raster version of create_thiessen_polygon: the cells of the square assessment grid are found from the pixel
+        rows and columns instead of polygons, so the mask is not polygonized and no shapefile is written or read.
+        Cells keep the pixels of the mask whose centre falls in them. The area of a cell within the mask is measured at
+        four points of each pixel, which is exact as the cell edges run along pixel edges or through pixel centres.
+         :param grid_area: assessment grid cell area or 100,000 (ha)
+         :param mask: mask of the jurisdiction (binary map)
+         :param density: adjusted prediction density map
+         :param deforestation:Deforestation Map during the HRP
+         :param out_fn: name of performance chart, the csv is saved next to it
+         :param raster_fn: residual map
+         :return  grid_df: dataframe with the ID, ActualDef, PredDef, Residuals and Area_ha of each cell
+        '''
+        self.progress_updated.emit(20)
+
+        # Calculate grid size
+        grid_size = int(np.sqrt(grid_area * 10000)) // int(self.rasters.resolution(mask))
+
+        # Cells of the sample points not on the edge of the lattice, as in assessment_grid_cells
+        cols, rows = self.rasters.size(mask)
+        n_cells_x = len(np.arange(-1 * grid_size, cols + 1 * grid_size, grid_size)) - 2
+        n_cells_y = len(np.arange(-1 * grid_size, rows + 1 * grid_size, grid_size)) - 2
+        n_cells = n_cells_x * n_cells_y
+
+        # Measure the mask area (pixels) and sum deforestation and density of each cell; the last bin collects the
+        # pixels outside the mask or outside the cells
+        mask_area = np.zeros(n_cells + 1)
+        actual_sums = np.zeros(n_cells + 1)
+        predicted_sums = np.zeros(n_cells + 1)
+        for window in self.rasters.windows(mask):
+            mask_window = self.rasters.read_binary(mask, window)
+            for offset in ((0.25, 0.25), (0.75, 0.25), (0.25, 0.75), (0.75, 0.75)):
+                cell_index = self.grid_cell_index(window, grid_size, n_cells_x, n_cells_y, offset)
+                cell_index = np.where(mask_window, cell_index, n_cells).ravel()
+                mask_area += np.bincount(cell_index, minlength=n_cells + 1) / 4
+
+            cell_index = self.grid_cell_index(window, grid_size, n_cells_x, n_cells_y)
+            cell_index = np.where(mask_window, cell_index, n_cells).ravel()
+            actual_sums += np.bincount(cell_index, weights=self.rasters.read_window(deforestation, window).ravel(),
+                                       minlength=n_cells + 1)
+            predicted_sums += np.bincount(cell_index, weights=self.rasters.read_window(density, window).ravel(),
+                                          minlength=n_cells + 1)
+        self.progress_updated.emit(50)
+
+        # Ensure cells retain 99.9% of maximum size within the study area
+        mask_area = mask_area[:n_cells]
+        cells = np.flatnonzero(mask_area > 0)
+        cells = cells[mask_area[cells] / mask_area[cells].max() > 0.999] if cells.size > 0 else cells
+
+        # Calculate areal_resolution_of_map_pixels
+        areal_resolution_of_map_pixels = self.rasters.pixel_area(density)
+
+        grid_df = pd.DataFrame({'ID': range(1, len(cells) + 1),
+                                'Actual Deforestation(ha)': actual_sums[cells] * areal_resolution_of_map_pixels,
+                                'Predicted Deforestation(ha)': predicted_sums[cells],
+                                'Area_ha': mask_area[cells] * areal_resolution_of_map_pixels})
+
+        # Calculate residuals
+        grid_df['Residuals(ha)'] = grid_df['Predicted Deforestation(ha)'] - grid_df['Actual Deforestation(ha)']
+        self.progress_updated.emit(60)
+
+        # Export to csv
+        csv_file_path = out_fn.split('.')[0]+'.csv'
+        grid_df.to_csv(csv_file_path, columns=['ID', 'Actual Deforestation(ha)', 'Predicted Deforestation(ha)','Residuals(ha)'],
+                       index=False)
+
+        # Create residual map: the residual of the cell inside the kept cells and the mask, 0 elsewhere
+        residuals = np.zeros(n_cells + 1, dtype=np.float32)
+        residuals[cells] = grid_df['Residuals(ha)'].to_numpy()
+        with self.rasters.writer(mask, raster_fn, gdal.GDT_Float32, -1) as writer:
+            for window in writer.windows():
+                xoff, yoff, xsize, ysize = window
+                cell_index = self.grid_cell_index(window, grid_size, n_cells_x, n_cells_y)
+                cell_index = np.where(self.rasters.read_binary(mask, window), cell_index, n_cells)
+                writer.write(residuals[cell_index], xoff, yoff)
+        self.progress_updated.emit(70)
+
+        # Same column names as the shapefile of create_thiessen_polygon
+        grid_df = grid_df.rename(columns={'Predicted Deforestation(ha)': 'PredDef',
+                                          'Actual Deforestation(ha)': 'ActualDef',
+                                          'Residuals(ha)': 'Residuals'})
+        return grid_df
+
     def create_deforestation_map (self, fmask, deforestation_cal, deforestation_cnf, out_fn_def):
+        '''
+        Create the combined deforestation reference map, window by window: 1 forest, 2 deforestation in the CAL,
+        3 deforestation in the CNF
+        :param fmask: mask of forest areas in the CAL
+        :param deforestation_cal: map of deforestation in the CAL
+        :param deforestation_cnf: map of deforestation in the CNF
+        :param out_fn_def: name of the combined deforestation reference map
+        :return:
+        '''
         self.progress_updated.emit(80)
-        arr_fmask = self.image_to_array(fmask)
-        arr_def_cal = self.image_to_array(deforestation_cal)
-        arr_def_cnf = self.image_to_array(deforestation_cnf)
+        with self.rasters.writer(fmask, out_fn_def, gdal.GDT_Int16, -1) as writer:
+            for xoff, yoff, xsize, ysize in writer.windows():
+                window = (xoff, yoff, xsize, ysize)
+                # Binary maps are read as bool arrays
+                arr_fmask = self.rasters.read_binary(fmask, window)
+                arr_def_cal = self.rasters.read_binary(deforestation_cal, window)
+                arr_def_cnf = self.rasters.read_binary(deforestation_cnf, window)
 
-        deforestation_arr=np.copy(arr_fmask)
+                deforestation_arr = arr_fmask.astype(np.uint8)
 
-        deforestation_arr[arr_def_cnf == 1] = 3
-        deforestation_arr[(arr_def_cnf == 0) & (arr_def_cal == 1)] = 2
-        deforestation_arr[(arr_def_cnf == 0) & (arr_def_cal == 0) & (arr_fmask == 1)] = 1
+                deforestation_arr[arr_def_cnf] = 3
+                deforestation_arr[~arr_def_cnf & arr_def_cal] = 2
+                deforestation_arr[~arr_def_cnf & ~arr_def_cal & arr_fmask] = 1
 
-        #write deforestation_map
-        self.array_to_image(fmask, out_fn_def, deforestation_arr, gdal.GDT_Int16, -1)
+                #write deforestation_map
+                writer.write(deforestation_arr, xoff, yoff)
+        self.rasters.close()
 
         return
 
@@ -732,6 +832,9 @@ class ModelEvaluation(QObject):
         return
 
     def remove_temp_files(self):
+        # Close the cached input datasets before deleting files
+        self.rasters.close()
+
         # Files to check for and delete
         mask_file = 'mask'
         shapefiles_to_delete = ["TEMP_POLYGONIZED","POLYGONIZED_MASK","thiessen_polygon_temp","temp_vector"]
@@ -0,0 +1,213 @@
+import numpy as np
+from osgeo import gdal
+
+# GDAL exceptions
+gdal.UseExceptions()
+
+# Signed integer types for modeling region ids, from the narrowest to the widest
+ID_TYPES = [(np.int16, gdal.GDT_Int16), (np.int32, gdal.GDT_Int32), (np.int64, gdal.GDT_Int64)]
+
+# Float32 holds every integer up to 2^24 exactly
+FLOAT32_EXACT = 2 ** 24
+
+# Counts and look-up tables are dense over the id range up to this range, or while the range is at most the number of
+# pixels counted (counts) or DENSE_RANGE_RATIO times the number of ids (look-up tables); wider ranges use the ids
+DENSE_RANGE = 2 ** 16
+DENSE_RANGE_RATIO = 16
+
+# Before the encoding is known, (class, subdivision) pairs are keyed as class * PAIR_MULTIPLIER + subdivision, which
+# holds any signed 32-bit subdivision id
+PAIR_MULTIPLIER = 2 ** 32
+
+class ModelingRegionEncoding:
+    '''
+    Encoding of the modeling region ids: id = vulnerability class * multiplier + subdivision.
+    The multiplier is 1000, or the next power of ten above the largest subdivision id when there are 1000 or more
+    subdivisions, and ids are stored in the narrowest integer type that holds every id instead of always int16.
+    '''
+    def __init__(self, class_range, subdivision_range):
+        '''
+        :param class_range: (minimum, maximum) of the vulnerability map
+        :param subdivision_range: (minimum, maximum) of the subdivision map
+        '''
+        low_class, high_class = (int(value) for value in class_range)
+        low_subdivision, high_subdivision = (int(value) for value in subdivision_range)
+        self.class_range = (low_class, high_class)
+        self.subdivision_range = (low_subdivision, high_subdivision)
+        self.multiplier = max(1000, 10 ** len(str(max(abs(low_subdivision), abs(high_subdivision)))))
+
+        # Pixels with a class <= 0 are multiplied by their class instead of 1 (0 outside the mask), as before
+        classes = {0, low_class, high_class}
+        if low_class < 0:
+            classes.add(min(high_class, -1))
+        if high_class > 0:
+            classes.add(max(low_class, 1))
+        ids = [(c * self.multiplier + s) * (1 if c > 0 else c) for c in classes
+               for s in (low_subdivision, high_subdivision)]
+        self.min_id = min(ids)
+        self.max_id = max(ids)
+
+        for dtype, data_type in ID_TYPES:
+            type_info = np.iinfo(dtype)
+            if type_info.min <= self.min_id and self.max_id <= type_info.max:
+                self.dtype = dtype
+                self.data_type = data_type
+                break
+
+    def output_data_type(self, out_fn):
+        '''
+        GDAL data type of a modeling region map file. The RST format only stores Byte, Int16 and Float32 rasters,
+        so ids wider than int16 are written to RST as Float32.
+        :param out_fn: modeling region map name
+        :return: GDAL data type
+        '''
+        if out_fn.split('.')[-1].lower() != 'rst' or self.data_type == gdal.GDT_Int16:
+            return self.data_type
+        if -FLOAT32_EXACT <= self.min_id and self.max_id <= FLOAT32_EXACT:
+            return gdal.GDT_Float32
+        raise ValueError(f"The modeling region IDs range from {self.min_id} to {self.max_id}, more than an .rst map can "
+                         f"store exactly. Please enter .tif extension in the name of the Modeling Region Map!")
+
+    def encode(self, arr1, arr2):
+        '''
+        Calculate the modeling region ids
+        :param arr1: vulnerability class array
+        :param arr2: subdivision array
+        :return: modeling region id array
+        '''
+        # Create a mask where the risk30 value larger than 1 reclassed into 1
+        mask_arr = np.where(arr1 > 0, 1, arr1)
+
+        # Calculate tabulation bin id with mask, in the id type as the class maps may be read as narrower types
+        tabulation_bin_id = np.add(np.multiply(arr1, self.multiplier, dtype=self.dtype, casting='unsafe'), arr2,
+                                   dtype=self.dtype, casting='unsafe')
+        return np.multiply(tabulation_bin_id, mask_arr, dtype=self.dtype, casting='unsafe')
+
+    def vulnerability_zone(self, ids):
+        '''
+        Convert modeling region ids to vulnerability zone ids
+        :param ids: modeling region ids
+        :return: vulnerability zone ids
+        '''
+        return np.asarray(ids) // self.multiplier
+
+def count_ids(ids, deforestation=False):
+    '''
+    Count the pixels and the deforested pixels of each id of an array in one np.bincount: the index is
+    2 * id + deforestation, so even entries are non-deforested and odd entries deforested pixels.
+    The bincount spans the id range of the array, or only its distinct ids (np.unique) when that range is wider than
+    the array, so that wide encodings (e.g. code-style subdivision ids) never allocate the whole id range.
+    :param ids: id array
+    :param deforestation: deforestation bool array of the same shape, or a bool for the whole array
+    :return: bin_ids: sorted ids present in the array, counts: (bin_ids, 2) array of non-deforested and deforested
+             pixels of each id
+    '''
+    ids = np.ravel(ids)
+    deforestation = np.ravel(deforestation)
+    if ids.size == 0:
+        return ids, np.zeros((0, 2), dtype=np.int64)
+
+    low = int(ids.min())
+    high = int(ids.max())
+    if high - low < max(ids.size, DENSE_RANGE):
+        index = (ids.astype(np.intp) - low) * 2 + deforestation
+        counts = np.bincount(index, minlength=2 * (high - low + 1)).reshape(-1, 2)
+        present = np.flatnonzero(counts.any(axis=1))
+        return (present + low).astype(ids.dtype), counts[present].astype(np.int64, copy=False)
+
+    bin_ids, inverse = np.unique(ids, return_inverse=True)
+    counts = np.bincount(inverse.ravel() * 2 + deforestation, minlength=2 * len(bin_ids)).reshape(-1, 2)
+    return bin_ids, counts.astype(np.int64, copy=False)
+
+def add_counts(bin_counts, window_counts):
+    '''
+    Add the counts of a window to the running counts; only the ids seen so far are kept
+    :param bin_counts: (bin_ids, counts) so far, or None to start
+    :param window_counts: (bin_ids, counts) of the window, from count_ids
+    :return: bin_counts: (bin_ids, counts) of the ids of both, sorted
+    '''
+    if bin_counts is None:
+        return window_counts
+    bin_ids, counts = bin_counts
+    window_ids, window_count = window_counts
+
+    # Grow the table when the window has new ids
+    all_ids = np.union1d(bin_ids, window_ids)
+    if len(all_ids) != len(bin_ids):
+        grown = np.zeros((len(all_ids), counts.shape[1]), dtype=counts.dtype)
+        grown[np.searchsorted(all_ids, bin_ids)] = counts
+        bin_ids, counts = all_ids, grown
+    counts[np.searchsorted(bin_ids, window_ids)] += window_count
+    return bin_ids, counts
+
+def count_pairs(classes, subdivisions, deforestation=False):
+    '''
+    Count the pixels and the deforested pixels of each (class, subdivision) pair of a window, for when the encoding
+    is not known yet. Pairs are numbered over the class and subdivision ranges of the window, so that count_ids
+    bincounts a small range, then keyed as class * PAIR_MULTIPLIER + subdivision.
+    :param classes: vulnerability class array
+    :param subdivisions: subdivision array
+    :param deforestation: deforestation bool array, or a bool for the whole window
+    :return: pair_counts: (pair_keys, counts), sorted keys and the non-deforested and deforested pixels of each pair
+    '''
+    classes = np.ravel(classes).astype(np.int64)
+    subdivisions = np.ravel(subdivisions).astype(np.int64)
+    if classes.size == 0:
+        return classes, np.zeros((0, 2), dtype=np.int64)
+
+    low_class = int(classes.min())
+    low_subdivision = int(subdivisions.min())
+    width = int(subdivisions.max()) - low_subdivision + 1
+    pair_ids, counts = count_ids((classes - low_class) * width + (subdivisions - low_subdivision), deforestation)
+    return (pair_ids // width + low_class) * PAIR_MULTIPLIER + pair_ids % width + low_subdivision, counts
+
+def pair_bin_counts(pair_counts, encoding):
+    '''
+    Convert the counts of (class, subdivision) pairs to the counts of their modeling region ids
+    :param pair_counts: (pair_keys, counts) from count_pairs and add_counts
+    :param encoding: ModelingRegionEncoding
+    :return: bin_counts: (bin_ids, counts) of each modeling region id, sorted
+    '''
+    pair_keys, counts = pair_counts
+    classes = (pair_keys + PAIR_MULTIPLIER // 2) // PAIR_MULTIPLIER
+    subdivisions = pair_keys - classes * PAIR_MULTIPLIER
+
+    # Pairs outside the mask all have the id 0
+    bin_ids, inverse = np.unique(encoding.encode(classes, subdivisions), return_inverse=True)
+    bin_counts = np.zeros((len(bin_ids), counts.shape[1]), dtype=counts.dtype)
+    np.add.at(bin_counts, inverse.ravel(), counts)
+    return bin_ids, bin_counts
+
+class LookupTable:
+    '''
+    Look-up table from id to value, so that an id array is mapped with one gather. While the id range is small the
+    table is dense over it and ids index it directly; for wider ranges (e.g. code-style subdivision ids) only the
+    sorted ids are kept and ids are first compacted to their position with np.searchsorted.
+    '''
+    def __init__(self, ids, values):
+        '''
+        :param ids: ids of the table; every id of the arrays to map must be one of them or 0, which maps to 0
+        :param values: value of each id
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        values = np.asarray(values)
+        order = np.argsort(ids, kind='stable')
+        self.ids = ids[order]
+        self.values = values[order]
+
+        self.offset = min(int(self.ids.min()), 0)
+        high = max(int(self.ids.max()), 0)
+        self.lookup = None
+        if high - self.offset < max(DENSE_RANGE, DENSE_RANGE_RATIO * len(self.ids)):
+            self.lookup = np.zeros(high - self.offset + 1, dtype=self.values.dtype)
+            self.lookup[self.ids - self.offset] = self.values
+
+    def map(self, arr):
+        '''
+        :param arr: id array
+        :return: value array of the same shape
+        '''
+        if self.lookup is not None:
+            return self.lookup[arr - self.offset]
+        index = np.minimum(np.searchsorted(self.ids, arr), len(self.ids) - 1)
+        return np.where(self.ids[index] == arr, self.values[index], 0).astype(self.values.dtype, copy=False)
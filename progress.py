@@ -0,0 +1,39 @@
+class ProgressReporter:
+    '''
+    Progress notifications of an engine. Callbacks are called with the percentage done (0-100).
+    It has the connect()/emit() interface of a pyqtSignal(int) without needing Qt, so the engines can
+    run in scripts and worker processes; UDef-ARP.py forwards it to a Qt signal for the dialogs.
+    '''
+    def __init__(self, callback=None):
+        self.callbacks = []
+        if callback is not None:
+            self.connect(callback)
+
+    def connect(self, callback):
+        '''
+        Register a callback
+        :param callback: callable taking the percentage done
+        '''
+        self.callbacks.append(callback)
+
+    def disconnect(self, callback=None):
+        '''
+        Remove a callback, or all of them
+        :param callback: registered callable, or None for all
+        '''
+        if callback is None:
+            self.callbacks = []
+        else:
+            self.callbacks.remove(callback)
+
+    def emit(self, value):
+        '''
+        Report progress to every callback
+        :param value: percentage done
+        '''
+        for callback in list(self.callbacks):
+            callback(value)
+
+    def __getstate__(self):
+        # Callbacks (e.g. Qt slots) are bound to the sending process and are not pickled
+        return {'callbacks': []}
@@ -0,0 +1,365 @@
+import os
+import threading
+import numpy as np
+from osgeo import gdal, gdal_array
+
+# GDAL exceptions
+gdal.UseExceptions()
+
+# Approximate number of pixels read per window by the streaming functions
+BLOCK_PIXELS = 2 ** 22
+
+# GeoTIFF creation profiles; BigTIFF is always used so that large jurisdictions can be written
+CREATION_PROFILES = {
+    'striped': ['BIGTIFF=YES'],
+    'deflate': ['BIGTIFF=YES', 'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=DEFLATE', 'NUM_THREADS=ALL_CPUS'],
+    'zstd': ['BIGTIFF=YES', 'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=ZSTD', 'NUM_THREADS=ALL_CPUS'],
+    'lzw': ['BIGTIFF=YES', 'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=LZW', 'NUM_THREADS=ALL_CPUS'],
+}
+DEFAULT_PROFILE = 'deflate'
+
+# GDAL integer data types, from the narrowest to the widest
+INTEGER_TYPES = [gdal.GDT_Byte, gdal.GDT_Int16, gdal.GDT_UInt16, gdal.GDT_Int32, gdal.GDT_UInt32]
+
+class RasterStack:
+    '''
+    Shared raster access for a workflow. Each image is opened once and the dataset handle, geotransform,
+    pixel area and NoData value are cached until close() is called.
+    GDAL handles are not thread safe, so every thread gets its own dataset handles.
+    '''
+    def __init__(self, creation_profile=DEFAULT_PROFILE):
+        '''
+        :param creation_profile: name of the GeoTIFF creation profile of the outputs, a key of CREATION_PROFILES
+        '''
+        if creation_profile not in CREATION_PROFILES:
+            raise ValueError(f"Unknown creation profile '{creation_profile}', expected one of "
+                             f"{', '.join(CREATION_PROFILES)}")
+        self.thread_data = threading.local()
+        self.info = {}
+        self.creation_profile = creation_profile
+
+    def dataset(self, image):
+        '''
+        Get the cached GDAL dataset of an image, opening it on first use
+        :param image: raster path
+        :return: GDAL dataset
+        '''
+        datasets = getattr(self.thread_data, 'datasets', None)
+        if datasets is None:
+            datasets = self.thread_data.datasets = {}
+        key = os.path.abspath(image)
+        if key not in datasets:
+            datasets[key] = gdal.Open(image)
+        return datasets[key]
+
+    def band(self, image):
+        '''
+        Get band 1 of an image
+        :param image: raster path
+        :return: GDAL band
+        '''
+        return self.dataset(image).GetRasterBand(1)
+
+    def image_info(self, image):
+        '''
+        Get the cached metadata of an image
+        :param image: raster path
+        :return: dictionary with geotransform, size, pixel_area (ha), nodata and block_size
+        '''
+        key = os.path.abspath(image)
+        if key not in self.info:
+            in_ds = self.dataset(image)
+            in_band = in_ds.GetRasterBand(1)
+            geotransform = in_ds.GetGeoTransform()
+            self.info[key] = {
+                'geotransform': geotransform,
+                'projection': in_ds.GetProjection(),
+                'size': (in_ds.RasterXSize, in_ds.RasterYSize),
+                # Calculate areal_resolution_of_map_pixels
+                'pixel_area': geotransform[1] * abs(geotransform[5]) / 10000,
+                'nodata': in_band.GetNoDataValue(),
+                'block_size': in_band.GetBlockSize(),
+            }
+        return self.info[key]
+
+    def geotransform(self, image):
+        return self.image_info(image)['geotransform']
+
+    def resolution(self, image):
+        return self.image_info(image)['geotransform'][1]
+
+    def pixel_area(self, image):
+        '''
+        Areal resolution of the map pixels in hectares
+        :param image: raster path
+        :return: pixel area (ha)
+        '''
+        return self.image_info(image)['pixel_area']
+
+    def nodata(self, image):
+        return self.image_info(image)['nodata']
+
+    def size(self, image):
+        '''
+        :param image: raster path
+        :return: (cols, rows)
+        '''
+        return self.image_info(image)['size']
+
+    def value_range(self, image):
+        '''
+        Exact minimum and maximum of band 1, computed once and cached.
+        Stored statistics are not used, as they may be approximate or out of date.
+        :param image: raster path
+        :return: (minimum, maximum)
+        '''
+        info = self.image_info(image)
+        if 'value_range' not in info:
+            info['value_range'] = tuple(self.band(image).ComputeRasterMinMax(False))
+        return info['value_range']
+
+    def window_range(self, image, arr):
+        '''
+        Exact minimum and maximum of a window already read, NoData pixels left out as in value_range, so that the
+        range of a raster can be collected while it is read window by window
+        :param image: raster path
+        :param arr: NumPy array of a window of the raster
+        :return: (minimum, maximum), or None if the window only holds NoData
+        '''
+        nodata = self.nodata(image)
+        if nodata is not None:
+            arr = arr[arr != nodata]
+        if arr.size == 0:
+            return None
+        return arr.min(), arr.max()
+
+    def read(self, image):
+        '''
+        Read band 1 in full
+        :param image: raster path
+        :return: arr: NumPy array
+        '''
+        return self.band(image).ReadAsArray()
+
+    def read_window(self, image, window):
+        '''
+        Read one window of band 1
+        :param image: raster path
+        :param window: (xoff, yoff, xsize, ysize) window
+        :return: arr: NumPy array of the window
+        '''
+        return self.band(image).ReadAsArray(*window)
+
+    def read_binary(self, image, window=None):
+        '''
+        Read a binary (0/1) map as a bool array, whatever its stored data type: every non-zero value is True.
+        Uncompressed RST/GeoTIFF files are memory-mapped, other formats are read in their own data type.
+        :param image: raster path
+        :param window: optional (xoff, yoff, xsize, ysize) window, the full raster if None
+        :return: arr: bool NumPy array
+        '''
+        if window is None:
+            window = (0, 0) + self.size(image)
+        xoff, yoff, xsize, ysize = window
+
+        mapped = self.memory_map(image)
+        if mapped is not None:
+            return np.not_equal(mapped[yoff:yoff + ysize, xoff:xoff + xsize], 0)
+
+        # Compare in the stored data type, so that e.g. -1 or 0.5 are True as in the memory-mapped case
+        return np.not_equal(self.band(image).ReadAsArray(xoff, yoff, xsize, ysize), 0)
+
+    def read_classes(self, image, window=None):
+        '''
+        Read an integer class map in the narrowest integer type that holds its exact minimum, maximum and NoData value.
+        Maps stored as floating point are read in their own data type.
+        :param image: raster path
+        :param window: optional (xoff, yoff, xsize, ysize) window, the full raster if None
+        :return: arr: NumPy array
+        '''
+        if window is None:
+            window = (0, 0) + self.size(image)
+
+        in_band = self.band(image)
+        buf_type = None
+        if in_band.DataType in INTEGER_TYPES:
+            # NoData pixels are not part of the computed range but are still read
+            values = list(self.value_range(image))
+            if self.nodata(image) is not None:
+                values.append(self.nodata(image))
+            low = min(values)
+            high = max(values)
+            for data_type in INTEGER_TYPES:
+                type_info = np.iinfo(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+                if type_info.min <= low and high <= type_info.max:
+                    buf_type = data_type
+                    break
+        return in_band.ReadAsArray(*window, buf_type=buf_type)
+
+    def memory_map(self, image):
+        '''
+        Memory-map an uncompressed single band raster stored in row order (RST, or striped uncompressed GeoTIFF)
+        :param image: raster path
+        :return: read-only np.memmap of shape (rows, cols), or None if the file layout does not allow it
+        '''
+        key = os.path.abspath(image)
+        info = self.image_info(image)
+        if 'memory_map' in info:
+            return info['memory_map']
+
+        mapped = None
+        in_ds = self.dataset(image)
+        in_band = in_ds.GetRasterBand(1)
+        driver = in_ds.GetDriver().ShortName
+        cols, rows = info['size']
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(in_band.DataType)
+        if in_ds.RasterCount == 1 and dtype is not None:
+            dtype = np.dtype(dtype).newbyteorder('<')
+            if driver == 'RST':
+                # RST data files are headerless little-endian rows
+                mapped = np.memmap(image, dtype=dtype, mode='r', shape=(rows, cols))
+            elif (driver == 'GTiff' and in_ds.GetMetadataItem('COMPRESSION', 'IMAGE_STRUCTURE') is None
+                  and in_band.GetMetadataItem('NBITS', 'IMAGE_STRUCTURE') is None and info['block_size'][0] == cols):
+                # Strips must be little-endian and written back to back
+                with open(image, 'rb') as tif_file:
+                    little_endian = tif_file.read(2) == b'II'
+                block_rows = info['block_size'][1]
+                n_strips = -(-rows // block_rows)
+                first = in_band.GetMetadataItem('BLOCK_OFFSET_0_0', 'TIFF')
+                last = in_band.GetMetadataItem('BLOCK_OFFSET_0_%d' % (n_strips - 1), 'TIFF')
+                if little_endian and first is not None and last is not None:
+                    strip_bytes = block_rows * cols * dtype.itemsize
+                    if int(last) - int(first) == (n_strips - 1) * strip_bytes:
+                        mapped = np.memmap(image, dtype=dtype, mode='r', offset=int(first), shape=(rows, cols))
+
+        self.info[key]['memory_map'] = mapped
+        return mapped
+
+    def windows(self, image, max_pixels=BLOCK_PIXELS):
+        '''
+        Split a raster into row strips aligned to the GDAL block (tile) height
+        :param image: raster path
+        :param max_pixels: approximate number of pixels per window
+        :return: list of (xoff, yoff, xsize, ysize) windows
+        '''
+        cols, rows = self.size(image)
+        block_rows = self.image_info(image)['block_size'][1]
+
+        # Read whole blocks (tiles) at a time, as many block rows as fit in max_pixels
+        strip_rows = max(1, max_pixels // (cols * block_rows)) * block_rows
+        return [(0, yoff, cols, min(strip_rows, rows - yoff)) for yoff in range(0, rows, strip_rows)]
+
+    def creation_options(self, out_fn, data_type):
+        '''
+        GDAL creation options of the current creation profile
+        :param out_fn: path to the file to create
+        :param data_type: output data type
+        :return: list of creation options
+        '''
+        if out_fn.split('.')[-1].lower() != 'tif':
+            return []
+        options = list(CREATION_PROFILES[self.creation_profile])
+        if any(option.startswith('COMPRESS=') for option in options):
+            # Horizontal differencing for integers, floating point predictor for floats
+            if data_type in (gdal.GDT_Float32, gdal.GDT_Float64):
+                options.append('PREDICTOR=3')
+            else:
+                options.append('PREDICTOR=2')
+        return options
+
+    def create(self, in_fn, out_fn, data_type, nodata=None):
+        '''
+        Create an empty single band image with the size, projection and geotransform of in_fn
+        :param in_fn: datasource to copy projection and geotransform from
+        :param out_fn: path to the file to create (.tif or .rst)
+        :param data_type: output data type
+        :param nodata: optional NoData value
+        :return: out_ds: GDAL dataset opened for writing
+        '''
+        in_ds = self.dataset(in_fn)
+        output_format = out_fn.split('.')[-1].upper()
+        if (output_format == 'TIF'):
+            output_format = 'GTIFF'
+        elif (output_format == 'RST'):
+            output_format = 'rst'
+        driver = gdal.GetDriverByName(output_format)
+        out_ds = driver.Create(out_fn, in_ds.RasterXSize, in_ds.RasterYSize, 1, data_type,
+                               options=self.creation_options(out_fn, data_type))
+        out_ds.SetGeoTransform(in_ds.GetGeoTransform())
+        out_ds.SetProjection(in_ds.GetProjection().encode('utf-8', 'backslashreplace').decode('utf-8'))
+        out_band = out_ds.GetRasterBand(1)
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+        return out_ds
+
+    def writer(self, in_fn, out_fn, data_type, nodata=None):
+        '''
+        Create an image and return a RasterWriter to fill it window by window
+        :param in_fn: datasource to copy projection and geotransform from
+        :param out_fn: path to the file to create (.tif or .rst)
+        :param data_type: output data type
+        :param nodata: optional NoData value
+        :return: RasterWriter
+        '''
+        return RasterWriter(self.create(in_fn, out_fn, data_type, nodata))
+
+    def close(self):
+        '''
+        Close the datasets opened by the calling thread and forget the cached metadata
+        '''
+        self.thread_data.datasets = {}
+        self.info = {}
+
+    def __getstate__(self):
+        # GDAL handles cannot be pickled; a copy sent to another process opens its own
+        return {'creation_profile': self.creation_profile}
+
+    def __setstate__(self, state):
+        self.__init__(state['creation_profile'])
+
+
+class RasterWriter:
+    '''
+    Output image written window by window. The dataset is created up front, so producing a map
+    does not require the full result array in memory.
+    '''
+    def __init__(self, out_ds):
+        self.out_ds = out_ds
+        self.out_band = out_ds.GetRasterBand(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def windows(self, max_pixels=BLOCK_PIXELS):
+        '''
+        Split the output into row strips aligned to its block (tile) height, so that whole blocks are written at once
+        :param max_pixels: approximate number of pixels per window
+        :return: list of (xoff, yoff, xsize, ysize) windows
+        '''
+        cols = self.out_ds.RasterXSize
+        rows = self.out_ds.RasterYSize
+        block_rows = self.out_band.GetBlockSize()[1]
+        strip_rows = max(1, max_pixels // (cols * block_rows)) * block_rows
+        return [(0, yoff, cols, min(strip_rows, rows - yoff)) for yoff in range(0, rows, strip_rows)]
+
+    def write(self, data, xoff=0, yoff=0):
+        '''
+        Write an array at the given offset
+        :param data: NumPy array of a window (or of the full image)
+        :param xoff: column offset
+        :param yoff: row offset
+        '''
+        self.out_band.WriteArray(data, xoff, yoff)
+
+    def close(self):
+        '''
+        Flush and close the output dataset
+        '''
+        if self.out_ds is not None:
+            self.out_band.FlushCache()
+            self.out_ds.FlushCache()
+            self.out_band = None
+            self.out_ds = None
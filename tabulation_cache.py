@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from osgeo import gdal
+from bin_table import source_fingerprint
+
+# GDAL exceptions
+gdal.UseExceptions()
+
+# Change when the cached files change meaning, so that older entries are not used
+CACHE_VERSION = 2
+
+# Default size cap of the cache
+DEFAULT_MAX_BYTES = 10 * 2 ** 30
+
+class TabulationCache:
+    '''
+    On-disk cache of the prediction modeling region maps, their bin id arrays and per-bin pixel counts.
+    Entries are keyed by the fingerprints (path, size, modification time and content hash) of the vulnerability
+    and subdivision maps, so a repeated CNF/VP run on the same inputs skips the tabulation step. The value ranges of
+    the two maps are kept with each entry, so that the modeling region encoding is known without reading the maps.
+    The least recently used entries are removed when the cache grows over max_bytes.
+    '''
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        '''
+        :param cache_dir: cache directory, created if needed
+        :param max_bytes: size cap of the cache
+        '''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def content_hash(self, image):
+        '''
+        SHA-256 of a file. Hashes are remembered by path, size and modification time, so unchanged files
+        are only read once; only the latest hash of each path is kept, and files that no longer exist are forgotten.
+        :param image: file path
+        :return: hex digest
+        '''
+        stamp = "{path}|{size}|{mtime_ns}".format(**source_fingerprint(image))
+        hashes_fn = os.path.join(self.cache_dir, 'content_hashes.json')
+        try:
+            with open(hashes_fn, 'r') as read_file:
+                hashes = json.load(read_file)
+        except (OSError, ValueError):
+            hashes = {}
+
+        if stamp not in hashes:
+            sha256 = hashlib.sha256()
+            with open(image, 'rb') as read_file:
+                for chunk in iter(lambda: read_file.read(2 ** 20), b''):
+                    sha256.update(chunk)
+            # Earlier versions of the same file and removed files are dropped
+            path = os.path.abspath(image)
+            hashes = {old_stamp: digest for old_stamp, digest in hashes.items()
+                      if old_stamp.rsplit('|', 2)[0] != path and os.path.exists(old_stamp.rsplit('|', 2)[0])}
+            hashes[stamp] = sha256.hexdigest()
+
+            # Write to a temporary file first so that concurrent runs never read a partial file
+            temp_fd, temp_fn = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(temp_fd, 'w') as write_file:
+                json.dump(hashes, write_file)
+            os.replace(temp_fn, hashes_fn)
+        return hashes[stamp]
+
+    def fingerprint(self, image):
+        '''
+        :param image: raster path
+        :return: dictionary with the path, size, modification time and content hash of the raster
+        '''
+        return {**source_fingerprint(image), 'sha256': self.content_hash(image)}
+
+    def key(self, risk30, municipality, out_fn1, creation_profile):
+        '''
+        Cache key of a prediction modeling region map
+        :param risk30: The 30-class vulnerability map
+        :param municipality: Subdivision image
+        :param out_fn1: modeling region map name, whose format is part of the key
+        :param creation_profile: GeoTIFF creation profile of the map
+        :return: hex key
+        '''
+        parts = [CACHE_VERSION, self.fingerprint(risk30), self.fingerprint(municipality),
+                 os.path.splitext(out_fn1)[1].lower(), creation_profile]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def value_ranges(self, key):
+        '''
+        Value ranges of the maps of a cache entry, to build the modeling region encoding before the entry is loaded
+        :param key: cache key
+        :return: (class_range, subdivision_range), or None if the key is not cached
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isfile(os.path.join(entry_dir, 'complete')):
+            return None
+        try:
+            with np.load(os.path.join(entry_dir, 'bin_counts.npz')) as bin_counts:
+                return tuple(bin_counts['class_range'].tolist()), tuple(bin_counts['subdivision_range'].tolist())
+        except (OSError, KeyError):
+            # Evicted meanwhile
+            return None
+
+    def load(self, key, out_fn1):
+        '''
+        Copy a cached modeling region map to out_fn1 and load its bin ids and bin counts
+        :param key: cache key
+        :param out_fn1: modeling region map name
+        :return: (tabulation_bin_id_masked, (bin_ids, counts)), or None if the key is not cached;
+                 tabulation_bin_id_masked is None if the entry was stored without it
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isfile(os.path.join(entry_dir, 'complete')):
+            return None
+
+        # Mark the entry as recently used
+        os.utime(entry_dir)
+
+        # The map is stored as files named map<suffix>, e.g. map.rst and map.rdc
+        out_base, out_ext = os.path.splitext(out_fn1)
+        for file_name in os.listdir(os.path.join(entry_dir, 'map')):
+            shutil.copyfile(os.path.join(entry_dir, 'map', file_name), out_base + file_name[len('map'):])
+
+        tabulation_bin_id_masked = None
+        if os.path.isfile(os.path.join(entry_dir, 'bin_id.npy')):
+            tabulation_bin_id_masked = np.load(os.path.join(entry_dir, 'bin_id.npy'), mmap_mode='r')
+        with np.load(os.path.join(entry_dir, 'bin_counts.npz')) as bin_counts:
+            return tabulation_bin_id_masked, (bin_counts['bin_ids'], bin_counts['counts'])
+
+    def store(self, key, out_fn1, tabulation_bin_id_masked, bin_counts, encoding):
+        '''
+        Add a modeling region map to the cache and evict the least recently used entries over the size cap
+        :param key: cache key
+        :param out_fn1: modeling region map, closed
+        :param tabulation_bin_id_masked: tabulation bin id array, or None to only keep the map (out of core)
+        :param bin_counts: (bin_ids, counts) of the map
+        :param encoding: ModelingRegionEncoding of the map, whose value ranges are kept
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        # Unique per call, as threads of one process may store at the same time
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp')
+        os.makedirs(os.path.join(temp_dir, 'map'))
+
+        # Copy every file of the dataset (.rdc, .aux.xml, ...) under the name map<suffix>
+        in_ds = gdal.Open(out_fn1)
+        file_list = in_ds.GetFileList()
+        in_ds = None
+        out_base = os.path.splitext(os.path.abspath(out_fn1))[0]
+        for file_name in file_list:
+            file_name = os.path.abspath(file_name)
+            if file_name.startswith(out_base):
+                shutil.copyfile(file_name, os.path.join(temp_dir, 'map', 'map' + file_name[len(out_base):]))
+
+        if tabulation_bin_id_masked is not None:
+            np.save(os.path.join(temp_dir, 'bin_id.npy'), tabulation_bin_id_masked)
+        bin_ids, counts = bin_counts
+        np.savez(os.path.join(temp_dir, 'bin_counts.npz'), bin_ids=bin_ids, counts=counts,
+                 class_range=np.array(encoding.class_range), subdivision_range=np.array(encoding.subdivision_range))
+        open(os.path.join(temp_dir, 'complete'), 'w').close()
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(temp_dir, entry_dir)
+        except OSError:
+            # Another thread stored the same entry first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache is under the size cap
+        '''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if os.path.isdir(entry_dir) and not name.endswith('.tmp'):
+                size = sum(os.path.getsize(os.path.join(root, file_name))
+                           for root, _, file_names in os.walk(entry_dir) for file_name in file_names)
+                entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        '''
+        Remove every cache entry
+        '''
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 30 m pixels of a UTM grid
+GEOTRANSFORM = (500000.0, 30.0, 0.0, 1000020.0, 0.0, -30.0)
+
+@pytest.fixture
+def write_raster(tmp_path):
+    '''
+    Write small single band GeoTIFFs in a temporary directory
+    :return: write(name, arr, nodata=None, options=None): path of the written GeoTIFF
+    '''
+    from osgeo import gdal, gdal_array, osr
+    gdal.UseExceptions()
+
+    def write(name, arr, nodata=None, options=None):
+        path = str(tmp_path / name)
+        rows, cols = arr.shape
+        data_type = gdal_array.NumericTypeCodeToGDALTypeCode(arr.dtype)
+        # Small tiles, so that the windowed functions see several windows and partial blocks
+        if options is None:
+            options = ['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16']
+        out_ds = gdal.GetDriverByName('GTiff').Create(path, cols, rows, 1, data_type, options=options)
+        out_ds.SetGeoTransform(GEOTRANSFORM)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(32619)
+        out_ds.SetProjection(srs.ExportToWkt())
+        out_band = out_ds.GetRasterBand(1)
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+        out_band.WriteArray(arr)
+        out_band.FlushCache()
+        out_ds.FlushCache()
+        out_ds = None
+        return path
+
+    return write
+
+@pytest.fixture
+def read_raster():
+    '''
+    :return: read(path): band 1 of a raster as a NumPy array
+    '''
+    from osgeo import gdal
+
+    def read(path):
+        in_ds = gdal.Open(path)
+        arr = in_ds.GetRasterBand(1).ReadAsArray()
+        in_ds = None
+        return arr
+
+    return read
+
+@pytest.fixture
+def small_windows(monkeypatch):
+    '''
+    Make the streaming functions read and write a few hundred pixels per window, so that small test rasters
+    are processed in several windows
+    '''
+    import raster_stack
+    monkeypatch.setattr(raster_stack.RasterStack.windows, '__defaults__', (200,))
+    monkeypatch.setattr(raster_stack.RasterWriter.windows, '__defaults__', (200,))
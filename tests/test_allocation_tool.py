@@ -0,0 +1,212 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+from allocation_tool import AllocationTool
+
+def reference_adjusted_densities(densities, counts, target, maximum_density, tolerance=1e-12):
+    '''
+    Adjusted densities of the original iterative AR adjustment, run until it converges
+    '''
+    adjusted = densities.astype(np.float64)
+    AR = target / np.sum(adjusted * counts)
+    for _ in range(100000):
+        if AR <= 1 + tolerance:
+            break
+        adjusted = np.minimum(AR * adjusted, maximum_density)
+        AR = target / np.sum(adjusted * counts)
+    return np.minimum(AR * adjusted, maximum_density)
+
+def capped_total(densities, counts, AR, maximum_density):
+    return np.sum(np.minimum(AR * densities, maximum_density) * counts)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_solve_adjustment_ratio_matches_iterations(seed):
+    rng = np.random.default_rng(seed)
+    densities = rng.random(50) * 0.05
+    densities[:5] = 0
+    counts = rng.integers(1, 1000, 50)
+    maximum_density = 0.09
+    target = 0.6 * maximum_density * np.sum(counts[densities > 0])
+
+    AR = AllocationTool().solve_adjustment_ratio(densities, counts, target, maximum_density)
+
+    assert capped_total(densities, counts, AR, maximum_density) == pytest.approx(target, rel=1e-9)
+    expected = reference_adjusted_densities(densities, counts, target, maximum_density)
+    assert np.allclose(np.minimum(AR * densities, maximum_density), expected, rtol=1e-6)
+
+def test_solve_adjustment_ratio_at_exact_capacity():
+    # Every pixel with a positive density takes the maximum; rounding leaves no partially capped solution
+    densities = np.array([0.07, 0.03, 0.011, 0.0])
+    counts = np.array([7, 11, 13, 5])
+    maximum_density = 0.09
+    target = maximum_density * 31
+
+    AR = AllocationTool().solve_adjustment_ratio(densities, counts, target, maximum_density)
+
+    assert capped_total(densities, counts, AR, maximum_density) == pytest.approx(target, rel=1e-12)
+
+def test_solve_adjustment_ratio_over_capacity():
+    with pytest.raises(ValueError):
+        AllocationTool().solve_adjustment_ratio(np.array([0.05, 0.01]), np.array([10, 10]), 2.0, 0.09)
+
+def reference_vp_density(tabulation_bin_id_VP_masked, merged_df, expected_deforestation, maximum_density):
+    '''
+    Adjusted prediction density map of the original pixel array implementation, iterated until it converges
+    '''
+    df_sorted = merged_df.sort_values('ID')
+    ids = np.concatenate(([0], df_sorted['ID'].values))
+    frequencies = np.concatenate(([0], df_sorted['Average Deforestation(pixel)'].values))
+    prediction_density_arr = frequencies[np.searchsorted(ids, tabulation_bin_id_VP_masked)] * maximum_density
+
+    AR = expected_deforestation / np.sum(prediction_density_arr)
+    while AR > 1 + 1e-12:
+        prediction_density_arr = np.minimum(AR * prediction_density_arr, maximum_density)
+        AR = expected_deforestation / np.sum(prediction_density_arr)
+    return np.minimum(AR * prediction_density_arr, maximum_density)
+
+@pytest.fixture
+def vp_inputs(write_raster, tmp_path):
+    import pandas as pd
+    rng = np.random.default_rng(6)
+    inside = rng.random((45, 37)) < 0.85
+    risk30 = np.where(inside, rng.integers(1, 31, (45, 37)), 0).astype(np.int16)
+    municipality = rng.integers(1, 5, (45, 37)).astype(np.int16)
+    tabulation_bin_id = (risk30.astype(np.int32) * 1000 + municipality) * inside
+
+    bin_ids = np.unique(tabulation_bin_id[inside])
+    merged_df = pd.DataFrame({'ID': bin_ids,
+                              'Total Deforestation(pixel)': np.zeros(len(bin_ids)),
+                              'Area of the Bin(pixel)': np.ones(len(bin_ids)),
+                              'Average Deforestation(pixel)': rng.random(len(bin_ids)) * 0.3})
+    csv = str(tmp_path / 'rf.csv')
+    merged_df.to_csv(csv, index=False)
+    return {'risk30_vp': write_raster('risk30_vp.tif', risk30), 'municipality': write_raster('admin.tif', municipality),
+            'csv': csv, 'merged_df': merged_df, 'tabulation_bin_id': tabulation_bin_id}
+
+@pytest.mark.parametrize('expected_deforestation', [5.0, 80.0])
+def test_execute_workflow_vp_matches_pixel_arrays(vp_inputs, small_windows, read_raster, tmp_path,
+                                                  expected_deforestation):
+    out_fn1 = str(tmp_path / 'region_vp.tif')
+    out_fn2 = str(tmp_path / 'density_vp.tif')
+
+    id_difference, _ = AllocationTool().execute_workflow_vp(str(tmp_path), None, vp_inputs['csv'],
+                                                            vp_inputs['municipality'], expected_deforestation,
+                                                            vp_inputs['risk30_vp'], out_fn1, out_fn2)
+
+    assert id_difference.size == 0
+    assert np.array_equal(read_raster(out_fn1), vp_inputs['tabulation_bin_id'])
+    density = read_raster(out_fn2)
+    expected = reference_vp_density(vp_inputs['tabulation_bin_id'], vp_inputs['merged_df'], expected_deforestation,
+                                    0.09)
+    assert density.dtype == np.float32
+    assert np.allclose(density, expected, rtol=1e-5, atol=1e-9)
+    assert np.sum(density, dtype=np.float64) == pytest.approx(expected_deforestation, rel=1e-5)
+
+def test_execute_workflow_vp_scenarios_matches_single_runs(vp_inputs, small_windows, read_raster, tmp_path):
+    scenarios = [5.0, 80.0]
+    for expected_deforestation in scenarios:
+        AllocationTool().execute_workflow_vp(str(tmp_path), None, vp_inputs['csv'], vp_inputs['municipality'],
+                                             expected_deforestation, vp_inputs['risk30_vp'], str(tmp_path / 'region_vp.tif'),
+                                             str(tmp_path / f'density_{expected_deforestation}.tif'))
+
+    out_fn2s = [str(tmp_path / f'scenario_{expected_deforestation}.tif') for expected_deforestation in scenarios]
+    _, ARs = AllocationTool().execute_workflow_vp_scenarios(str(tmp_path), vp_inputs['csv'], vp_inputs['municipality'],
+                                                            scenarios, vp_inputs['risk30_vp'],
+                                                            str(tmp_path / 'region_scenarios.tif'), out_fn2s, workers=2)
+
+    assert len(ARs) == 2
+    for expected_deforestation, out_fn2 in zip(scenarios, out_fn2s):
+        assert (read_raster(out_fn2).tobytes() ==
+                read_raster(str(tmp_path / f'density_{expected_deforestation}.tif')).tobytes())
+
+def test_execute_workflow_vp_scenarios_single_value(vp_inputs, read_raster, tmp_path):
+    out_fn2 = str(tmp_path / 'density.tif')
+    _, ARs = AllocationTool().execute_workflow_vp_scenarios(str(tmp_path), vp_inputs['csv'], vp_inputs['municipality'],
+                                                            5.0, vp_inputs['risk30_vp'], str(tmp_path / 'region.tif'),
+                                                            out_fn2)
+    assert len(ARs) == 1
+    assert read_raster(out_fn2).sum(dtype=np.float64) == pytest.approx(5.0, rel=1e-5)
+
+@pytest.mark.parametrize('out_fn2s', [['density.tif', 'density.tif'], ['density.tif', 'region.tif']])
+def test_execute_workflow_vp_scenarios_rejects_shared_names(vp_inputs, tmp_path, out_fn2s):
+    with pytest.raises(ValueError):
+        AllocationTool().execute_workflow_vp_scenarios(str(tmp_path), vp_inputs['csv'], vp_inputs['municipality'],
+                                                       [5.0, 80.0], vp_inputs['risk30_vp'], 'region.tif', out_fn2s)
+    # Nothing is written
+    assert not (tmp_path / 'region.tif').exists()
+
+def test_execute_workflow_vp_rejects_bin_table_of_other_encoding(vp_inputs, write_raster, tmp_path):
+    from bin_table import save_bin_table
+    # 1200 subdivisions need the multiplier 10000, the table was fitted with 1000
+    municipality = write_raster('admin_1200.tif', np.full((45, 37), 1200, dtype=np.int16))
+    csv = str(tmp_path / 'rf.npz')
+    save_bin_table(vp_inputs['merged_df'], csv, {'multiplier': 1000})
+
+    with pytest.raises(ValueError):
+        AllocationTool().execute_workflow_vp(str(tmp_path), None, csv, municipality, 5.0, vp_inputs['risk30_vp'],
+                                             str(tmp_path / 'region.tif'), str(tmp_path / 'density.tif'))
+    assert not (tmp_path / 'region.tif').exists()
+
+def test_execute_workflow_fit_reads_each_input_twice(write_raster, small_windows, read_raster, tmp_path, monkeypatch):
+    import pandas as pd
+    from raster_stack import RasterStack
+    rng = np.random.default_rng(10)
+    inside = rng.random((45, 37)) < 0.85
+    risk30 = np.where(inside, rng.integers(1, 31, (45, 37)), 0).astype(np.int16)
+    # NoData subdivisions outside the mask do not widen the encoding
+    municipality = np.where(inside, rng.integers(1, 5, (45, 37)), 32767).astype(np.int16)
+    deforestation = ((rng.random((45, 37)) < 0.3) & inside).astype(np.uint8)
+    paths = {'risk30': write_raster('risk30_hrp.tif', risk30),
+             'municipality': write_raster('admin.tif', municipality, nodata=32767),
+             'deforestation': write_raster('deforestation.tif', deforestation)}
+
+    # Pixels read from each input, and no separate min/max scan
+    pixels_read = dict.fromkeys(paths.values(), 0)
+    def counted(read):
+        def read_counted(self, image, window=None):
+            pixels_read[image] += np.prod(window[2:]) if window is not None else 45 * 37
+            return read(self, image, window)
+        return read_counted
+    monkeypatch.setattr(RasterStack, 'read_window', counted(RasterStack.read_window))
+    monkeypatch.setattr(RasterStack, 'read_binary', counted(RasterStack.read_binary))
+    monkeypatch.setattr(RasterStack, 'value_range', lambda self, image: pytest.fail('full raster min/max scan'))
+
+    out_fn1 = str(tmp_path / 'region.tif')
+    out_fn2 = str(tmp_path / 'fit_density.tif')
+    AllocationTool().execute_workflow_fit(str(tmp_path), paths['risk30'], paths['municipality'],
+                                          paths['deforestation'], str(tmp_path / 'rf.csv'), out_fn1, out_fn2)
+
+    assert pixels_read[paths['risk30']] == 2 * 45 * 37
+    assert pixels_read[paths['municipality']] == 2 * 45 * 37
+    assert pixels_read[paths['deforestation']] <= 2 * 45 * 37
+
+    tabulation_bin_id = (risk30.astype(np.int32) * 1000 + municipality) * inside
+    assert np.array_equal(read_raster(out_fn1), tabulation_bin_id)
+    bin_ids, areas = np.unique(tabulation_bin_id[inside], return_counts=True)
+    deforested = np.array([deforestation[tabulation_bin_id == bin_id].sum() for bin_id in bin_ids])
+    table = pd.read_csv(str(tmp_path / 'rf.csv'))
+    assert table['ID'].tolist() == bin_ids.tolist()
+    assert table['Area of the Bin(pixel)'].tolist() == areas.tolist()
+    assert table['Total Deforestation(pixel)'].tolist() == deforested.tolist()
+    frequencies = dict(zip(bin_ids, deforested / areas * 0.09))
+    expected = np.array([frequencies.get(bin_id, 0) for bin_id in tabulation_bin_id.ravel()]).reshape(45, 37)
+    assert np.allclose(read_raster(out_fn2), expected, rtol=1e-6)
+
+def test_execute_workflow_vp_with_dataframe_table_missing_bins(vp_inputs, read_raster, tmp_path):
+    # The table of the fitting stage passed as a DataFrame, without the bins of subdivision 4; their relative
+    # frequencies are estimated from the other bins of the same vulnerability class
+    merged_df = vp_inputs['merged_df']
+    merged_df = merged_df[merged_df['ID'] % 1000 != 4].reset_index(drop=True)
+    out_fn2 = str(tmp_path / 'density.tif')
+
+    id_difference, _ = AllocationTool().execute_workflow_vp(str(tmp_path), None, merged_df, vp_inputs['municipality'],
+                                                            5.0, vp_inputs['risk30_vp'], str(tmp_path / 'region.tif'),
+                                                            out_fn2)
+
+    assert id_difference.size > 0
+    assert np.all(id_difference % 1000 == 4)
+    assert read_raster(out_fn2).sum(dtype=np.float64) == pytest.approx(5.0, rel=1e-5)
+    # No adjusted csv without a table file
+    assert not list(tmp_path.glob('*_adjusted_for_prediction.csv'))
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from bin_table import BIN_TABLE_COLUMNS, source_fingerprint, save_bin_table, load_bin_table, check_bin_table
+
+@pytest.fixture
+def fitted_table(tmp_path):
+    '''
+    Binary table saved with the metadata of a fit on one map
+    '''
+    source = tmp_path / 'risk30_hrp.tif'
+    source.write_bytes(b'map')
+    merged_df = pd.DataFrame({'ID': np.array([1001, 2003]), 'Total Deforestation(pixel)': np.array([1.0, 0.0]),
+                              'Area of the Bin(pixel)': np.array([4, 3]),
+                              'Average Deforestation(pixel)': np.array([0.25, 0.0])})
+    file_name = str(tmp_path / 'rf.npz')
+    save_bin_table(merged_df, file_name, {'multiplier': 1000, 'sources': {'risk30_hrp': source_fingerprint(source)}})
+    return file_name, merged_df, source
+
+def test_load_bin_table_round_trip(fitted_table):
+    file_name, merged_df, _ = fitted_table
+    loaded, metadata = load_bin_table(file_name)
+
+    pd.testing.assert_frame_equal(loaded, merged_df[BIN_TABLE_COLUMNS])
+    check_bin_table(file_name, metadata, 1000)
+
+def test_check_bin_table_rejects_other_multiplier(fitted_table):
+    file_name, _, _ = fitted_table
+    with pytest.raises(ValueError):
+        check_bin_table(file_name, load_bin_table(file_name)[1], 10000)
+
+def test_check_bin_table_rejects_changed_source(fitted_table):
+    file_name, _, source = fitted_table
+    source.write_bytes(b'other map')
+    with pytest.raises(ValueError):
+        check_bin_table(file_name, load_bin_table(file_name)[1], 1000)
+
+def test_check_bin_table_skips_moved_source(fitted_table):
+    file_name, _, source = fitted_table
+    os.remove(source)
+    check_bin_table(file_name, load_bin_table(file_name)[1], 1000)
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+pytest.importorskip('geopandas')
+
+from model_evaluation import ModelEvaluation
+
+def test_create_deforestation_map_is_written_by_window(write_raster, small_windows, read_raster, tmp_path):
+    rng = np.random.default_rng(4)
+    fmask = (rng.random((45, 37)) < 0.8).astype(np.uint8)
+    deforestation_cal = (rng.random((45, 37)) < 0.2).astype(np.uint8)
+    deforestation_cnf = (rng.random((45, 37)) < 0.2).astype(np.uint8)
+    out_fn = str(tmp_path / 'deforestation.tif')
+
+    ModelEvaluation().create_deforestation_map(write_raster('fmask.tif', fmask),
+                                               write_raster('def_cal.tif', deforestation_cal),
+                                               write_raster('def_cnf.tif', deforestation_cnf), out_fn)
+
+    # Original full array computation
+    expected = fmask.copy()
+    expected[deforestation_cnf == 1] = 3
+    expected[(deforestation_cnf == 0) & (deforestation_cal == 1)] = 2
+    expected[(deforestation_cnf == 0) & (deforestation_cal == 0) & (fmask == 1)] = 1
+    written = read_raster(out_fn)
+    assert written.dtype == np.int16
+    assert np.array_equal(written, expected)
+
+def write_rectangles(path, rectangles):
+    '''
+    Polygon GeoJSON of rectangles given in pixel coordinates (col0, row0, col1, row1) of the write_raster grid
+    '''
+    from osgeo import ogr, osr
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromEPSG(32619)
+    ds = ogr.GetDriverByName('GeoJSON').CreateDataSource(path)
+    layer = ds.CreateLayer('cells', spatial_ref, ogr.wkbPolygon)
+    for col0, row0, col1, row1 in rectangles:
+        x0, x1 = 500000 + 30 * col0, 500000 + 30 * col1
+        y0, y1 = 1000020 - 30 * row0, 1000020 - 30 * row1
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(f'POLYGON (({x0} {y0}, {x1} {y0}, {x1} {y1}, {x0} {y1}, {x0} {y0}))'))
+        layer.CreateFeature(feature)
+    ds = None
+    return path
+
+def test_zonal_stats_rasterizes_by_window(write_raster, small_windows, tmp_path):
+    rng = np.random.default_rng(7)
+    values = rng.integers(0, 100, (45, 37)).astype(np.int16)
+    # The last rectangle is outside the raster
+    rectangles = [(2, 3, 10, 30), (12, 10, 30, 44), (31, 0, 37, 5), (50, 50, 60, 60)]
+    vector_path = write_rectangles(str(tmp_path / 'cells.geojson'), rectangles)
+
+    stats = ModelEvaluation().zonal_stats(vector_path, write_raster('values.tif', values), ('sum', 'count', 'max'))
+
+    assert len(stats) == len(rectangles)
+    for (col0, row0, col1, row1), zone in zip(rectangles[:3], stats):
+        cell = values[row0:row1, col0:col1]
+        assert zone == {'sum': cell.sum(), 'count': cell.size, 'max': cell.max()}
+    assert stats[3]['sum'] == 0 and stats[3]['count'] == 0 and np.isnan(stats[3]['max'])
+
+def reference_voronoi_cells(cols, rows, gt, grid_size):
+    '''
+    Thiessen polygons of the original construction: Voronoi diagram of the sample points, then polygonize of the
+    finite ridges
+    '''
+    from scipy.spatial import Voronoi
+    from shapely.geometry import LineString
+    from shapely.ops import polygonize
+    x = np.arange(-1 * grid_size, cols + 1 * grid_size, grid_size)
+    y = np.arange(-1 * grid_size, rows + 1 * grid_size, grid_size)
+    grid_x, grid_y = np.meshgrid(x, y)
+    coords = np.column_stack([gt[0] + grid_x.ravel() * gt[1], gt[3] + grid_y.ravel() * gt[5]])
+    vor = Voronoi(points=coords)
+    lines = [LineString(vor.vertices[line]) for line in vor.ridge_vertices if -1 not in line]
+    return list(polygonize(lines))
+
+def lattice_positions(polygons, gt, grid_size):
+    '''
+    (row, column) of the sample point of each cell, from its centroid
+    '''
+    return [(int(round((polygon.centroid.y - gt[3]) / gt[5] / grid_size)),
+             int(round((polygon.centroid.x - gt[0]) / gt[1] / grid_size))) for polygon in polygons]
+
+def test_assessment_grid_cells_match_voronoi(write_raster):
+    import shapely
+    mask = write_raster('mask.tif', np.ones((45, 37), dtype=np.uint8))
+    model_evaluation = ModelEvaluation()
+    gt = model_evaluation.rasters.geotransform(mask)
+
+    cells = model_evaluation.assessment_grid_cells(mask, 8)
+    reference = reference_voronoi_cells(37, 45, gt, 8)
+
+    # One cell per Voronoi polygon, with the same vertices
+    positions = lattice_positions(cells, gt, 8)
+    assert len(set(positions)) == len(cells) == len(reference)
+    by_position = dict(zip(positions, cells))
+    for position, polygon in zip(lattice_positions(reference, gt, 8), reference):
+        assert shapely.equals_exact(shapely.normalize(by_position[position]), shapely.normalize(polygon), 1e-6)
+
+    # Row-major order: rows from the top, cells from the left
+    assert positions == sorted(positions)
+
+def test_voronoi_cell_order_depends_on_the_origin():
+    # The same 4 x 4 pixel raster, moved one pixel east: the two Voronoi cells of each map are at the same place
+    # relative to the raster, but polygonize returns them in another order. The IDs of the Voronoi construction
+    # depend on the absolute coordinates through qhull, so the grid alone cannot give them.
+    gt = (500000.0, 30.0, 0.0, 1000020.0, 0.0, -30.0)
+    moved_gt = (500030.0, 30.0, 0.0, 1000020.0, 0.0, -30.0)
+
+    order = lattice_positions(reference_voronoi_cells(4, 4, gt, 2), gt, 2)
+    moved_order = lattice_positions(reference_voronoi_cells(4, 4, moved_gt, 2), moved_gt, 2)
+
+    assert sorted(order) == sorted(moved_order)
+    assert order != moved_order
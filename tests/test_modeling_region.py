@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+from modeling_region import ModelingRegionEncoding, LookupTable, count_ids, add_counts
+from allocation_tool import AllocationTool
+
+def test_encoding_type_follows_the_subdivision_ids():
+    encoding = ModelingRegionEncoding((0, 30), (1, 20))
+    assert (encoding.multiplier, encoding.dtype) == (1000, np.int16)
+
+    encoding = ModelingRegionEncoding((0, 30), (1, 1500))
+    assert (encoding.multiplier, encoding.dtype) == (10000, np.int32)
+    ids = encoding.encode(np.array([[30, 0, 2]], dtype=np.int16), np.array([[1500, 7, 3]], dtype=np.int16))
+    assert ids.tolist() == [[301500, 0, 20003]]
+
+def test_output_data_type_of_rst_maps():
+    assert ModelingRegionEncoding((0, 30), (1, 20)).output_data_type('region.rst') == gdal.GDT_Int16
+
+    # int32 ids are stored as Float32 in RST, which holds them exactly up to 2^24
+    encoding = ModelingRegionEncoding((0, 30), (1, 1500))
+    assert encoding.output_data_type('region.tif') == gdal.GDT_Int32
+    assert encoding.output_data_type('region.rst') == gdal.GDT_Float32
+
+    with pytest.raises(ValueError):
+        ModelingRegionEncoding((0, 30), (1, 150000)).output_data_type('region.rst')
+
+def test_lookup_table():
+    lookup = LookupTable(np.array([-1, 2005, 30001]), np.array([0.5, 0.25, 0.125]))
+    assert lookup.lookup is not None
+    assert lookup.map(np.array([2005, -1, 30001, 0])).tolist() == [0.25, 0.5, 0.125, 0]
+
+def test_lookup_table_of_wide_ids():
+    # 7-digit subdivision codes: the id range is far larger than the number of ids
+    ids = np.array([301000007, 10000003, 154321987])
+    lookup = LookupTable(ids, np.array([0.5, 0.25, 0.125]))
+    assert lookup.lookup is None
+    assert lookup.map(np.array([[10000003, 0], [301000007, 154321987]])).tolist() == [[0.25, 0], [0.5, 0.125]]
+
+@pytest.mark.parametrize('scale', [1, 10000])
+def test_count_ids(scale):
+    rng = np.random.default_rng(8)
+    ids = rng.integers(0, 40, (30, 20)) * scale
+    deforestation = rng.random((30, 20)) < 0.3
+
+    bin_ids, counts = count_ids(ids, deforestation)
+
+    expected_ids, inverse = np.unique(ids, return_inverse=True)
+    assert bin_ids.tolist() == expected_ids.tolist()
+    assert counts[:, 0].tolist() == np.bincount(inverse.ravel(), weights=~deforestation.ravel()).tolist()
+    assert counts[:, 1].tolist() == np.bincount(inverse.ravel(), weights=deforestation.ravel()).tolist()
+
+    # Counted in two parts
+    bin_counts = add_counts(count_ids(ids[:10], deforestation[:10]), count_ids(ids[10:], deforestation[10:]))
+    assert bin_counts[0].tolist() == bin_ids.tolist()
+    assert np.array_equal(bin_counts[1], counts)
+
+def test_region_encoding_uses_exact_range(write_raster):
+    risk30 = write_raster('risk30.tif', np.array([[30, 1], [0, 2]], dtype=np.int16))
+    municipality = write_raster('admin.tif', np.array([[1500, 3], [2, 1]], dtype=np.int16))
+    # Statistics that were not updated after subdivisions were added
+    in_ds = gdal.Open(municipality, gdal.GA_Update)
+    in_ds.GetRasterBand(1).SetStatistics(1, 900, 10, 5)
+    in_ds = None
+
+    assert AllocationTool().region_encoding(risk30, municipality).multiplier == 10000
+
+@pytest.mark.parametrize('out_of_core', [False, True])
+def test_wide_ids_in_rst_modeling_region_map(write_raster, small_windows, read_raster, tmp_path, out_of_core):
+    import pandas as pd
+    rng = np.random.default_rng(7)
+    risk30 = rng.integers(0, 31, (30, 20)).astype(np.int16)
+    municipality = rng.integers(1, 1500, (30, 20)).astype(np.int16)
+    tabulation_bin_id = (risk30.astype(np.int32) * 10000 + municipality) * (risk30 > 0)
+    bin_ids = np.unique(tabulation_bin_id[risk30 > 0])
+    csv = str(tmp_path / 'rf.csv')
+    pd.DataFrame({'ID': bin_ids, 'Total Deforestation(pixel)': np.zeros(len(bin_ids)),
+                  'Area of the Bin(pixel)': np.ones(len(bin_ids)),
+                  'Average Deforestation(pixel)': rng.random(len(bin_ids)) * 0.3}).to_csv(csv, index=False)
+    risk30_vp = write_raster('risk30_vp.tif', risk30)
+    municipality = write_raster('admin.tif', municipality)
+
+    density = {}
+    for out_ext in ('.tif', '.rst'):
+        out_fn1 = str(tmp_path / f'region{out_ext}')
+        out_fn2 = str(tmp_path / f'density_{out_ext[1:]}.tif')
+        AllocationTool(out_of_core=out_of_core).execute_workflow_vp(str(tmp_path), None, csv, municipality, 10.0,
+                                                                    risk30_vp, out_fn1, out_fn2)
+        assert np.array_equal(read_raster(out_fn1), tabulation_bin_id)
+        density[out_ext] = read_raster(out_fn2)
+    assert density['.rst'].tobytes() == density['.tif'].tobytes()
+
+def test_vp_with_code_style_subdivision_ids(write_raster, small_windows, read_raster, tmp_path):
+    import pandas as pd
+    rng = np.random.default_rng(9)
+    risk30 = rng.integers(0, 31, (30, 20)).astype(np.int16)
+    # 7-digit subdivision codes need the multiplier 10^7, an id range of about 3 * 10^8
+    municipality = rng.choice(np.array([1000003, 4520117, 9999999], dtype=np.int32), (30, 20))
+    tabulation_bin_id = (risk30.astype(np.int64) * 10 ** 7 + municipality) * (risk30 > 0)
+    bin_ids = np.unique(tabulation_bin_id[risk30 > 0])
+    frequencies = rng.random(len(bin_ids)) * 0.3
+    csv = str(tmp_path / 'rf.csv')
+    pd.DataFrame({'ID': bin_ids, 'Total Deforestation(pixel)': np.zeros(len(bin_ids)),
+                  'Area of the Bin(pixel)': np.ones(len(bin_ids)),
+                  'Average Deforestation(pixel)': frequencies}).to_csv(csv, index=False)
+    out_fn1 = str(tmp_path / 'region.tif')
+    out_fn2 = str(tmp_path / 'density.tif')
+
+    AllocationTool().execute_workflow_vp(str(tmp_path), None, csv, write_raster('admin.tif', municipality), 1.0,
+                                         write_raster('risk30_vp.tif', risk30), out_fn1, out_fn2)
+
+    assert np.array_equal(read_raster(out_fn1), tabulation_bin_id)
+    density = read_raster(out_fn2)
+    # Every pixel of a bin has the same density, and the bins with a higher frequency a higher density
+    inside = risk30 > 0
+    per_bin = {bin_id: np.unique(density[tabulation_bin_id == bin_id]) for bin_id in bin_ids}
+    assert all(len(values) == 1 for values in per_bin.values())
+    assert np.all(density[~inside] == 0)
+    assert np.sum(density, dtype=np.float64) == pytest.approx(1.0, rel=1e-5)
+    order = np.argsort(frequencies)
+    assert np.all(np.diff([per_bin[bin_id][0] for bin_id in bin_ids[order]]) >= 0)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+from raster_stack import RasterStack
+
+@pytest.mark.parametrize('options', [['TILED=NO'], ['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16', 'COMPRESS=DEFLATE']])
+@pytest.mark.parametrize('dtype', [np.int16, np.float32])
+def test_read_binary_is_non_zero(write_raster, options, dtype):
+    # -1 and 0.5 are non-zero, whether the file is memory-mapped (striped) or read through GDAL (compressed)
+    arr = np.array([[0, 1, -1, 2], [0, 0, 5, -3]], dtype=dtype)
+    if dtype == np.float32:
+        arr[0, 3] = 0.5
+    image = write_raster('binary.tif', arr, options=options)
+
+    rasters = RasterStack()
+    assert np.array_equal(rasters.read_binary(image), arr != 0)
+    assert np.array_equal(rasters.read_binary(image, (1, 1, 3, 1)), arr[1:2, 1:4] != 0)
+
+def test_read_classes_ignores_stale_statistics(write_raster):
+    arr = np.array([[1, 300, 70000], [2, 3, 4]], dtype=np.int32)
+    image = write_raster('classes.tif', arr)
+    # Statistics that were not updated after the values changed
+    in_ds = gdal.Open(image, gdal.GA_Update)
+    in_ds.GetRasterBand(1).SetStatistics(1, 200, 50, 10)
+    in_ds = None
+
+    classes = RasterStack().read_classes(image)
+    assert np.array_equal(classes, arr)
+    assert classes.dtype == np.int32
+
+def test_read_classes_keeps_nodata(write_raster):
+    arr = np.array([[1, 30, -1], [-1, 2, 3]], dtype=np.int32)
+    image = write_raster('classes.tif', arr, nodata=-1)
+
+    classes = RasterStack().read_classes(image)
+    assert np.array_equal(classes, arr)
+    assert classes.dtype == np.int16
+
+def test_value_range_is_exact(write_raster):
+    image = write_raster('classes.tif', np.array([[5, 9], [7, 12]], dtype=np.int16))
+    in_ds = gdal.Open(image, gdal.GA_Update)
+    in_ds.GetRasterBand(1).SetStatistics(0, 30, 15, 5)
+    in_ds = None
+
+    assert RasterStack().value_range(image) == (5, 12)
+
+def test_creation_profiles():
+    assert RasterStack('striped').creation_options('out.tif', gdal.GDT_Int16) == ['BIGTIFF=YES']
+    options = RasterStack('zstd').creation_options('out.tif', gdal.GDT_Float32)
+    assert 'COMPRESS=ZSTD' in options and 'PREDICTOR=3' in options
+    assert RasterStack('zstd').creation_options('out.rst', gdal.GDT_Float32) == []
+    with pytest.raises(ValueError):
+        RasterStack('bogus')
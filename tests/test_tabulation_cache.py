@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+from allocation_tool import AllocationTool
+from modeling_region import ModelingRegionEncoding
+from tabulation_cache import TabulationCache
+
+def test_cache_hit_reads_no_map(write_raster, small_windows, read_raster, tmp_path, monkeypatch):
+    import pandas as pd
+    from raster_stack import RasterStack
+    rng = np.random.default_rng(11)
+    risk30 = rng.integers(1, 31, (30, 20)).astype(np.int16)
+    municipality = rng.integers(1, 5, (30, 20)).astype(np.int16)
+    tabulation_bin_id = risk30.astype(np.int32) * 1000 + municipality
+    bin_ids = np.unique(tabulation_bin_id)
+    csv = str(tmp_path / 'rf.csv')
+    pd.DataFrame({'ID': bin_ids, 'Total Deforestation(pixel)': np.zeros(len(bin_ids)),
+                  'Area of the Bin(pixel)': np.ones(len(bin_ids)),
+                  'Average Deforestation(pixel)': rng.random(len(bin_ids)) * 0.3}).to_csv(csv, index=False)
+    risk30_vp = write_raster('risk30_vp.tif', risk30)
+    municipality = write_raster('admin.tif', municipality)
+    cache = TabulationCache(str(tmp_path / 'cache'))
+
+    def run(out_fn1, out_fn2):
+        AllocationTool(tabulation_cache=cache).execute_workflow_vp(str(tmp_path), None, csv, municipality, 5.0,
+                                                                   risk30_vp, out_fn1, out_fn2)
+        return read_raster(out_fn1), read_raster(out_fn2)
+
+    region, density = run(str(tmp_path / 'region.tif'), str(tmp_path / 'density.tif'))
+
+    # Neither the value ranges nor the modeling region ids are computed again
+    monkeypatch.setattr(RasterStack, 'value_range', lambda self, image: pytest.fail('min/max scan on a cache hit'))
+    monkeypatch.setattr(AllocationTool, 'tabulation_bin_id_VP', lambda *args: pytest.fail('tabulation on a cache hit'))
+    cached_region, cached_density = run(str(tmp_path / 'region_2.tif'), str(tmp_path / 'density_2.tif'))
+
+    assert np.array_equal(cached_region, tabulation_bin_id)
+    assert np.array_equal(cached_region, region)
+    assert cached_density.tobytes() == density.tobytes()
+
+def test_content_hashes_keep_one_stamp_per_file(tmp_path):
+    cache = TabulationCache(str(tmp_path / 'cache'))
+    image = tmp_path / 'admin.tif'
+    other = tmp_path / 'risk30.tif'
+    other.write_bytes(b'risk')
+    cache.content_hash(str(other))
+    for version in range(3):
+        image.write_bytes(b'version %d' % version)
+        os.utime(image, ns=(version * 10 ** 9, version * 10 ** 9))
+        cache.content_hash(str(image))
+
+    with open(os.path.join(cache.cache_dir, 'content_hashes.json')) as read_file:
+        stamps = list(json.load(read_file))
+    assert len(stamps) == 2
+    assert sum(stamp.startswith(str(image)) for stamp in stamps) == 1
+
+    # Removed files are forgotten
+    os.remove(other)
+    image.write_bytes(b'version 3')
+    cache.content_hash(str(image))
+    with open(os.path.join(cache.cache_dir, 'content_hashes.json')) as read_file:
+        assert [stamp.rsplit('|', 2)[0] for stamp in json.load(read_file)] == [str(image)]
+
+def test_concurrent_stores_of_one_key(write_raster, tmp_path):
+    out_fn1 = write_raster('region.tif', np.full((6, 5), 30001, dtype=np.int32))
+    cache = TabulationCache(str(tmp_path / 'cache'))
+    bin_counts = (np.array([30001]), np.array([[30, 0]]))
+    encoding = ModelingRegionEncoding((30, 30), (1, 1))
+    errors = []
+
+    def store():
+        try:
+            cache.store('key', out_fn1, None, bin_counts, encoding)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=store) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.value_ranges('key') == ((30, 30), (1, 1))
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith('.tmp')]
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+pytest.importorskip('matplotlib')
+pytest.importorskip('geopandas')
+
+from udef_arp_cli import scenario_name
+
+def test_scenario_names_are_distinct():
+    assert scenario_name(1500.0) == '1500'
+    assert scenario_name(1500.25) == '1500.25'
+    # The :g format gave 1.5e+06 for both
+    assert scenario_name(1500000.0) != scenario_name(1500001.0)
+
+def test_relative_cache_dir_is_resolved_once(tmp_path, monkeypatch):
+    import json
+    import os
+    import udef_arp_cli
+    for name in ('job_1', 'job_2'):
+        (tmp_path / name).mkdir()
+    config = tmp_path / 'jobs.json'
+    config.write_text(json.dumps([{'directory': 'job_1', 'steps': []}, {'directory': 'job_2', 'steps': []}]))
+
+    # Each job changes the working directory, as set_working_directory does
+    cache_dirs = []
+    def run_job(job, progress_callback=None):
+        cache_dirs.append(job['cache_dir'])
+        os.chdir(job['directory'])
+    monkeypatch.setattr(udef_arp_cli, 'run_job', run_job)
+    monkeypatch.chdir(tmp_path)
+
+    assert udef_arp_cli.main([str(config), '--cache-dir', 'cache', '--quiet']) == 0
+    assert cache_dirs == [str(tmp_path / 'cache')] * 2
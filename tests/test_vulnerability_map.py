@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+from vulnerability_map import VulnerabilityMap
+
+def reference_nrt(distance_arr_cal, deforestation_hrp_arr, mask_arr, bin_width):
+    '''
+    NRT of the original full array implementation
+    '''
+    distance_arr_masked = distance_arr_cal * mask_arr * deforestation_hrp_arr
+    distance_arr_masked_1d = distance_arr_masked.flatten()
+    distance_arr_masked_1d = distance_arr_masked_1d[distance_arr_masked_1d != 0]
+    hist, bin_edges = np.histogram(distance_arr_masked_1d, bins=np.arange(distance_arr_masked_1d.min(),
+                                                                          distance_arr_masked_1d.max() + bin_width,
+                                                                          bin_width))
+    cumulative_prop = np.cumsum(hist / np.sum(hist))
+    index_995 = np.argmax(cumulative_prop >= 0.995)
+    return int((bin_edges[index_995] + bin_edges[index_995 + 1]) / 2)
+
+def reference_geometric_classification(arr, mask_arr0, LL, NRT, n_classes):
+    '''
+    Classification of the original full array implementation, one pass per class
+    '''
+    UL = NRT = int(NRT)
+    r = np.power(LL / UL, 1 / n_classes)
+    class_array = np.array([[i, i + 1] for i in range(n_classes)])
+    risk_class = np.multiply(UL, np.power(r, class_array))
+    risk_class[n_classes - 1][1] = LL
+    risk_class[0][0] = NRT
+
+    mask_arr = arr * mask_arr0
+    mask_arr[mask_arr >= NRT] = 1
+    for i in range(n_classes):
+        lower = risk_class[i][0]
+        upper = risk_class[i][1]
+        mask_arr[(lower > mask_arr) & (mask_arr >= upper)] = i + 2
+    return mask_arr
+
+@pytest.fixture
+def distance_inputs(write_raster):
+    '''
+    Distance, deforestation and mask maps of 45 x 37 pixels, so that windows do not line up with the raster size
+    '''
+    rng = np.random.default_rng(2)
+    distance = (rng.integers(1, 140, (45, 37)) * 30).astype(np.int16)
+    deforestation = (rng.random((45, 37)) < 0.4).astype(np.uint8)
+    mask = (rng.random((45, 37)) < 0.9).astype(np.uint8)
+    return {
+        'arrays': (distance, deforestation, mask),
+        'paths': (write_raster('distance.tif', distance), write_raster('deforestation.tif', deforestation),
+                  write_raster('mask.tif', mask)),
+    }
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_nrt_calculation_matches_full_array(distance_inputs, small_windows, workers):
+    distance, deforestation, mask = distance_inputs['arrays']
+    in_fn, deforestation_hrp, mask_fn = distance_inputs['paths']
+
+    NRT = VulnerabilityMap().nrt_calculation(in_fn, deforestation_hrp, mask_fn, workers=workers)
+
+    assert NRT == reference_nrt(distance, deforestation, mask, 30.0)
+
+def test_nrt_calculation_without_deforestation(write_raster):
+    distance = np.full((8, 8), 30, dtype=np.int16)
+    empty = np.zeros((8, 8), dtype=np.uint8)
+
+    with pytest.raises(ValueError):
+        VulnerabilityMap().nrt_calculation(write_raster('distance.tif', distance), write_raster('deforestation.tif', empty),
+                                           write_raster('mask.tif', empty + 1))
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_geometric_classification_streaming_matches_full_array(distance_inputs, small_windows, read_raster, tmp_path,
+                                                               workers):
+    distance, _, mask = distance_inputs['arrays']
+    in_fn, _, mask_fn = distance_inputs['paths']
+    NRT = 3000
+    out_fn = str(tmp_path / 'vulnerability.tif')
+
+    vulnerability_map = VulnerabilityMap()
+    mask_arr = vulnerability_map.geometric_classification(in_fn, NRT, 29, mask_fn, workers=workers)
+    vulnerability_map.geometric_classification_streaming(in_fn, NRT, 29, mask_fn, out_fn, workers=workers)
+    written = read_raster(out_fn)
+
+    expected = reference_geometric_classification(distance, mask, 30, NRT, 29)
+    assert mask_arr.dtype == expected.dtype
+    assert mask_arr.tobytes() == expected.tobytes()
+    assert written.dtype == np.int16
+    assert written.tobytes() == expected.tobytes()
+
+def reference_alternative_classification(arr, mask_arr0, fmask_arr0, n_classes):
+    '''
+    Classification of the original full array implementation of the alternative vulnerability map
+    '''
+    arr_rescale = 1 + arr * 1 / np.max(arr)
+    LL = 1
+    UL = 2
+    r = np.power(UL / LL, 1 / n_classes)
+    class_array = np.array([[i, i + 1] for i in range(n_classes - 1, -1, -1)])
+    risk_class = LL + (UL - (np.multiply(LL, np.power(r, class_array))))
+    risk_class[0][1] = LL
+
+    mask_arr = arr_rescale * (mask_arr0 * fmask_arr0)
+    for i in range(n_classes):
+        upper = risk_class[i][0]
+        lower = risk_class[i][1]
+        mask_arr[(upper > mask_arr) & (mask_arr >= lower)] = i + 1
+    return mask_arr
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_geometric_classification_alternative_streaming_matches_full_array(write_raster, small_windows, read_raster,
+                                                                           tmp_path, workers):
+    rng = np.random.default_rng(5)
+    arr = rng.random((45, 37)).astype(np.float32)
+    mask = (rng.random((45, 37)) < 0.9).astype(np.uint8)
+    fmask = (rng.random((45, 37)) < 0.7).astype(np.uint8)
+    in_fn = write_raster('empirical.tif', arr)
+    mask_fn = write_raster('mask.tif', mask)
+    fmask_fn = write_raster('fmask.tif', fmask)
+    out_fn = str(tmp_path / 'vulnerability.tif')
+
+    vulnerability_map = VulnerabilityMap()
+    mask_arr = vulnerability_map.geometric_classification_alternative(in_fn, 30, mask_fn, fmask_fn, workers=workers)
+    vulnerability_map.geometric_classification_alternative_streaming(in_fn, 30, mask_fn, fmask_fn, out_fn,
+                                                                     workers=workers)
+    written = read_raster(out_fn)
+
+    expected = reference_alternative_classification(arr, mask, fmask, 30)
+    assert mask_arr.tobytes() == expected.tobytes()
+    assert written.dtype == np.int16
+    assert written.tobytes() == expected.astype(np.int16).tobytes()
@@ -0,0 +1,584 @@
+'''
+Headless runner for the UDef-ARP workflows.
+
+Every screen of UDef-ARP.py has a matching function here, so the six pipelines (RMT, AT and MCT for the fitting
+and prediction phases) can be run from Python or from a JSON config file on a machine without a display:
+
+    python udef_arp_cli.py jurisdictions.json
+
+A config file holds one job or a list of jobs. Keys at the top level are shared by every job, and each job runs its
+steps in order in its own working directory:
+
+    {
+        "workers": 4,
+        "jobs": [
+            {
+                "directory": "C:/data/jurisdiction_a",
+                "steps": [
+                    {"workflow": "nrt", "in_fn": "distance_cal.tif", "deforestation_hrp": "def_cal.tif",
+                     "mask": "mask.tif"},
+                    {"workflow": "vulnerability", "in_fn": "distance_cal.tif", "mask": "mask.tif",
+                     "out_fn": "risk30_cal.tif"},
+                    {"workflow": "allocation_fit", "risk30_hrp": "risk30_cal.tif", "municipality": "admin.tif",
+                     "deforestation_hrp": "def_cal.tif", "csv_name": "rf_cal.csv",
+                     "out_fn1": "region_cal.tif", "out_fn2": "density_cal.tif"}
+                ]
+            }
+        ]
+    }
+
+The keys of a step are the parameters of the workflow function it names. A "vulnerability" step without an "NRT"
+uses the NRT of the last "nrt" step of the same job, like the GUI does.
+
+With a "cache_dir" key (and optionally "cache_max_gb", 10 by default), the prediction modeling region maps and their
+bin counts are cached on disk, so CNF/VP steps that are run again on unchanged inputs skip the tabulation. With
+"out_of_core": true, CNF/VP steps keep the modeling region map on disk only, for jurisdictions larger than the memory.
+
+GeoTIFF outputs are tiled and DEFLATE compressed by default. A "creation_profile" key (or --creation-profile) selects
+another profile of raster_stack.CREATION_PROFILES: "striped" (uncompressed strips), "zstd" or "lzw".
+'''
+import os
+import sys
+import json
+import argparse
+import warnings
+import traceback
+import matplotlib
+# Plots are only saved to file, never shown
+matplotlib.use('Agg')
+from osgeo import gdal
+from allocation_tool import AllocationTool
+from vulnerability_map import VulnerabilityMap
+from model_evaluation import ModelEvaluation
+from map_checker import MapChecker
+from tabulation_cache import TabulationCache
+from raster_stack import CREATION_PROFILES, DEFAULT_PROFILE
+
+# GDAL exceptions
+gdal.UseExceptions()
+
+map_checker = MapChecker()
+
+# Error message of an input that is not a binary map
+BINARY_MESSAGE = "'{}' must be a binary map (0 and 1) where the 1’s indicate {}."
+
+def get_full_path(base_dir, user_input):
+    '''
+    Resolve an input file name against the working directory
+    :param base_dir: working directory
+    :param user_input: file name or absolute path
+    :return: absolute or directory-relative path
+    '''
+    if os.path.isabs(user_input):
+        return user_input
+    else:
+        return os.path.join(base_dir, user_input)
+
+def check_images(images, binary_maps=None):
+    '''
+    Check that the input images can be processed together
+    :param images: list of input images
+    :param binary_maps: dictionary of input image to the error message raised when it is not a binary map
+    :return:
+    '''
+    # Check if all images have the same resolution
+    resolutions = [map_checker.get_image_resolution(img) for img in images]
+    if len(set(resolutions)) != 1:
+        raise ValueError("All the input raster images must have the same spatial resolution!")
+
+    # Check if all images have the same number of rows and columns
+    dimensions = [map_checker.get_image_dimensions(img) for img in images]
+    if len(set(dimensions)) != 1:
+        raise ValueError("All the input raster images must have the same number of rows and columns!")
+
+    for image, message in (binary_maps or {}).items():
+        if not map_checker.check_binary_map(image):
+            raise ValueError(message)
+    return
+
+def check_output(out_fn, description, extensions=('.tif', '.rst')):
+    '''
+    Check the name of an output file
+    :param out_fn: output file name
+    :param description: description used in the error message
+    :param extensions: accepted file extensions
+    :return:
+    '''
+    if not out_fn:
+        raise ValueError(f"Please enter the name of {description}!")
+    if not out_fn.endswith(tuple(extensions)):
+        raise ValueError(f"Please enter {' or '.join(extensions)} extension in the name of {description}!")
+    return
+
+def warn_max_iterations(max_iterations):
+    '''
+    Warn about the deprecated max_iterations parameter of the CNF/VP steps
+    :param max_iterations: value passed by the caller, None if not passed
+    :return:
+    '''
+    if max_iterations is not None:
+        warnings.warn("max_iterations is deprecated and ignored: the Adjustment Ratio is solved directly.",
+                      DeprecationWarning, stacklevel=3)
+    return
+
+def nrt(directory, in_fn, deforestation_hrp, mask, workers=1, progress=None):
+    '''
+    Calculate the Negligible Risk Threshold (RMT screens)
+    :param directory: working directory
+    :param in_fn: map of distance from the forest edge
+    :param deforestation_hrp: map of deforestation in the CAL/HRP
+    :param mask: mask of the jurisdiction
+    :param workers: number of threads used to read the maps
+    :param progress: callable taking the percentage, or None
+    :return: NRT
+    '''
+    in_fn = get_full_path(directory, in_fn)
+    deforestation_hrp = get_full_path(directory, deforestation_hrp)
+    mask = get_full_path(directory, mask)
+    check_images([in_fn, deforestation_hrp, mask],
+                 {deforestation_hrp: BINARY_MESSAGE.format("MAP OF DEFORESTATION IN THE HRP", "deforestation"),
+                  mask: BINARY_MESSAGE.format("MASK OF THE JURISDICTION", "jurisdiction")})
+
+    vulnerability_map = VulnerabilityMap(progress)
+    vulnerability_map.set_working_directory(directory)
+    return vulnerability_map.nrt_calculation(in_fn, deforestation_hrp, mask, workers)
+
+def vulnerability(directory, in_fn, mask, out_fn, NRT=None, n_classes=29, workers=1, creation_profile=DEFAULT_PROFILE,
+                  progress=None):
+    '''
+    Create the vulnerability map of the benchmark model (RMT screens)
+    :param directory: working directory
+    :param in_fn: map of distance from the forest edge
+    :param mask: mask of the jurisdiction
+    :param out_fn: name of the vulnerability map
+    :param NRT: Negligible Risk Threshold
+    :param n_classes: number of classes below the NRT
+    :param workers: number of threads used to classify the map
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return:
+    '''
+    if NRT is None:
+        raise ValueError("Please enter the NRT value!")
+    if int(NRT) <= 0:
+        raise ValueError("NRT value should be larger than 0!")
+    check_output(out_fn, "Vulnerability Map")
+    in_fn = get_full_path(directory, in_fn)
+    mask = get_full_path(directory, mask)
+
+    vulnerability_map = VulnerabilityMap(progress, creation_profile)
+    vulnerability_map.set_working_directory(directory)
+    vulnerability_map.geometric_classification_streaming(in_fn, int(NRT), int(n_classes), mask, out_fn,
+                                                         gdal.GDT_Int16, -1, workers)
+    vulnerability_map.replace_ref_system(in_fn, out_fn)
+    return
+
+def vulnerability_alternative(directory, in_fn, mask, fmask, out_fn, n_classes=30, workers=1,
+                              creation_profile=DEFAULT_PROFILE, progress=None):
+    '''
+    Create the vulnerability map of an alternative model (RMT screens)
+    :param directory: working directory
+    :param in_fn: alternative vulnerability map
+    :param mask: mask of the non-excluded jurisdiction
+    :param fmask: mask of forest areas
+    :param out_fn: name of the vulnerability map
+    :param n_classes: number of classes
+    :param workers: number of threads used to classify the map
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return:
+    '''
+    check_output(out_fn, "Vulnerability Map")
+    in_fn = get_full_path(directory, in_fn)
+    mask = get_full_path(directory, mask)
+    fmask = get_full_path(directory, fmask)
+    check_images([in_fn, mask, fmask],
+                 {fmask: BINARY_MESSAGE.format("MASK OF FOREST AREAS", "forest areas"),
+                  mask: BINARY_MESSAGE.format("MASK OF THE NON-EXCLUDED JURISDICTION", "areas inside the jurisdiction")})
+
+    vulnerability_map = VulnerabilityMap(progress, creation_profile)
+    vulnerability_map.set_working_directory(directory)
+    vulnerability_map.geometric_classification_alternative_streaming(in_fn, int(n_classes), mask, fmask, out_fn,
+                                                                     gdal.GDT_Int16, -1, workers)
+    vulnerability_map.replace_ref_system(in_fn, out_fn)
+    return
+
+def allocation_fit(directory, risk30_hrp, municipality, deforestation_hrp, csv_name, out_fn1, out_fn2,
+                   creation_profile=DEFAULT_PROFILE, progress=None):
+    '''
+    Fit the relative frequency table and density map (AT fitting screens)
+    :param directory: working directory
+    :param risk30_hrp: vulnerability map in the CAL/HRP
+    :param municipality: map of administrative divisions
+    :param deforestation_hrp: map of deforestation in the CAL/HRP
+    :param csv_name: name of the relative frequency table, .csv or .npz (binary table with a .csv export)
+    :param out_fn1: name of the modeling region map
+    :param out_fn2: name of the fitted density map
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return:
+    '''
+    check_output(out_fn1, "Modeling Region Map")
+    check_output(csv_name, "Relative Frequency Table", ('.csv', '.npz'))
+    check_output(out_fn2, "Fitted Density Map")
+    risk30_hrp = get_full_path(directory, risk30_hrp)
+    municipality = get_full_path(directory, municipality)
+    deforestation_hrp = get_full_path(directory, deforestation_hrp)
+    check_images([risk30_hrp, municipality, deforestation_hrp],
+                 {deforestation_hrp: BINARY_MESSAGE.format("MAP OF DEFORESTATION IN THE CAL/HRP", "deforestation")})
+
+    allocation_tool = AllocationTool(progress, creation_profile=creation_profile)
+    allocation_tool.execute_workflow_fit(directory, risk30_hrp, municipality, deforestation_hrp, csv_name,
+                                         out_fn1, out_fn2)
+    return
+
+def allocation_cnf(directory, csv, municipality, deforestation_cnf, risk30_vp, out_fn1, out_fn2, max_iterations=None,
+                   tabulation_cache=None, out_of_core=False, creation_profile=DEFAULT_PROFILE, progress=None):
+    '''
+    Predict the adjusted density map in the CNF (AT prediction screen)
+    :param directory: working directory
+    :param csv: relative frequency table of the CAL
+    :param municipality: map of administrative divisions
+    :param deforestation_cnf: map of deforestation in the CNF
+    :param risk30_vp: vulnerability map in the CNF
+    :param out_fn1: name of the prediction modeling region map
+    :param out_fn2: name of the adjusted prediction density map
+    :param max_iterations: deprecated and ignored, the AR is solved directly without iterations
+    :param tabulation_cache: TabulationCache or cache directory of the modeling region maps, or None
+    :param out_of_core: keep the modeling region map on disk only, for maps larger than the memory
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return: id_difference: modeling region IDs missing from the CAL, iteration_count: always 0
+    '''
+    check_output(out_fn1, "Prediction Modeling Region Map in CNF")
+    check_output(out_fn2, "Adjusted Prediction Density Map in CNF")
+    csv = get_full_path(directory, csv)
+    municipality = get_full_path(directory, municipality)
+    deforestation_cnf = get_full_path(directory, deforestation_cnf)
+    risk30_vp = get_full_path(directory, risk30_vp)
+    check_images([municipality, deforestation_cnf, risk30_vp],
+                 {deforestation_cnf: BINARY_MESSAGE.format("MAP OF DEFORESTATION IN THE CNF", "deforestation")})
+
+    warn_max_iterations(max_iterations)
+    allocation_tool = AllocationTool(progress, tabulation_cache, bool(out_of_core), creation_profile)
+    return allocation_tool.execute_workflow_cnf(directory, None, csv, municipality, deforestation_cnf,
+                                                risk30_vp, out_fn1, out_fn2)
+
+def allocation_vp(directory, csv, municipality, expected_deforestation, risk30_vp, out_fn1, out_fn2,
+                  max_iterations=None, tabulation_cache=None, out_of_core=False, creation_profile=DEFAULT_PROFILE,
+                  progress=None):
+    '''
+    Predict the adjusted density map in the VP (AT prediction screen)
+    :param directory: working directory
+    :param csv: relative frequency table of the HRP
+    :param municipality: map of administrative divisions
+    :param expected_deforestation: expected annual jurisdictional deforestation (ha/year)
+    :param risk30_vp: vulnerability map in the VP
+    :param out_fn1: name of the prediction modeling region map
+    :param out_fn2: name of the adjusted prediction density map
+    :param max_iterations: deprecated and ignored, the AR is solved directly without iterations
+    :param tabulation_cache: TabulationCache or cache directory of the modeling region maps, or None
+    :param out_of_core: keep the modeling region map on disk only, for maps larger than the memory
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return: id_difference: modeling region IDs missing from the HRP, iteration_count: always 0
+    '''
+    check_output(out_fn1, "Prediction Modeling Region Map in VP")
+    check_output(out_fn2, "Adjusted Prediction Density Map in VP")
+    csv = get_full_path(directory, csv)
+    municipality = get_full_path(directory, municipality)
+    risk30_vp = get_full_path(directory, risk30_vp)
+    check_images([municipality, risk30_vp])
+
+    warn_max_iterations(max_iterations)
+    allocation_tool = AllocationTool(progress, tabulation_cache, bool(out_of_core), creation_profile)
+    return allocation_tool.execute_workflow_vp(directory, None, csv, municipality,
+                                               float(expected_deforestation), risk30_vp, out_fn1, out_fn2)
+
+def scenario_name(value):
+    '''
+    Name of an expected deforestation scenario, distinct for distinct values (unlike the rounded :g format)
+    :param value: expected deforestation (ha/year)
+    :return: the value without a trailing .0 for whole numbers, e.g. 1500 or 1500.25
+    '''
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def allocation_vp_scenarios(directory, csv, municipality, expected_deforestation, risk30_vp, out_fn1, out_fn2,
+                            workers=1, tabulation_cache=None, out_of_core=False, creation_profile=DEFAULT_PROFILE,
+                            progress=None):
+    '''
+    Predict one adjusted density map in the VP per expected deforestation scenario, sharing the modeling region map
+    and bin table of all scenarios
+    :param directory: working directory
+    :param csv: relative frequency table of the HRP
+    :param municipality: map of administrative divisions
+    :param expected_deforestation: list of expected annual jurisdictional deforestation (ha/year), or a single value
+    :param risk30_vp: vulnerability map in the VP
+    :param out_fn1: name of the prediction modeling region map
+    :param out_fn2: list of adjusted prediction density map names, one per scenario, or a single name to which
+                    each expected deforestation is appended (density.tif -> density_1500.tif, density_1500.5.tif)
+    :param workers: number of maps written at the same time
+    :param tabulation_cache: TabulationCache or cache directory of the modeling region maps, or None
+    :param out_of_core: keep the modeling region map on disk only, for maps larger than the memory
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return: id_difference: modeling region IDs missing from the HRP, ARs: Adjustment Ratio of each scenario
+    '''
+    if isinstance(expected_deforestation, (int, float, str)):
+        expected_deforestation = [expected_deforestation]
+    expected_deforestations = [float(value) for value in expected_deforestation]
+    if isinstance(out_fn2, str):
+        base, ext = os.path.splitext(out_fn2)
+        out_fn2 = [f"{base}_{scenario_name(value)}{ext}" for value in expected_deforestations]
+    check_output(out_fn1, "Prediction Modeling Region Map in VP")
+    for out_fn in out_fn2:
+        check_output(out_fn, "Adjusted Prediction Density Map in VP")
+    csv = get_full_path(directory, csv)
+    municipality = get_full_path(directory, municipality)
+    risk30_vp = get_full_path(directory, risk30_vp)
+    check_images([municipality, risk30_vp])
+
+    allocation_tool = AllocationTool(progress, tabulation_cache, bool(out_of_core), creation_profile)
+    return allocation_tool.execute_workflow_vp_scenarios(directory, csv, municipality, expected_deforestations,
+                                                         risk30_vp, out_fn1, list(out_fn2), workers)
+
+def evaluation_fit(directory, mask, density, deforestation_hrp, grid_area, title, out_fn, raster_fn, xmax='Default',
+                   ymax='Default', raster_mode=False, creation_profile=DEFAULT_PROFILE, progress=None):
+    '''
+    Evaluate the fitted density map (MCT fitting screen)
+    :param directory: working directory
+    :param mask: mask of the non-excluded jurisdiction
+    :param density: fitted density map
+    :param deforestation_hrp: map of deforestation in the CAL
+    :param grid_area: assessment grid cell area (ha)
+    :param title: plot title
+    :param out_fn: name of the plot
+    :param raster_fn: name of the residual map
+    :param xmax: maximum x-axis value or 'Default'
+    :param ymax: maximum y-axis value or 'Default'
+    :param raster_mode: compute the assessment grid from pixel rows and columns, without polygonizing the mask or
+                        writing the Thiessen polygon shapefile
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return:
+    '''
+    check_output(out_fn, "plot", ('.png', '.jpg', '.pdf', '.svg', '.eps', '.ps', '.tif'))
+    check_output(raster_fn, "Residual Map")
+    if float(grid_area) <= 0:
+        raise ValueError("Thiessen polygon grid area value should larger than 0!")
+    mask = get_full_path(directory, mask)
+    density = get_full_path(directory, density)
+    deforestation_hrp = get_full_path(directory, deforestation_hrp)
+    check_images([mask, deforestation_hrp, density],
+                 {mask: BINARY_MESSAGE.format("MASK OF THE NON-EXCLUDED JURISDICTION", "areas inside the jurisdiction"),
+                  deforestation_hrp: BINARY_MESSAGE.format("MAP OF DEFORESTATION IN THE CAL", "deforestation")})
+
+    model_evaluation = ModelEvaluation(progress, creation_profile)
+    model_evaluation.set_working_directory(directory)
+    if raster_mode:
+        clipped_gdf = model_evaluation.create_grid_evaluation(float(grid_area), mask, density, deforestation_hrp, out_fn,
+                                                              raster_fn)
+    else:
+        model_evaluation.create_mask_polygon(mask)
+        clipped_gdf = model_evaluation.create_thiessen_polygon(float(grid_area), mask, density, deforestation_hrp,
+                                                               out_fn, raster_fn)
+    model_evaluation.replace_ref_system(mask, raster_fn)
+    model_evaluation.create_plot(grid_area, clipped_gdf, title, out_fn, xmax, ymax)
+    model_evaluation.remove_temp_files()
+    return
+
+def evaluation_cnf(directory, mask, fmask, deforestation_cal, deforestation_hrp, density, grid_area, title, out_fn,
+                   raster_fn, out_fn_def, xmax='Default', ymax='Default', raster_mode=False,
+                   creation_profile=DEFAULT_PROFILE, progress=None):
+    '''
+    Evaluate the adjusted prediction density map in the CNF (MCT prediction screen)
+    :param directory: working directory
+    :param mask: mask of the non-excluded jurisdiction
+    :param fmask: mask of forest areas in the CAL
+    :param deforestation_cal: map of deforestation in the CAL
+    :param deforestation_hrp: map of deforestation in the CNF
+    :param density: adjusted prediction density map
+    :param grid_area: assessment grid cell area (ha)
+    :param title: plot title
+    :param out_fn: name of the plot
+    :param raster_fn: name of the residual map
+    :param out_fn_def: name of the combined deforestation reference map
+    :param xmax: maximum x-axis value or 'Default'
+    :param ymax: maximum y-axis value or 'Default'
+    :param raster_mode: compute the assessment grid from pixel rows and columns, without polygonizing the mask or
+                        writing the Thiessen polygon shapefile
+    :param creation_profile: GeoTIFF creation profile of the output maps, a key of raster_stack.CREATION_PROFILES
+    :param progress: callable taking the percentage, or None
+    :return:
+    '''
+    check_output(out_fn, "plot", ('.png', '.jpg', '.pdf', '.svg', '.eps', '.ps', '.tif'))
+    check_output(raster_fn, "Residual Map")
+    check_output(out_fn_def, "Combined Deforestation Reference Map")
+    if float(grid_area) <= 0:
+        raise ValueError("Thiessen polygon grid area value should larger than 0!")
+    mask = get_full_path(directory, mask)
+    fmask = get_full_path(directory, fmask)
+    deforestation_cal = get_full_path(directory, deforestation_cal)
+    deforestation_hrp = get_full_path(directory, deforestation_hrp)
+    density = get_full_path(directory, density)
+    check_images([mask, fmask, deforestation_cal, deforestation_hrp, density],
+                 {mask: BINARY_MESSAGE.format("MASK OF THE NON-EXCLUDED JURISDICTION", "areas inside the jurisdiction"),
+                  deforestation_hrp: BINARY_MESSAGE.format("MAP OF DEFORESTATION IN THE CNF", "deforestation"),
+                  deforestation_cal: BINARY_MESSAGE.format("MAP OF DEFORESTATION IN THE CAL", "deforestation"),
+                  fmask: BINARY_MESSAGE.format("MASK OF FOREST AREAS IN THE CAL", "forest areas")})
+
+    model_evaluation = ModelEvaluation(progress, creation_profile)
+    model_evaluation.set_working_directory(directory)
+    if raster_mode:
+        clipped_gdf = model_evaluation.create_grid_evaluation(float(grid_area), mask, density, deforestation_hrp, out_fn,
+                                                              raster_fn)
+    else:
+        model_evaluation.create_mask_polygon(mask)
+        clipped_gdf = model_evaluation.create_thiessen_polygon(float(grid_area), mask, density, deforestation_hrp,
+                                                               out_fn, raster_fn)
+    model_evaluation.replace_ref_system(mask, raster_fn)
+    model_evaluation.create_deforestation_map(fmask, deforestation_cal, deforestation_hrp, out_fn_def)
+    model_evaluation.replace_ref_system(fmask, out_fn_def)
+    model_evaluation.replace_legend(out_fn_def)
+    model_evaluation.create_plot(grid_area, clipped_gdf, title, out_fn, xmax, ymax)
+    model_evaluation.remove_temp_files()
+    return
+
+WORKFLOWS = {
+    'nrt': nrt,
+    'vulnerability': vulnerability,
+    'vulnerability_alternative': vulnerability_alternative,
+    'allocation_fit': allocation_fit,
+    'allocation_cnf': allocation_cnf,
+    'allocation_vp': allocation_vp,
+    'allocation_vp_scenarios': allocation_vp_scenarios,
+    'evaluation_fit': evaluation_fit,
+    'evaluation_cnf': evaluation_cnf,
+}
+
+# Workflows that accept the 'workers' key of a job
+THREADED_WORKFLOWS = ('nrt', 'vulnerability', 'vulnerability_alternative', 'allocation_vp_scenarios')
+
+# Workflows that accept the tabulation cache and out_of_core keys of a job
+PREDICTION_WORKFLOWS = ('allocation_cnf', 'allocation_vp', 'allocation_vp_scenarios')
+
+# Workflows that write maps and accept the creation_profile key of a job
+PROFILE_WORKFLOWS = tuple(workflow for workflow in WORKFLOWS if workflow != 'nrt')
+
+def run_job(job, progress=None, log=print):
+    '''
+    Run the steps of one job in order
+    :param job: dictionary with 'directory', 'steps' and optionally 'workers', 'cache_dir', 'cache_max_gb',
+                'out_of_core' and 'creation_profile'
+    :param progress: callable taking the percentage, or None
+    :param log: callable taking a message
+    :return: results: list of the values returned by each step
+    '''
+    directory = job.get('directory')
+    if not directory:
+        raise ValueError("Please select or enter the working directory!")
+    directory = os.path.abspath(directory)
+
+    tabulation_cache = None
+    if job.get('cache_dir'):
+        tabulation_cache = TabulationCache(job['cache_dir'], int(float(job.get('cache_max_gb', 10)) * 2 ** 30))
+
+    NRT = job.get('NRT')
+    results = []
+    for step in job.get('steps', []):
+        step = dict(step)
+        workflow = step.pop('workflow', None)
+        if workflow not in WORKFLOWS:
+            raise ValueError(f"Unknown workflow '{workflow}', expected one of {', '.join(WORKFLOWS)}")
+        if workflow in THREADED_WORKFLOWS and 'workers' in job:
+            step.setdefault('workers', job['workers'])
+        if workflow in PREDICTION_WORKFLOWS and tabulation_cache is not None:
+            step.setdefault('tabulation_cache', tabulation_cache)
+        if workflow in PREDICTION_WORKFLOWS and 'out_of_core' in job:
+            step.setdefault('out_of_core', job['out_of_core'])
+        if workflow in PROFILE_WORKFLOWS and 'creation_profile' in job:
+            step.setdefault('creation_profile', job['creation_profile'])
+        if workflow == 'vulnerability':
+            step.setdefault('NRT', NRT)
+
+        log(f"{directory}: {workflow}")
+        result = WORKFLOWS[workflow](directory, progress=progress, **step)
+        results.append(result)
+
+        if workflow == 'nrt':
+            NRT = result
+            log(f"{directory}: NRT is {NRT}")
+        elif workflow == 'allocation_vp_scenarios':
+            log(f"{directory}: AR of each scenario: {', '.join(f'{AR:.6g}' for AR in result[1])}")
+        if workflow in ('allocation_cnf', 'allocation_vp', 'allocation_vp_scenarios'):
+            id_difference = result[0]
+            if id_difference.size > 0:
+                log(f"{directory}: Warning: Modeling Region ID {','.join(map(str, id_difference))} do not exist in the "
+                    f"fitting stage. Relative frequencies for missing bins have been estimated from corresponding "
+                    f"vulnerability zones over the entire jurisdiction.")
+    return results
+
+def load_jobs(config_fn):
+    '''
+    Read the jobs of a config file
+    :param config_fn: JSON config file
+    :return: jobs: list of job dictionaries with the shared keys filled in
+    '''
+    with open(config_fn, 'r') as read_file:
+        config = json.load(read_file)
+
+    # A bare list is a list of jobs, a dictionary without 'jobs' is a single job
+    if isinstance(config, list):
+        config = {'jobs': config}
+    shared = {key: value for key, value in config.items() if key != 'jobs'}
+    jobs = config.get('jobs', [{}])
+
+    # Relative working and cache directories are relative to the config file
+    config_dir = os.path.dirname(os.path.abspath(config_fn))
+    merged_jobs = []
+    for job in jobs:
+        job = {**shared, **job}
+        for key in ('directory', 'cache_dir'):
+            if job.get(key):
+                job[key] = os.path.join(config_dir, job[key])
+        merged_jobs.append(job)
+    return merged_jobs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='udef-arp', description='Run UDef-ARP workflows without the GUI.')
+    parser.add_argument('config', help='JSON config file with one job or a list of jobs')
+    parser.add_argument('--workers', type=int, help='number of threads for the RMT steps, overrides the config')
+    parser.add_argument('--cache-dir', help='cache directory of the prediction modeling region maps, overrides the config')
+    parser.add_argument('--creation-profile', choices=list(CREATION_PROFILES),
+                        help=f"GeoTIFF creation profile of the output maps ({DEFAULT_PROFILE} by default), "
+                             f"overrides the config")
+    parser.add_argument('--keep-going', action='store_true', help='run the remaining jobs after a job fails')
+    parser.add_argument('--quiet', action='store_true', help='do not print progress')
+    args = parser.parse_args(argv)
+
+    def progress(value):
+        print(f"  {value}%", flush=True)
+
+    # Relative to the directory the command is run from, before any job changes the working directory
+    cache_dir = os.path.abspath(args.cache_dir) if args.cache_dir is not None else None
+
+    failed = 0
+    for job in load_jobs(args.config):
+        if args.workers is not None:
+            job['workers'] = args.workers
+        if cache_dir is not None:
+            job['cache_dir'] = cache_dir
+        if args.creation_profile is not None:
+            job['creation_profile'] = args.creation_profile
+        try:
+            run_job(job, None if args.quiet else progress)
+        except Exception:
+            failed += 1
+            print(f"{job.get('directory')}: An Error Occurred During Processing", file=sys.stderr)
+            traceback.print_exc()
+            if not args.keep_going:
+                break
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,21 @@
 import os
 import numpy as np
 from osgeo import gdal
-from PyQt5.QtCore import QObject, pyqtSignal
 import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from raster_stack import RasterStack, DEFAULT_PROFILE
+from progress import ProgressReporter
 
 # GDAL exceptions
 gdal.UseExceptions()
 
-class VulnerabilityMap(QObject):
-    progress_updated = pyqtSignal(int)
-    def __init__(self):
-        super(VulnerabilityMap, self).__init__()
+class VulnerabilityMap:
+    def __init__(self, progress_callback=None, creation_profile=DEFAULT_PROFILE):
+        self.progress_updated = ProgressReporter(progress_callback)
         self.data_folder = None
         self.initial_directory = None
+        self.rasters = RasterStack(creation_profile)
 
     def set_working_directory(self, directory):
         '''
@@ -22,53 +25,49 @@ class VulnerabilityMap(QObject):
         self.progress_updated.emit(0)
         self.data_folder = directory
         os.chdir(self.data_folder)
+        self.rasters.close()
 
-    def image_to_array(self,image):
-        # Set up a GDAL dataset
-        in_ds = gdal.Open(image)
-        # Set up a GDAL band
-        in_band = in_ds.GetRasterBand(1)
-        # Create Numpy Array1
-        arr = in_band.ReadAsArray()
-        return arr
-
-    def nrt_calculation(self, in_fn, deforestation_hrp, mask):
+    def nrt_calculation(self, in_fn, deforestation_hrp, mask, workers=1):
         '''
         NRT calculation
         :param in_fn: map of distance from the forest eddge in CAL
         :param deforestation_hrp:deforestation binary map in HRP
         :param mask: mask of the non-excluded jurisdiction (binary map)
+        :param workers: number of threads processing the raster windows
         :return: NRT: Negligible Risk Threshold
         '''
-        # Convert image to NumPy array
+        # The rasters are read window by window
+        windows = self.rasters.windows(in_fn)
         self.progress_updated.emit(10)
-        distance_arr_cal = self.image_to_array(in_fn)
-        self.progress_updated.emit(30)
-        deforestation_hrp_arr = self.image_to_array(deforestation_hrp)
-        self.progress_updated.emit(40)
-        mask_arr = self.image_to_array(mask)
-        self.progress_updated.emit(50)
 
-        # Mask the distance arr within deforstation pixel and study area
-        distance_arr_masked=distance_arr_cal*mask_arr*deforestation_hrp_arr
-        self.progress_updated.emit(60)
-
-        ## Calculate the histogram
-        # Flatten the distance_arr_masked and expect 0 for np.histogram function
-        # The np.histogram is computed over the flattened array
-        distance_arr_masked_1d = distance_arr_masked.flatten()
-        self.progress_updated.emit(80)
-        distance_arr_masked_1d = distance_arr_masked_1d[distance_arr_masked_1d != 0]
+        # First pass: range of the distance within deforestation pixels and study area
+        distance_min = None
+        distance_max = None
+        distance_range = lambda window: self.masked_distance_range(in_fn, deforestation_hrp, mask, window)
+        for window_range in self.map_windows(distance_range, windows, workers):
+            if window_range is not None:
+                window_min, window_max = window_range
+                distance_min = window_min if distance_min is None else min(distance_min, window_min)
+                distance_max = window_max if distance_max is None else max(distance_max, window_max)
+        if distance_min is None:
+            raise ValueError("No deforestation pixels were found within the mask of the jurisdiction.")
+        self.progress_updated.emit(40)
 
         ## Calculate the histogram
         # Set up bin width as spatial resolution
-        in_ds = gdal.Open(in_fn)
-        P = in_ds.GetGeoTransform()[1]
+        P = self.rasters.resolution(in_fn)
         bin_width = P
-        # Calculate the histogram
-        hist, bin_edges = np.histogram(distance_arr_masked_1d, bins=np.arange(distance_arr_masked_1d.min(),
-                                                                              distance_arr_masked_1d.max() + bin_width,
-                                                                               bin_width))
+        bin_edges = np.arange(distance_min, distance_max + bin_width, bin_width)
+
+        # Second pass: accumulate the histogram counts of each window
+        hist = np.zeros(len(bin_edges) - 1, dtype=np.int64)
+        distance_hist = lambda window: self.histogram_counts(
+            self.masked_distance(in_fn, deforestation_hrp, mask, window), bin_edges)
+        for window_hist in self.map_windows(distance_hist, windows, workers):
+            hist += window_hist
+        self.rasters.close()
+        self.progress_updated.emit(80)
+
         # Calculate the cumulative proportion
         # Normalize the histogram to get probability
         hist_normalized = hist / np.sum(hist)
@@ -89,27 +88,53 @@ class VulnerabilityMap(QObject):
         self.progress_updated.emit(100)
         return NRT
 
-    def geometric_classification(self, in_fn, NRT, n_classes, mask):
+    def masked_distance(self, in_fn, deforestation_hrp, mask, window):
         '''
-        geometric classification
-        :param in_fn: map of distance from the forest eddge
-        :param NRT:Negligible Risk Threshold
-        :param n_classes:number of classes
-        :param mask:mask of the non-excluded jurisdiction (binary map)
-        :return: mask_arr: result array with mask larger than NRT
+        Read the distance within deforestation pixels and study area for one window
+        :param in_fn: map of distance from the forest edge
+        :param deforestation_hrp: deforestation binary map
+        :param mask: mask of the non-excluded jurisdiction
+        :param window: (xoff, yoff, xsize, ysize) window
+        :return: distance_1d: 1D array of the non-zero masked distances
         '''
-        # Convert in_fn to NumPy array
-        # Set up a GDAL dataset
-        in_ds = gdal.Open(in_fn)
-        # Set up a GDAL band
-        in_band = in_ds.GetRasterBand(1)
-        # Create Numpy Array
-        arr = in_band.ReadAsArray()
+        # Mask the distance arr within deforstation pixel and study area
+        # The binary maps are read as bool, so the product keeps the data type of the distance map
+        distance_arr_masked = self.rasters.read_window(in_fn, window) * (self.rasters.read_binary(mask, window) &
+                                                                         self.rasters.read_binary(deforestation_hrp, window))
+        return distance_arr_masked[distance_arr_masked != 0]
 
-        # The lower limit of the highest class = spatial resolution (the minimum distance possible without being in non-forest)
-        LL = int(in_ds.GetGeoTransform()[1])
+    def masked_distance_range(self, in_fn, deforestation_hrp, mask, window):
+        '''
+        Minimum and maximum of the distance within deforestation pixels and study area for one window
+        :return: (min, max), or None if the window has no such pixels
+        '''
+        distance_1d = self.masked_distance(in_fn, deforestation_hrp, mask, window)
+        if distance_1d.size == 0:
+            return None
+        return distance_1d.min(), distance_1d.max()
 
-        self.progress_updated.emit(10)
+    def histogram_counts(self, values, bin_edges):
+        '''
+        Count values per bin, with the same bins as np.histogram(values, bins=bin_edges)
+        :param values: 1D array
+        :param bin_edges: monotonically increasing bin edges
+        :return: counts: number of values in each bin
+        '''
+        n_bins = len(bin_edges) - 1
+        # Bins are half-open [left, right) except the last one, which includes its right edge
+        bins = np.searchsorted(bin_edges, values, side='right') - 1
+        bins[values == bin_edges[-1]] = n_bins - 1
+        bins = bins[(bins >= 0) & (bins < n_bins)]
+        return np.bincount(bins, minlength=n_bins)
+
+    def geometric_risk_class(self, LL, NRT, n_classes):
+        '''
+        Calculate the upper and lower limits of the geometric classes within the NRT
+        :param LL: lower limit of the highest class (spatial resolution)
+        :param NRT: Negligible Risk Threshold
+        :param n_classes: number of classes
+        :return: risk_class: 2D array with the [UL, LL] limits of each class
+        '''
         # The upper limit of the lowest class = the Negligible Risk Threshold
         UL = NRT = int(NRT)
         n_classes = int(n_classes)
@@ -125,53 +150,14 @@ class VulnerabilityMap(QObject):
         risk_class=np.multiply(UL,x)
         risk_class[n_classes-1][1] = LL
         risk_class[0][0] = NRT
+        return risk_class
 
-        self.progress_updated.emit(20)
-
-        # Multiple Distance to Non-Forest to
-        mask_arr0 = self.image_to_array(mask)
-        mask_arr=arr * mask_arr0
-        # Create mask: areas beyond the NRT, assign class 1
-        mask_arr[mask_arr >= NRT] = 1
-
-        self.progress_updated.emit(30)
-        for i in range(n_classes):
-            lower = risk_class[i][0]
-            upper = risk_class[i][1]
-            mask_arr[(lower > mask_arr) & (mask_arr >= upper)] = i + 2
-            if i % 5 == 0:
-                progress = 40 + (10 * (i // 5))
-                self.progress_updated.emit(progress)
-
-        return mask_arr
-
-    def geometric_classification_alternative(self, in_fn, n_classes, mask, fmask):
+    def alternative_risk_class(self, n_classes):
         '''
-        geometric classification for alternative vulnerability map
-        :param in_fn: Empirical vulnerability map [0.0,1.0] range
-        :param n_classes:number of classes
-        :param mask: mask of the non-excluded jurisdiction (binary map)
-        :param fmask: mask of the forest areas (binary map)
-        :return: mask_arr: result array with mask larger than NRT
+        Calculate the upper and lower limits of the geometric classes of the rescaled [1.0–2.0] vulnerability map
+        :param n_classes: number of classes
+        :return: risk_class: 2D array with the [UL, LL] limits of each class
         '''
-        # Convert in_fn to NumPy array
-        # Set up a GDAL dataset
-        in_ds = gdal.Open(in_fn)
-        # Set up a GDAL band
-        in_band = in_ds.GetRasterBand(1)
-        # Create Numpy Array
-        arr = in_band.ReadAsArray()
-
-        self.progress_updated.emit(10)
-
-        max_value = in_band.GetMaximum()
-        if max_value is None:
-            # Calculate max_value for raster images without metadata
-            max_value = np.max(arr)
-
-        # Rescaled empirical vulnerability map to a [1.0–2.0] range
-        arr_rescale = 1+arr*1/max_value
-
         # The lower limit of the highest class = 1
         LL = int(1)
 
@@ -189,33 +175,253 @@ class VulnerabilityMap(QObject):
 
         # Explicitly set llmin
         risk_class[0][1] = LL
+        return risk_class
+
+    def classify_distance(self, mask_arr, NRT, risk_class):
+        '''
+        Assign the geometric classes to a masked distance array (in place)
+        :param mask_arr: distance from the forest edge multiplied by the jurisdiction mask
+        :param NRT: Negligible Risk Threshold
+        :param risk_class: class limits from geometric_risk_class
+        :return: mask_arr: classified array
+        '''
+        # Areas beyond the NRT are class 1, class i within the NRT covers [risk_class[i][1], risk_class[i][0])
+        steps = [(int(NRT), np.inf, 1)]
+        steps += [(risk_class[i][1], risk_class[i][0], i + 2) for i in range(len(risk_class))]
+
+        return self.lookup_classes(mask_arr, steps)
+
+    def lookup_classes(self, arr, steps):
+        '''
+        Reclassify an array (in place) with a single binned lookup.
+        The result is the same as applying arr[(lower <= arr) & (arr < upper)] = value for each step in order
+        :param arr: NumPy array to classify
+        :param steps: list of (lower, upper, value) reclassification steps
+        :return: arr: classified array
+        '''
+        # Bin j covers edges[j-1] <= value < edges[j]; bin 0 and bin len(edges) are outside all edges
+        edges = np.unique([limit for lower, upper, _ in steps for limit in (lower, upper)])
+        n_bins = len(edges) + 1
+
+        # Replay the steps on each bin: a bin either keeps its value or ends up with a class value.
+        # A class value that falls inside the range of a later step is reassigned, as in the step-by-step loop.
+        assign = np.zeros(n_bins, dtype=bool)
+        values = np.zeros(n_bins, dtype=np.float64)
+        for j in range(1, n_bins - 1):
+            for lower, upper, value in steps:
+                if assign[j]:
+                    if lower <= values[j] < upper:
+                        values[j] = value
+                elif lower <= edges[j - 1] and edges[j] <= upper:
+                    assign[j] = True
+                    values[j] = value
+
+        # Find the bin of every pixel in one pass and write the class values
+        bins = np.searchsorted(edges, arr, side='right')
+        np.copyto(arr, values[bins], casting='unsafe', where=assign[bins])
+        return arr
+
+    def map_windows(self, function, windows, workers=1):
+        '''
+        Apply a function to each window, on a thread pool if workers > 1.
+        Results are returned in window order, so the outcome does not depend on the number of workers
+        :param function: function taking a (xoff, yoff, xsize, ysize) window
+        :param windows: list of windows
+        :param workers: number of threads, None for all CPU cores
+        :return: generator of the function results
+        '''
+        if workers is None:
+            workers = os.cpu_count()
+        if workers <= 1:
+            yield from map(function, windows)
+            return
+
+        # Keep a bounded number of windows in flight so that results do not pile up in memory
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for window in windows:
+                pending.append(executor.submit(function, window))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def classify_distance_window(self, in_fn, NRT, mask, risk_class, window):
+        '''
+        Geometric classification of one window
+        :return: mask_arr: classified window
+        '''
+        # Multiple Distance to Non-Forest to mask
+        mask_arr = self.rasters.read_window(in_fn, window) * self.rasters.read_binary(mask, window)
+        return self.classify_distance(mask_arr, NRT, risk_class)
+
+    def geometric_classification(self, in_fn, NRT, n_classes, mask, workers=1):
+        '''
+        geometric classification
+        :param in_fn: map of distance from the forest eddge
+        :param NRT:Negligible Risk Threshold
+        :param n_classes:number of classes
+        :param mask:mask of the non-excluded jurisdiction (binary map)
+        :param workers: number of threads processing the raster windows
+        :return: mask_arr: result array with mask larger than NRT
+        '''
+        # The lower limit of the highest class = spatial resolution (the minimum distance possible without being in non-forest)
+        LL = int(self.rasters.resolution(in_fn))
+
+        self.progress_updated.emit(10)
+        risk_class = self.geometric_risk_class(LL, NRT, n_classes)
 
         self.progress_updated.emit(20)
 
-        # Mask jurisdiction and forest area
-        # Create jurisdiction mask array
-        in_ds1 = gdal.Open(mask)
-        in_band1 = in_ds1.GetRasterBand(1)
-        mask_arr = in_band1.ReadAsArray()
-        # Create forest area array
-        in_ds2 = gdal.Open(fmask)
-        in_band2 = in_ds2.GetRasterBand(1)
-        fmask_arr = in_band2.ReadAsArray()
+        windows = self.rasters.windows(in_fn)
+        classify = lambda window: self.classify_distance_window(in_fn, NRT, mask, risk_class, window)
+        mask_arr = self.merge_windows(self.rasters.size(in_fn), windows, self.map_windows(classify, windows, workers))
+        self.rasters.close()
+        self.progress_updated.emit(90)
+
+        return mask_arr
+
+    def geometric_classification_streaming(self, in_fn, NRT, n_classes, mask, out_fn, data_type=gdal.GDT_Int16, nodata=-1,
+                                           workers=1):
+        '''
+        geometric classification written window by window, so that peak memory is bounded by the window size
+        :param in_fn: map of distance from the forest eddge
+        :param NRT:Negligible Risk Threshold
+        :param n_classes:number of classes
+        :param mask:mask of the non-excluded jurisdiction (binary map)
+        :param out_fn: path to the vulnerability map to create
+        :param data_type: output data type
+        :param nodata: optional NoData value
+        :param workers: number of threads processing the raster windows
+        :return:
+        '''
+        # The lower limit of the highest class = spatial resolution (the minimum distance possible without being in non-forest)
+        LL = int(self.rasters.resolution(in_fn))
+        risk_class = self.geometric_risk_class(LL, NRT, n_classes)
+
+        self.progress_updated.emit(10)
+
+        # Classify each window and write it straight into the output dataset, in window order
+        cols, rows = self.rasters.size(in_fn)
+        with self.rasters.writer(in_fn, out_fn, data_type, nodata) as writer:
+            windows = writer.windows()
+            classify = lambda window: self.classify_distance_window(in_fn, NRT, mask, risk_class, window)
+            for (xoff, yoff, xsize, ysize), mask_arr in zip(windows, self.map_windows(classify, windows, workers)):
+                writer.write(mask_arr, xoff, yoff)
+                self.progress_updated.emit(10 + int(80 * (yoff + ysize) / rows))
+
+        self.rasters.close()
+        self.progress_updated.emit(90)
+        return
+
+    def merge_windows(self, size, windows, results):
+        '''
+        Assemble window results into a full size array
+        :param size: (cols, rows) of the array
+        :param windows: list of (xoff, yoff, xsize, ysize) windows
+        :param results: window arrays, in the order of windows
+        :return: arr: full size array
+        '''
+        arr = None
+        for (xoff, yoff, xsize, ysize), window_arr in zip(windows, results):
+            if arr is None:
+                arr = np.empty((size[1], size[0]), dtype=window_arr.dtype)
+            arr[yoff:yoff + ysize, xoff:xoff + xsize] = window_arr
+        return arr
+
+    def classify_alternative_window(self, in_fn, max_value, mask, fmask, risk_class, window):
+        '''
+        Geometric classification of one window of the alternative vulnerability map
+        :return: mask_arr: classified window
+        '''
+        # Rescaled empirical vulnerability map to a [1.0–2.0] range
+        arr_rescale = 1+self.rasters.read_window(in_fn, window)*1/max_value
+
         # Array multiple mask and fmask
-        mask_arr = arr_rescale*mask_arr*fmask_arr
+        mask_arr = arr_rescale*(self.rasters.read_binary(mask, window) & self.rasters.read_binary(fmask, window))
+
+        # Class i covers [risk_class[i][1], risk_class[i][0])
+        steps = [(risk_class[i][1], risk_class[i][0], i + 1) for i in range(len(risk_class))]
+        return self.lookup_classes(mask_arr, steps)
+
+    def alternative_max_value(self, in_fn, windows, workers=1):
+        '''
+        Maximum of the empirical vulnerability map, used to rescale it
+        :param in_fn: Empirical vulnerability map [0.0,1.0] range
+        :param windows: list of windows of in_fn
+        :param workers: number of threads processing the raster windows
+        :return: max_value
+        '''
+        max_value = self.rasters.band(in_fn).GetMaximum()
+        if max_value is None:
+            # Calculate max_value for raster images without metadata
+            window_max = lambda window: np.max(self.rasters.read_window(in_fn, window))
+            max_value = np.max(list(self.map_windows(window_max, windows, workers)))
+        return max_value
+
+    def geometric_classification_alternative(self, in_fn, n_classes, mask, fmask, workers=1):
+        '''
+        geometric classification for alternative vulnerability map
+        :param in_fn: Empirical vulnerability map [0.0,1.0] range
+        :param n_classes:number of classes
+        :param mask: mask of the non-excluded jurisdiction (binary map)
+        :param fmask: mask of the forest areas (binary map)
+        :param workers: number of threads processing the raster windows
+        :return: mask_arr: result array with mask larger than NRT
+        '''
+        windows = self.rasters.windows(in_fn)
+
+        self.progress_updated.emit(10)
+
+        max_value = self.alternative_max_value(in_fn, windows, workers)
+        risk_class = self.alternative_risk_class(n_classes)
 
         self.progress_updated.emit(30)
 
-        for i in range(n_classes):
-            upper = risk_class[i][0]
-            lower = risk_class[i][1]
-            mask_arr[(upper > mask_arr) & (mask_arr >= lower)] = i + 1
-            if i % 5 == 0:
-                progress = 40 + (10 * (i // 5))
-                self.progress_updated.emit(progress)
+        # Mask jurisdiction and forest area and classify each window
+        classify = lambda window: self.classify_alternative_window(in_fn, max_value, mask, fmask, risk_class, window)
+        mask_arr = self.merge_windows(self.rasters.size(in_fn), windows, self.map_windows(classify, windows, workers))
+        self.rasters.close()
+        self.progress_updated.emit(90)
 
         return mask_arr
 
+    def geometric_classification_alternative_streaming(self, in_fn, n_classes, mask, fmask, out_fn,
+                                                       data_type=gdal.GDT_Int16, nodata=-1, workers=1):
+        '''
+        geometric classification for alternative vulnerability map written window by window, so that peak memory is
+        bounded by the window size
+        :param in_fn: Empirical vulnerability map [0.0,1.0] range
+        :param n_classes:number of classes
+        :param mask: mask of the non-excluded jurisdiction (binary map)
+        :param fmask: mask of the forest areas (binary map)
+        :param out_fn: path to the vulnerability map to create
+        :param data_type: output data type
+        :param nodata: optional NoData value
+        :param workers: number of threads processing the raster windows
+        :return:
+        '''
+        self.progress_updated.emit(10)
+
+        max_value = self.alternative_max_value(in_fn, self.rasters.windows(in_fn), workers)
+        risk_class = self.alternative_risk_class(n_classes)
+
+        self.progress_updated.emit(30)
+
+        # Classify each window and write it straight into the output dataset, in window order
+        cols, rows = self.rasters.size(in_fn)
+        with self.rasters.writer(in_fn, out_fn, data_type, nodata) as writer:
+            windows = writer.windows()
+            classify = lambda window: self.classify_alternative_window(in_fn, max_value, mask, fmask, risk_class,
+                                                                       window)
+            for (xoff, yoff, xsize, ysize), mask_arr in zip(windows, self.map_windows(classify, windows, workers)):
+                writer.write(mask_arr, xoff, yoff)
+                self.progress_updated.emit(30 + int(60 * (yoff + ysize) / rows))
+
+        self.rasters.close()
+        self.progress_updated.emit(90)
+        return
+
     def array_to_image(self, in_fn, out_fn, data, data_type, nodata=None):
         '''
          Create image from array
@@ -226,20 +432,8 @@ class VulnerabilityMap(QObject):
         :param nodata: optional NoData value
         :return:
         '''
-        in_ds = gdal.Open(in_fn)
-        output_format = out_fn.split('.')[-1].upper()
-        if (output_format == 'TIF'):
-            output_format = 'GTIFF'
-        elif (output_format == 'RST'):
-            output_format = 'rst'
-        driver = gdal.GetDriverByName(output_format)
-        out_ds = driver.Create(out_fn, in_ds.RasterXSize, in_ds.RasterYSize, 1, data_type, options=["BigTIFF=YES"])
-        out_ds.SetProjection(in_ds.GetProjection().encode('utf-8', 'backslashreplace').decode('utf-8'))
-        out_ds.SetGeoTransform(in_ds.GetGeoTransform())
-        out_band = out_ds.GetRasterBand(1)
-        if nodata is not None:
-            out_band.SetNoDataValue(nodata)
-        out_band.WriteArray(data)
+        with self.rasters.writer(in_fn, out_fn, data_type, nodata) as writer:
+            writer.write(data)
         return
 
     def replace_ref_system(self, in_fn, out_fn):